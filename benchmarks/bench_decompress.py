@@ -0,0 +1,134 @@
+#!/usr/bin/env python
+#############################################################
+# ubi_reader/benchmarks
+# (c) 2013 Jason Pruitt (jrspruitt@gmail.com)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#############################################################
+
+"""Time decompressing data nodes with LZO, zlib and zstd
+
+Compresses synthetic UBIFS_BLOCK_SIZE text blocks the way mkfs.ubifs
+does, and times ubireader.ubifs.misc.decompress on them for each
+compression, and each installed backend of it. For zstd a new
+decompression context per block is timed too, the per thread context
+decompress uses replaced it. Best of --runs runs.
+
+    $ python benchmarks/bench_decompress.py
+    $ python benchmarks/bench_decompress.py -b 5000 -r 10
+"""
+
+import argparse
+import random
+import time
+import zlib
+
+import zstandard
+from lzallright import LZOCompressor
+
+from ubireader import settings
+from ubireader.ubifs.compression import backends
+from ubireader.ubifs.defines import *
+from ubireader.ubifs.misc import decompress
+
+WORDS = [b'root', b'bin', b'sh', b'etc', b'usr', b'lib', b'config', b'value', b'true', b'false',
+         b'0x00000000', b'ubifs', b'leb', b'peb', b'=', b'#', b'\n', b'/', b'    ']
+
+
+def compress_lzo(buf):
+    return LZOCompressor().compress(buf)
+
+
+def compress_zlib(buf):
+    c = zlib.compressobj(6, zlib.DEFLATED, -11)
+    return c.compress(buf) + c.flush()
+
+
+def compress_zstd(buf):
+    return zstandard.ZstdCompressor().compress(buf)
+
+
+COMPRESSORS = [(UBIFS_COMPR_LZO, compress_lzo), (UBIFS_COMPR_ZLIB, compress_zlib), (UBIFS_COMPR_ZSTD, compress_zstd)]
+
+
+def make_blocks(count, seed):
+    """Text-like blocks of UBIFS_BLOCK_SIZE bytes.
+
+    Arguments:
+    Int:count    -- Number of blocks.
+    Int:seed     -- Random seed.
+    """
+    r = random.Random(seed)
+    blocks = []
+    for _ in range(0, count):
+        buf = b''
+        while len(buf) < UBIFS_BLOCK_SIZE:
+            buf += r.choice(WORDS) + b' '
+        blocks.append(buf[:UBIFS_BLOCK_SIZE])
+    return blocks
+
+
+def best_of(runs, func):
+    best = None
+    for _ in range(0, runs):
+        start = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def zstd_new_context(data, unc_len):
+    return zstandard.ZstdDecompressor().decompress(data, max_output_size=unc_len)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Time data node decompression per compression and backend.')
+    parser.add_argument('-b', '--blocks', type=int, default=2000, help='Number of blocks. (default: 2000)')
+    parser.add_argument('-r', '--runs', type=int, default=5, help='Runs, the best is shown. (default: 5)')
+    parser.add_argument('--seed', type=int, default=1, help='Random seed. (default: 1)')
+    args = parser.parse_args()
+
+    blocks = make_blocks(args.blocks, args.seed)
+    total = len(blocks) * UBIFS_BLOCK_SIZE
+
+    print('%-6s %-22s %6s %10s %10s' % ('compr', 'backend', 'ratio', 'MiB/s', 'us/block'))
+    for ctype, compress in COMPRESSORS:
+        payloads = [compress(buf) for buf in blocks]
+        ratio = sum(len(p) for p in payloads) / total
+        compr = PRINT_UBIFS_COMPR[ctype]
+
+        funcs = [(b.name, b.decompress) for b in backends(ctype)]
+        if ctype == UBIFS_COMPR_ZSTD:
+            funcs.append(('new context per block', zstd_new_context))
+
+        for name, func in funcs:
+            for p, buf in zip(payloads, blocks):
+                if func(p, len(buf)) != buf:
+                    raise SystemExit('%s (%s) decompressed a block wrong' % (compr, name))
+
+            settings.decompress_backends = {compr: name}
+            if name in [b.name for b in backends(ctype)]:
+                # Through decompress, as extraction does.
+                run = lambda: [decompress(ctype, UBIFS_BLOCK_SIZE, p) for p in payloads]
+            else:
+                run = lambda: [func(p, UBIFS_BLOCK_SIZE) for p in payloads]
+
+            seconds = best_of(args.runs, run)
+            print('%-6s %-22s %6.2f %10.1f %10.1f' % (compr, name, ratio, total / seconds / 2**20,
+                                                     seconds / len(blocks) * 1e6))
+
+
+if __name__ == '__main__':
+    main()
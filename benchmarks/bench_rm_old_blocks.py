@@ -0,0 +1,163 @@
+#!/usr/bin/env python
+#############################################################
+# ubi_reader/benchmarks
+# (c) 2013 Jason Pruitt (jrspruitt@gmail.com)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#############################################################
+
+"""Time resolving old LEB copies with rm_old_blocks
+
+Builds synthetic block lists, some LEBs with several copies and some
+invalid blocks, and times ubireader.ubi.block.rm_old_blocks against
+the pairwise implementation it replaced. Both must keep the same
+blocks. The old one is quadratic, it is only run up to --old-max
+blocks.
+
+    $ python benchmarks/bench_rm_old_blocks.py
+    $ python benchmarks/bench_rm_old_blocks.py -s 1000 10000 100000 --old-max 2000
+"""
+
+import argparse
+import random
+import time
+from types import SimpleNamespace
+
+from ubireader.ubi.block import rm_old_blocks
+
+
+def old_rm_old_blocks(blocks, block_list):
+    """rm_old_blocks before grouping blocks by LEB, without logging."""
+    del_blocks = []
+
+    for i in block_list:
+        if i in del_blocks:
+            continue
+
+        if blocks[i].is_valid is not True:
+            del_blocks.append(i)
+            continue
+
+        for k in block_list:
+            if i == k:
+                continue
+
+            if k in del_blocks:
+                continue
+
+            if blocks[k].is_valid is not True:
+                del_blocks.append(k)
+                continue
+
+            if blocks[i].leb_num != blocks[k].leb_num:
+                continue
+
+            if blocks[i].ec_hdr.image_seq != blocks[k].ec_hdr.image_seq:
+                continue
+
+            second_newer = blocks[k].vid_hdr.sqnum > blocks[i].vid_hdr.sqnum
+            del_block = None
+
+            if second_newer:
+                if blocks[k].vid_hdr.copy_flag == 0:
+                    del_block = i
+            else:
+                if blocks[i].vid_hdr.copy_flag == 0:
+                    del_block = k
+
+            if del_block is not None:
+                del_blocks.append(del_block)
+                break
+
+            if second_newer:
+                if blocks[k].data_crc != blocks[k].vid_hdr.data_crc:
+                    del_block = k
+                else:
+                    del_block = i
+            else:
+                if blocks[i].data_crc != blocks[i].vid_hdr.data_crc:
+                    del_block = i
+                else:
+                    del_block = k
+
+            del_blocks.append(del_block)
+            break
+
+    return [j for j in block_list if j not in del_blocks]
+
+
+def make_blocks(count, seed, dup=0.1, invalid=0.01):
+    """Synthetic blocks keyed by PEB number and shuffled PEB list.
+
+    Arguments:
+    Int:count    -- Number of blocks.
+    Int:seed     -- Random seed.
+    Float:dup    -- Share of LEBs with extra copies.
+    Float:invalid -- Share of invalid blocks.
+    """
+    r = random.Random(seed)
+    blocks = {}
+    peb = 0
+    leb = 0
+    while peb < count:
+        copies = 1 + (r.randint(1, 3) if r.random() < dup else 0)
+        for _ in range(copies):
+            if peb >= count:
+                break
+            blocks[peb] = SimpleNamespace(
+                is_valid=r.random() > invalid, leb_num=leb, peb_num=peb,
+                ec_hdr=SimpleNamespace(image_seq=r.choice([1, 1, 1, 2])),
+                vid_hdr=SimpleNamespace(sqnum=r.randint(0, 5), copy_flag=r.randint(0, 1), data_crc=r.randint(0, 1)),
+                data_crc=r.randint(0, 1))
+            peb += 1
+        leb += 1
+
+    block_list = list(blocks)
+    r.shuffle(block_list)
+    return blocks, block_list
+
+
+def timed(func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Time rm_old_blocks on synthetic block lists.')
+    parser.add_argument('-s', '--sizes', type=int, nargs='+', default=[1000, 2000, 5000, 10000, 50000, 100000],
+                        help='Block list sizes to time.')
+    parser.add_argument('--old-max', type=int, default=5000,
+                        help='Largest list the old implementation is run on, it is quadratic. (default: 5000)')
+    parser.add_argument('--seed', type=int, default=1, help='Random seed. (default: 1)')
+    args = parser.parse_args()
+
+    print('%9s %12s %12s' % ('blocks', 'old (s)', 'new (s)'))
+    for size in args.sizes:
+        blocks, block_list = make_blocks(size, args.seed)
+        new, new_time = timed(rm_old_blocks, blocks, block_list)
+
+        if size <= args.old_max:
+            old, old_time = timed(old_rm_old_blocks, blocks, block_list)
+            if old != new:
+                raise SystemExit('Results differ for %s blocks' % size)
+            old_col = '%12.4f' % old_time
+        else:
+            old_col = '%12s' % '-'
+
+        print('%9s %s %12.4f' % (size, old_col, new_time))
+
+
+if __name__ == '__main__':
+    main()
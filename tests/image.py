@@ -0,0 +1,428 @@
+"""Small UBI and UBIFS images built from scratch for the tests."""
+
+import random
+import re
+import struct
+import zlib
+from zlib import crc32
+
+from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+
+from ubireader.ubi.defines import *
+from ubireader.ubifs.defines import *
+
+PEB_SIZE = 16 * 1024
+VID_HDR_OFFSET = 512
+DATA_OFFSET = 1024
+LEB_SIZE = PEB_SIZE - DATA_OFFSET
+
+S_IFDIR = 0o040000
+S_IFREG = 0o100000
+S_IFLNK = 0o120000
+
+
+def pack(fmt, fields, **values):
+    """Pack struct of format fmt, fields not given are zero."""
+    defaults = []
+    for count, code in re.findall(r'(\d*)([a-zA-Z?])', fmt):
+        if code == 's':
+            defaults.append(b'')
+        else:
+            defaults.extend([0] * int(count or 1))
+    args = [values.pop(name, default) for name, default in zip(fields, defaults)]
+    assert not values, 'Unknown fields %s' % list(values)
+    return struct.pack(fmt, *args)
+
+
+def _crc(buf):
+    return ~crc32(buf) & 0xFFFFFFFF
+
+
+def r5_hash(name):
+    """Kernel key_r5_hash, written out the way ubifs/key.h does it."""
+    a = 0
+    for c in struct.unpack('%sb' % len(name), name):
+        a = (a + (c << 4)) % 2**32
+        a = (a + (c >> 4)) % 2**32
+        a = (a * 11) % 2**32
+    a &= UBIFS_S_KEY_HASH_MASK
+    return a + 3 if a <= 2 else a
+
+
+def _key(ino_num, key_type, value=0):
+    return struct.pack('<II', ino_num, (key_type << UBIFS_S_KEY_BLOCK_BITS) | value)
+
+
+def node(node_type, body, sqnum=1):
+    """UBIFS node with common header."""
+    length = UBIFS_COMMON_HDR_SZ + len(body)
+    rest = struct.pack('<QIBB2s', sqnum, length, node_type, 0, b'') + body
+    return UBIFS_NODE_MAGIC + struct.pack('<I', _crc(rest)) + rest
+
+
+def compress(compr_type, buf):
+    if compr_type == UBIFS_COMPR_ZLIB:
+        c = zlib.compressobj(6, zlib.DEFLATED, -11)
+        return c.compress(buf) + c.flush()
+    elif compr_type == UBIFS_COMPR_LZO:
+        from lzallright import LZOCompressor
+        return LZOCompressor().compress(buf)
+    elif compr_type == UBIFS_COMPR_ZSTD:
+        import zstandard
+        return zstandard.ZstdCompressor().compress(buf)
+    return buf
+
+
+class ubifs_image(object):
+    """UBIFS image builder
+
+    Arguments:
+    Int:fanout     -- Branches per index node.
+    Int:key_hash   -- UBIFS_KEY_HASH_R5 or UBIFS_KEY_HASH_TEST.
+    Bin:master_key -- (optional) 64 byte fscrypt v1 key, names and file
+                      data are encrypted with it. Names are at most 16
+                      bytes then.
+
+    Entries are added with mkdir, add_file and symlink, which return
+    the inode number. build() writes superblock, master nodes, leaf
+    nodes, and the index over them.
+    """
+
+    def __init__(self, fanout=4, key_hash=UBIFS_KEY_HASH_R5, master_key=None):
+        self.fanout = fanout
+        self.key_hash = key_hash
+        self.master_key = master_key
+        self._next_ino = 64
+        self._sqnum = 0
+        self._inodes = {}
+        self._leaves = []
+        self._inodes[UBIFS_ROOT_INO] = dict(mode=S_IFDIR | 0o755, size=160, nlink=2, data=b'')
+        self._encrypt(UBIFS_ROOT_INO)
+
+    def name_hash(self, name):
+        if self.key_hash == UBIFS_KEY_HASH_TEST:
+            a = int.from_bytes(name[:4], 'little') & UBIFS_S_KEY_HASH_MASK
+            return a + 3 if a <= 2 else a
+        return r5_hash(name)
+
+    def _add(self, key, node_type, body):
+        self._sqnum += 1
+        self._leaves.append((struct.unpack('<II', key[:8]), node(node_type, body, self._sqnum)))
+
+    def _new_inode(self, mode, size=0, data=b'', encrypt=True):
+        ino_num = self._next_ino
+        self._next_ino += 1
+        self._inodes[ino_num] = dict(mode=mode, size=size, nlink=1, data=data)
+        if encrypt:
+            self._encrypt(ino_num)
+        return ino_num
+
+    def _encrypt(self, ino_num):
+        # Encryption context xattr with the nonce the key of the inode
+        # is derived from.
+        if self.master_key is None:
+            return
+
+        nonce = struct.pack('<QQ', ino_num, 0x5eed)
+        enc = Cipher(algorithms.AES(nonce), modes.ECB()).encryptor()
+        self._inodes[ino_num]['key'] = enc.update(self.master_key) + enc.finalize()
+
+        xattr_ino = self._new_inode(S_IFREG | 0o644, 28, b'\x01\x01\x04\x00' + bytes(8) + nonce, encrypt=False)
+        name = UBIFS_XATTR_NAME_ENCRYPTION_CONTEXT.encode()
+        body = pack(UBIFS_XENT_NODE_FORMAT, UBIFS_XENT_NODE_FIELDS, inum=xattr_ino, type=UBIFS_ITYPE_REG, nlen=len(name),
+                    key=_key(ino_num, UBIFS_XENT_KEY, self.name_hash(name))) + name + b'\x00'
+        self._add(body, UBIFS_XENT_NODE, body)
+
+    def _dent(self, parent, name, ino_num, itype):
+        name = name.encode() if isinstance(name, str) else name
+        if self.master_key is not None:
+            assert len(name) <= 16
+            enc = Cipher(algorithms.AES(self._inodes[parent]['key'][:32]), modes.CBC(bytes(16))).encryptor()
+            name = enc.update(name.ljust(16, b'\x00')) + enc.finalize()
+        body = pack(UBIFS_DENT_NODE_FORMAT, UBIFS_DENT_NODE_FIELDS, inum=ino_num, type=itype, nlen=len(name),
+                    key=_key(parent, UBIFS_DENT_KEY, self.name_hash(name))) + name + b'\x00'
+        self._add(body, UBIFS_DENT_NODE, body)
+
+    def mkdir(self, parent, name):
+        ino_num = self._new_inode(S_IFDIR | 0o755, 160)
+        self._inodes[ino_num]['nlink'] = 2
+        self._inodes[parent]['nlink'] += 1
+        self._dent(parent, name, ino_num, UBIFS_ITYPE_DIR)
+        return ino_num
+
+    def symlink(self, parent, name, target):
+        assert self.master_key is None
+        ino_num = self._new_inode(S_IFLNK | 0o777, len(target), target.encode())
+        self._dent(parent, name, ino_num, UBIFS_ITYPE_LNK)
+        return ino_num
+
+    def add_file(self, parent, name, content=b'', size=None, blocks=None, compr=UBIFS_COMPR_ZLIB, bad_blocks=()):
+        """Add regular file.
+
+        Arguments:
+        Int:parent      -- Inode number of directory.
+        Str:name        -- Entry name.
+        Bin:content     -- File contents, every block gets a data node.
+        Int:size        -- (optional) File size, default len(content).
+        Dict:blocks     -- (optional) Data nodes to write instead, keyed
+                           by block number, missing ones are holes.
+        Int:compr       -- Compression type, or list cycled per block.
+        List:bad_blocks -- Block numbers whose payload won't decompress.
+        """
+        if blocks is None:
+            blocks = {i: content[i * UBIFS_BLOCK_SIZE:(i + 1) * UBIFS_BLOCK_SIZE]
+                      for i in range(0, -(-len(content) // UBIFS_BLOCK_SIZE))}
+        ino_num = self._new_inode(S_IFREG | 0o644, len(content) if size is None else size)
+        comprs = compr if isinstance(compr, (list, tuple)) else [compr]
+
+        for block_num, buf in sorted(blocks.items()):
+            compr_type = comprs[block_num % len(comprs)]
+            payload = compress(compr_type, buf)
+            if block_num in bad_blocks:
+                compr_type = UBIFS_COMPR_ZLIB
+                payload = b'\xff' * len(payload)
+            plaintext_size = 0
+            if self.master_key is not None:
+                plaintext_size = len(payload)
+                enc = Cipher(algorithms.AES(self._inodes[ino_num]['key']),
+                             modes.XTS(struct.pack('<QQ', block_num, 0))).encryptor()
+                payload = enc.update(payload.ljust(max(16, -(-len(payload) // 16) * 16), b'\x00')) + enc.finalize()
+            body = pack(UBIFS_DATA_NODE_FORMAT, UBIFS_DATA_NODE_FIELDS, size=len(buf), compr_type=compr_type,
+                        plaintext_size=plaintext_size, key=_key(ino_num, UBIFS_DATA_KEY, block_num)) + payload
+            self._add(body, UBIFS_DATA_NODE, body)
+
+        self._dent(parent, name, ino_num, UBIFS_ITYPE_REG)
+        return ino_num
+
+    def _ino_nodes(self):
+        for ino_num, ino in self._inodes.items():
+            body = pack(UBIFS_INO_NODE_FORMAT, UBIFS_INO_NODE_FIELDS, key=_key(ino_num, UBIFS_INO_KEY),
+                        size=ino['size'], nlink=ino['nlink'], mode=ino['mode'], data_len=len(ino['data']),
+                        atime_sec=1700000000 + ino_num, mtime_sec=1700000000 + ino_num,
+                        ctime_sec=1700000000) + ino['data']
+            self._add(body, UBIFS_INO_NODE, body)
+
+    def build(self, seed=None):
+        """Image bytes.
+
+        Arguments:
+        Int:seed  -- (optional) Shuffle leaf nodes in the image with
+                     this seed, they are in key order otherwise.
+        """
+        leaves = list(self._leaves)
+        self._ino_nodes()
+        leaves, self._leaves = self._leaves, leaves
+        if seed is not None:
+            random.Random(seed).shuffle(leaves)
+
+        lebs = {}
+        pos = [UBIFS_MST_LNUM + 2, 0]
+
+        def put(buf):
+            buf += b'\x00' * (-len(buf) % 8)
+            if pos[1] + len(buf) > LEB_SIZE:
+                pos[0] += 1
+                pos[1] = 0
+            lebs.setdefault(pos[0], bytearray()).extend(buf)
+            pos[1] += len(buf)
+            return pos[0], pos[1] - len(buf), len(buf)
+
+        # Stable sort, entries with colliding keys keep their order.
+        branches = sorted(((key, put(buf)) for key, buf in leaves), key=lambda x: x[0])
+
+        pos[0] += 1
+        pos[1] = 0
+        level = 0
+        while True:
+            parents = []
+            for i in range(0, len(branches), self.fanout):
+                group = branches[i:i + self.fanout]
+                body = struct.pack(UBIFS_IDX_NODE_FORMAT, len(group), level)
+                for key, (lnum, offs, length) in group:
+                    body += struct.pack(UBIFS_BRANCH_FORMAT, lnum, offs, length, struct.pack('<II', *key))
+                self._sqnum += 1
+                parents.append((group[0][0], put(node(UBIFS_IDX_NODE, body, self._sqnum))))
+            branches = parents
+            level += 1
+            if len(branches) == 1:
+                break
+
+        root_lnum, root_offs, root_len = branches[0][1]
+        leb_cnt = pos[0] + 1
+        sb = pack(UBIFS_SB_NODE_FORMAT, UBIFS_SB_NODE_FIELDS, key_hash=self.key_hash, min_io_size=8,
+                  leb_size=LEB_SIZE, leb_cnt=leb_cnt, max_leb_cnt=leb_cnt, fanout=self.fanout, fmt_version=4,
+                  default_compr=UBIFS_COMPR_ZLIB, time_gran=1000000000)
+        mst = pack(UBIFS_MST_NODE_FORMAT, UBIFS_MST_NODE_FIELDS, highest_inum=self._next_ino, cmt_no=1,
+                   root_lnum=root_lnum, root_offs=root_offs, root_len=root_len, leb_cnt=leb_cnt)
+        lebs[0] = node(UBIFS_SB_NODE, sb)
+        lebs[UBIFS_MST_LNUM] = lebs[UBIFS_MST_LNUM + 1] = node(UBIFS_MST_NODE, mst)
+
+        return b''.join(bytes(lebs.get(i, b'')).ljust(LEB_SIZE, b'\xff') for i in range(0, leb_cnt))
+
+
+def open_ubifs(path, data, master_key=None):
+    """Write UBIFS image data to path and open it."""
+    from ubireader.ubi_io import ubi_file
+    from ubireader.ubifs import ubifs
+
+    path.write_bytes(data)
+    return ubifs(ubi_file(str(path), LEB_SIZE), master_key)
+
+
+def set_branch(image, lnum, offs, i, target):
+    """Point branch i of index node at lnum:offs to target (lnum, offs)."""
+    addr = lnum * LEB_SIZE + offs
+    length = struct.unpack('<I', image[addr + 16:addr + 20])[0]
+    branch = addr + UBIFS_COMMON_HDR_SZ + UBIFS_IDX_NODE_SZ + i * UBIFS_BRANCH_SZ
+    image[branch:branch + 8] = struct.pack('<II', *target)
+    image[addr + 4:addr + 8] = struct.pack('<I', _crc(bytes(image[addr + 8:addr + length])))
+
+
+def root(image):
+    """(lnum, offs) of the index root, from the master node."""
+    addr = UBIFS_MST_LNUM * LEB_SIZE + UBIFS_COMMON_HDR_SZ
+    fields = dict(zip(UBIFS_MST_NODE_FIELDS, struct.unpack(UBIFS_MST_NODE_FORMAT, image[addr:addr + UBIFS_MST_NODE_SZ])))
+    return fields['root_lnum'], fields['root_offs']
+
+
+def ec_hdr(ec=1, image_seq=1):
+    buf = pack(EC_HDR_FORMAT, EC_HDR_FIELDS, magic=UBI_EC_HDR_MAGIC, version=1, ec=ec,
+               vid_hdr_offset=VID_HDR_OFFSET, data_offset=DATA_OFFSET, image_seq=image_seq)
+    return buf[:-4] + struct.pack('>I', _crc(buf[:-4]))
+
+
+def vid_hdr(vol_id, lnum, sqnum, compat=0, copy_flag=0):
+    buf = pack(VID_HDR_FORMAT, VID_HDR_FIELDS, magic=UBI_VID_HDR_MAGIC, version=1, vol_type=UBI_VID_DYNAMIC,
+               copy_flag=copy_flag, compat=compat, vol_id=vol_id, lnum=lnum, sqnum=sqnum)
+    return buf[:-4] + struct.pack('>I', _crc(buf[:-4]))
+
+
+def peb(ec, vid=None, data=b''):
+    """PEB with EC header, VID header if mapped, and LEB data."""
+    buf = bytearray(b'\xff' * PEB_SIZE)
+    buf[0:UBI_EC_HDR_SZ] = ec
+    if vid is not None:
+        buf[VID_HDR_OFFSET:VID_HDR_OFFSET + UBI_VID_HDR_SZ] = vid
+        buf[DATA_OFFSET:DATA_OFFSET + len(data)] = data
+    return bytes(buf)
+
+
+def vtbl(volumes):
+    """Volume table of [(name, reserved LEBs)]."""
+    buf = b''
+    for i in range(0, min(UBI_MAX_VOLUMES, LEB_SIZE // UBI_VTBL_REC_SZ)):
+        rec = b''
+        if i < len(volumes):
+            name, reserved = volumes[i]
+            rec = pack(VTBL_REC_FORMAT, VTBL_REC_FIELDS, reserved_pebs=reserved, alignment=1,
+                       vol_type=UBI_VID_DYNAMIC, name_len=len(name), name=name)
+        rec = rec[:-4] if rec else bytes(UBI_VTBL_REC_SZ - 4)
+        buf += rec + struct.pack('>I', _crc(rec))
+    return buf
+
+
+def split_lebs(image):
+    return [image[i:i + LEB_SIZE] for i in range(0, len(image), LEB_SIZE)]
+
+
+def ubi_image(volumes, image_seq=1, free_pebs=2, stale=()):
+    """UBI image bytes.
+
+    Arguments:
+    List:volumes  -- [(name, UBIFS image bytes)], name is bytes.
+    Int:image_seq -- Image sequence number of all PEBs.
+    Int:free_pebs -- Erased PEBs at the end.
+    List:stale    -- (vol_id, lnum) to also write an older copy of,
+                     with different data, before the current one.
+    """
+    sqnum = 1
+    layout = vtbl([(name, len(split_lebs(data)) + 2) for name, data in volumes])
+    pebs = []
+    for lnum in range(0, 2):
+        pebs.append(peb(ec_hdr(image_seq=image_seq), vid_hdr(UBI_INTERNAL_VOL_START, lnum, sqnum, compat=5), layout))
+        sqnum += 1
+
+    for vol_id, (name, data) in enumerate(volumes):
+        for lnum, leb in enumerate(split_lebs(data)):
+            if (vol_id, lnum) in stale:
+                pebs.append(peb(ec_hdr(image_seq=image_seq), vid_hdr(vol_id, lnum, sqnum), b'\xaa' * LEB_SIZE))
+                sqnum += 1
+            pebs.append(peb(ec_hdr(image_seq=image_seq), vid_hdr(vol_id, lnum, sqnum), leb))
+            sqnum += 1
+
+    pebs.extend(peb(ec_hdr(image_seq=image_seq)) for _ in range(0, free_pebs))
+    return b''.join(pebs)
+
+
+def fastmap_image(volumes, stale=(), garbage=4, free_pool=2, bad_crc=False):
+    """UBI image with a fastmap.
+
+    Arguments:
+    List:volumes   -- [(name, UBIFS image bytes)], name is bytes.
+    List:stale     -- (vol_id, lnum) the EBA table maps to an old copy,
+                      the current copy is in a pool PEB written after
+                      the fastmap.
+    Int:garbage    -- Old copies of LEBs of volume 0 the fastmap
+                      doesn't list.
+    Int:free_pool  -- Erased pool PEBs.
+    Bool:bad_crc   -- Write a wrong fastmap data CRC.
+
+    Returns:
+    Bytes          -- Image.
+    """
+    sqnum = 1
+    layout = vtbl([(name, len(split_lebs(data)) + 2) for name, data in volumes])
+    pebs = []
+    eba = {UBI_INTERNAL_VOL_START: []}
+    for lnum in range(0, 2):
+        eba[UBI_INTERNAL_VOL_START].append(len(pebs))
+        pebs.append(peb(ec_hdr(), vid_hdr(UBI_INTERNAL_VOL_START, lnum, sqnum, compat=5), layout))
+        sqnum += 1
+
+    anchor = len(pebs)
+    pebs.append(None)
+
+    for i in range(0, garbage):
+        pebs.append(peb(ec_hdr(), vid_hdr(0, i, 0), b'\xbb' * LEB_SIZE))
+
+    pool = []
+    current = []
+    for vol_id, (name, data) in enumerate(volumes):
+        lebs = split_lebs(data)
+        eba[vol_id] = [UBI_FM_UNMAPPED] * (len(lebs) + 2)
+        for lnum, leb in enumerate(lebs):
+            eba[vol_id][lnum] = len(pebs)
+            if (vol_id, lnum) in stale:
+                pebs.append(peb(ec_hdr(), vid_hdr(vol_id, lnum, sqnum), b'\xaa' * LEB_SIZE))
+                current.append((vol_id, lnum, leb))
+            else:
+                pebs.append(peb(ec_hdr(), vid_hdr(vol_id, lnum, sqnum), leb))
+            sqnum += 1
+
+    fm_sqnum = sqnum
+    sqnum += 1
+    for vol_id, lnum, leb in current:
+        pool.append(len(pebs))
+        pebs.append(peb(ec_hdr(), vid_hdr(vol_id, lnum, sqnum), leb))
+        sqnum += 1
+    for _ in range(0, free_pool):
+        pool.append(len(pebs))
+        pebs.append(peb(ec_hdr()))
+
+    def pool_buf(pebs):
+        return pack(FM_POOL_FORMAT, FM_POOL_FIELDS, magic=UBI_FM_POOL_MAGIC, size=len(pebs), max_size=16,
+                    pebs=struct.pack('>%sI' % len(pebs), *pebs))
+
+    data = pack(FM_SB_FORMAT, FM_SB_FIELDS, magic=UBI_FM_SB_MAGIC, version=UBI_FM_FMT_VERSION, used_blocks=1,
+                block_loc=struct.pack('>I', anchor), sqnum=fm_sqnum)
+    data += pack(FM_HDR_FORMAT, FM_HDR_FIELDS, magic=UBI_FM_HDR_MAGIC, vol_count=len(eba))
+    data += pool_buf(pool[:1]) + pool_buf(pool[1:])
+    for vol_id, table in eba.items():
+        data += pack(FM_VHDR_FORMAT, FM_VHDR_FIELDS, magic=UBI_FM_VHDR_MAGIC, vol_id=vol_id, vol_type=UBI_VID_DYNAMIC)
+        data += pack(FM_EBA_FORMAT, FM_EBA_FIELDS, magic=UBI_FM_EBA_MAGIC, reserved_pebs=len(table))
+        data += struct.pack('>%sI' % len(table), *table)
+
+    data = bytearray(data.ljust(LEB_SIZE, b'\x00'))
+    data[8:12] = struct.pack('>I', _crc(bytes(data)) ^ (1 if bad_crc else 0))
+    pebs[anchor] = peb(ec_hdr(), vid_hdr(UBI_FM_SB_VOLUME_ID, 0, fm_sqnum, compat=5), bytes(data))
+    return b''.join(pebs)
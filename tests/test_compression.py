@@ -0,0 +1,102 @@
+import sys
+
+import pytest
+
+from ubireader import settings
+from ubireader.scripts import ubireader_extract_files
+from ubireader.ubifs import compression
+from ubireader.ubifs.defines import *
+from ubireader.ubifs.misc import decompress
+
+from image import compress
+
+BLOCK = b''.join(b'%05d block data, ' % i for i in range(0, 240))[:UBIFS_BLOCK_SIZE]
+
+
+@pytest.fixture(autouse=True)
+def backends(monkeypatch):
+    # Fakes registered by tests are dropped afterwards.
+    monkeypatch.setattr(compression, '_backends', {k: list(v) for k, v in compression._backends.items()})
+    monkeypatch.setattr(settings, 'decompress_backends', {})
+
+
+@pytest.mark.parametrize('ctype', [UBIFS_COMPR_LZO, UBIFS_COMPR_ZLIB, UBIFS_COMPR_ZSTD])
+def test_installed_backends(ctype):
+    # Optional ones, e.g. lzo and isal, are tested when installed.
+    data = compress(ctype, BLOCK)
+    assert compression.backends(ctype)
+    for b in compression.backends(ctype):
+        assert b.decompress(data, len(BLOCK)) == BLOCK
+
+
+def test_register_priority():
+    default = compression.get_backend(UBIFS_COMPR_ZLIB)
+    fake = compression.register(UBIFS_COMPR_ZLIB, 'fake', lambda data, unc_len: b'fake')
+
+    assert compression.get_backend(UBIFS_COMPR_ZLIB) is fake
+    assert compression.backends(UBIFS_COMPR_ZLIB)[0] is fake
+    assert default in compression.backends(UBIFS_COMPR_ZLIB)
+    assert decompress(UBIFS_COMPR_ZLIB, 4, b'') == b'fake'
+
+    assert compression.get_backend(UBIFS_COMPR_NONE) is None
+    assert compression.get_backend(99) is None
+
+
+def test_settings_select_backend(monkeypatch):
+    default = compression.get_backend(UBIFS_COMPR_ZLIB)
+    fake = compression.register(UBIFS_COMPR_ZLIB, 'fake', lambda data, unc_len: b'fake')
+
+    monkeypatch.setattr(settings, 'decompress_backends', {'zlib': default.name})
+    assert compression.get_backend(UBIFS_COMPR_ZLIB) is default
+    # Unknown names fall back to the preferred backend.
+    monkeypatch.setattr(settings, 'decompress_backends', {'zlib': 'missing'})
+    assert compression.get_backend(UBIFS_COMPR_ZLIB) is fake
+    monkeypatch.setattr(settings, 'decompress_backends', {'lzo': 'fake'})
+    assert compression.get_backend(UBIFS_COMPR_ZLIB) is fake
+    assert compression.get_backend(UBIFS_COMPR_LZO).name != 'fake'
+
+
+def test_stats():
+    calls = []
+
+    def func(data, unc_len):
+        calls.append(unc_len)
+        return data * 2
+
+    fake = compression.register(UBIFS_COMPR_ZSTD, 'fake', func)
+    assert not [s for s in compression.stats() if s['name'] == 'fake']
+
+    assert fake.decompress(b'abc', 6) == b'abcabc'
+    assert decompress(UBIFS_COMPR_ZSTD, 10, b'hello') == b'hellohello'
+    assert calls == [6, 10]
+
+    stats = [s for s in compression.stats() if s['name'] == 'fake']
+    assert len(stats) == 1
+    assert stats[0]['compr'] == 'zstd'
+    assert (stats[0]['calls'], stats[0]['in_bytes'], stats[0]['out_bytes']) == (2, 8, 16)
+    assert stats[0]['seconds'] >= 0
+
+
+@pytest.mark.parametrize('arg, message', [('zlib=missing', 'not available for zlib'),
+                                          ('gzip=zlib', 'Unknown compression gzip')])
+def test_cli_backend_checked(monkeypatch, capsys, arg, message):
+    # main() sets all of them from its arguments.
+    for name, value in vars(settings).items():
+        if not name.startswith('_'):
+            monkeypatch.setattr(settings, name, value)
+    monkeypatch.setattr(sys, 'argv', ['ubireader_extract_files', '-B', arg, 'image'])
+    with pytest.raises(SystemExit):
+        ubireader_extract_files.main()
+    assert message in capsys.readouterr().err
+
+
+@pytest.mark.parametrize('content_size', [True, False], ids=['content_size', 'no_content_size'])
+def test_zstd_frame(content_size):
+    import zstandard
+
+    data = zstandard.ZstdCompressor(write_content_size=content_size).compress(BLOCK)
+    assert zstandard.get_frame_parameters(data).content_size == (len(BLOCK) if content_size else zstandard.CONTENTSIZE_UNKNOWN)
+    assert decompress(UBIFS_COMPR_ZSTD, len(BLOCK), data) == BLOCK
+    # Short last block of a file.
+    data = zstandard.ZstdCompressor(write_content_size=content_size).compress(BLOCK[:100])
+    assert decompress(UBIFS_COMPR_ZSTD, 100, data) == BLOCK[:100]
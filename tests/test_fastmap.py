@@ -0,0 +1,97 @@
+import pytest
+
+from ubireader import settings
+from ubireader.ubi import ubi
+from ubireader.ubi import fastmap
+from ubireader.ubi_io import ubi_file
+from ubireader.ubifs.defines import *
+
+from image import PEB_SIZE, fastmap_image, ubifs_image
+
+STALE = [(0, 3), (1, 4)]
+
+
+def _ubifs(files):
+    b = ubifs_image()
+    for i in range(0, files):
+        b.add_file(UBIFS_ROOT_INO, 'file%02d' % i, b'%02d' % i * 3000)
+    return b.build()
+
+
+VOLUMES = [(b'rootfs', _ubifs(8)), (b'data', _ubifs(12))]
+
+
+def _open(path, data):
+    path.write_bytes(data)
+    return ubi(ubi_file(str(path), PEB_SIZE))
+
+
+def _volumes(image):
+    return {name: (sorted(vol.block_list), b''.join(vol.reader(image)))
+            for img in image.images for name, vol in img.volumes.items()}
+
+
+@pytest.fixture(autouse=True)
+def no_scan_index(monkeypatch):
+    monkeypatch.setattr(settings, 'use_scan_index', False)
+
+
+def _attach(tmp_path, monkeypatch, data):
+    monkeypatch.setattr(settings, 'use_fastmap', False)
+    scanned = _open(tmp_path / 'scan.ubi', data)
+    monkeypatch.setattr(settings, 'use_fastmap', True)
+    attached = _open(tmp_path / 'fm.ubi', data)
+    return scanned, attached
+
+
+def test_fastmap_matches_scan(tmp_path, monkeypatch):
+    scanned, attached = _attach(tmp_path, monkeypatch, fastmap_image(VOLUMES))
+
+    assert not scanned.from_fastmap
+    assert attached.from_fastmap
+    assert _volumes(attached) == _volumes(scanned)
+    # Garbage old copies are not read.
+    assert len(attached.blocks) < len(scanned.blocks)
+
+    for name, data in VOLUMES:
+        assert _volumes(attached)[name.decode()][1] == data
+
+
+def test_bad_crc_falls_back_to_scan(tmp_path, monkeypatch):
+    data = fastmap_image(VOLUMES, bad_crc=True)
+    path = tmp_path / 'bad.ubi'
+    path.write_bytes(data)
+    ufile = ubi_file(str(path), PEB_SIZE)
+    anchor = fastmap.find_anchor(ufile)
+    assert anchor == 2
+    assert not fastmap.fastmap(ufile, anchor).is_valid
+    ufile.close()
+
+    scanned, attached = _attach(tmp_path, monkeypatch, data)
+    assert not attached.from_fastmap
+    assert len(attached.blocks) == len(scanned.blocks)
+    assert _volumes(attached) == _volumes(scanned)
+
+
+def test_stale_eba_uses_pool(tmp_path, monkeypatch):
+    data = fastmap_image(VOLUMES, stale=STALE)
+    scanned, attached = _attach(tmp_path, monkeypatch, data)
+
+    assert attached.from_fastmap
+    assert _volumes(attached) == _volumes(scanned)
+
+    path = tmp_path / 'fm.ubi'
+    ufile = ubi_file(str(path), PEB_SIZE)
+    fm = fastmap.fastmap(ufile, fastmap.find_anchor(ufile))
+    ufile.close()
+    for vol_id, lnum in STALE:
+        stale_peb = fm.eba[vol_id][lnum]
+        # The EBA table has the old copy, the newer pool PEB replaces it.
+        assert stale_peb not in _volumes(attached)[VOLUMES[vol_id][0].decode()][0]
+        pool_pebs = [p for p in fm.pools if attached.blocks[p].leb_num == lnum
+                     and attached.blocks[p].vid_hdr and attached.blocks[p].vid_hdr.vol_id == vol_id]
+        assert len(pool_pebs) == 1
+        assert pool_pebs[0] in _volumes(attached)[VOLUMES[vol_id][0].decode()][0]
+
+    for name, ubifs in VOLUMES:
+        assert _volumes(attached)[name.decode()][1] == ubifs
@@ -0,0 +1,59 @@
+from types import SimpleNamespace
+
+from ubireader import settings
+from ubireader.ubi_io import ubi_file
+from ubireader.ubifs.defines import *
+from ubireader.ubifs.misc import iter_reg_file
+
+
+def test_iter_reg_file_mmap_uncompressed_short_block(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, 'use_mmap', True)
+
+    payload = b'short uncompressed block'
+    path = tmp_path / 'image.bin'
+    path.write_bytes(payload + b'\xff' * (UBIFS_BLOCK_SIZE - len(payload)))
+
+    ufile = ubi_file(str(path), UBIFS_BLOCK_SIZE)
+    try:
+        assert isinstance(ufile.read_at(0, len(payload)), memoryview)
+
+        data = SimpleNamespace(key={'khash': UBIFS_DATA_KEY << UBIFS_S_KEY_BLOCK_BITS},
+                               compr_type=UBIFS_COMPR_NONE, size=len(payload),
+                               offset=0, compr_len=len(payload))
+        inode = {'ino': SimpleNamespace(size=UBIFS_BLOCK_SIZE + 10, key={'ino_num': 65}),
+                 'data': [data]}
+        ubifs = SimpleNamespace(file=ufile, master_key=None)
+
+        out = b''.join(iter_reg_file(ubifs, inode, 'file', {65: inode}))
+    finally:
+        ufile.close()
+
+    assert out == payload + bytes(UBIFS_BLOCK_SIZE + 10 - len(payload))
+
+
+def test_decode_iter_threads_share_pool(monkeypatch):
+    import threading
+    import zlib
+    from ubireader.ubifs import misc
+
+    monkeypatch.setattr(misc, '_pools', {})
+    monkeypatch.setattr(settings, 'decompress_workers', 2)
+
+    block = b'block data ' * 300
+    c = zlib.compressobj(6, zlib.DEFLATED, -11)
+    payload = c.compress(block) + c.flush()
+    data = SimpleNamespace(compr_type=UBIFS_COMPR_ZLIB, size=len(block))
+
+    results = []
+    def run():
+        out = list(misc.decode_iter((i, data, payload, None) for i in range(200)))
+        results.append(out == [(i, block) for i in range(200)])
+
+    threads = [threading.Thread(target=run) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert results == [True] * 8
+    assert list(misc._pools) == [(2, False)]
@@ -0,0 +1,135 @@
+import os
+import threading
+from types import SimpleNamespace
+
+import pytest
+
+from ubireader import settings
+from ubireader.ubifs.defines import *
+from ubireader.ubifs.output import extract_files, extract_plan
+
+from image import LEB_SIZE, open_ubifs, ubifs_image
+
+BS = UBIFS_BLOCK_SIZE
+
+
+def _item(offset, compr_len):
+    return (offset, 0, 0, SimpleNamespace(offset=offset, compr_len=compr_len))
+
+
+def _runs(items, **limits):
+    plan = extract_plan(SimpleNamespace(leb_size=LEB_SIZE), {})
+    for name, value in limits.items():
+        setattr(plan, name, value)
+    return [[item[0] for item in run] for run in plan._runs(items)]
+
+
+def test_runs_adjacent():
+    assert _runs([_item(0, 100), _item(100, 50), _item(150, 10)]) == [[0, 100, 150]]
+    assert _runs([]) == []
+
+
+def test_runs_gap():
+    items = [_item(0, 100), _item(100 + 64, 100), _item(264 + 65, 100)]
+    assert _runs(items, max_gap=64) == [[0, 164], [329]]
+    assert _runs(items, max_gap=65) == [[0, 164, 329]]
+
+
+def test_runs_leb_boundary():
+    items = [_item(LEB_SIZE - 200, 100), _item(LEB_SIZE - 100, 100), _item(LEB_SIZE, 100)]
+    assert _runs(items) == [[LEB_SIZE - 200, LEB_SIZE - 100], [LEB_SIZE]]
+
+
+def test_runs_max_read():
+    items = [_item(i * 100, 100) for i in range(0, 10)]
+    assert _runs(items, max_read=300) == [[0, 100, 200], [300, 400, 500], [600, 700, 800], [900]]
+    assert _runs(items, max_read=1000) == [[i * 100 for i in range(0, 10)]]
+
+
+def test_runs_overlap():
+    # Nodes at the same or an overlapping offset are read separately.
+    items = [_item(0, 100), _item(0, 100), _item(50, 100), _item(150, 10)]
+    assert _runs(items) == [[0], [0], [50, 150]]
+
+
+def _image(tmp_path):
+    b = ubifs_image()
+    compr = [UBIFS_COMPR_ZLIB, UBIFS_COMPR_LZO, UBIFS_COMPR_ZSTD, UBIFS_COMPR_NONE]
+    for d in range(0, 3):
+        parent = b.mkdir(UBIFS_ROOT_INO, 'dir%s' % d)
+        for i in range(0, 8):
+            content = bytes((i * 7 + j) % 256 for j in range(0, 1000)) * (i * 3 + 1)
+            b.add_file(parent, 'file%s' % i, content, compr=compr[i % 4:] + compr[:i % 4])
+        b.add_file(parent, 'sparse', size=6 * BS, blocks={1: b'x' * BS, 3: b'y' * 10, 4: bytes(BS)})
+        b.add_file(parent, 'empty')
+        b.symlink(parent, 'link', 'file1')
+    # Damaged blocks, later blocks are good.
+    b.add_file(UBIFS_ROOT_INO, 'bad', b'bad!' * (6 * BS // 4), bad_blocks=[2, 4])
+    b.add_file(UBIFS_ROOT_INO, 'bad_first', b'ok' * BS, bad_blocks=[0])
+    return open_ubifs(tmp_path / 'ubifs.img', b.build(seed=5))
+
+
+def _extract(ubifs, path):
+    os.mkdir(path)
+    extract_files(ubifs, str(path))
+    tree = {}
+    for root, dirs, files in os.walk(path):
+        for name in dirs + files:
+            p = os.path.join(root, name)
+            st = os.lstat(p)
+            if os.path.islink(p):
+                content = os.readlink(p)
+            elif os.path.isdir(p):
+                content = None
+            else:
+                with open(p, 'rb') as f:
+                    content = f.read()
+            tree[os.path.relpath(p, path)] = (st.st_mode, st.st_size, st.st_mtime, content)
+    return tree
+
+
+@pytest.mark.parametrize('sparse', [True, False], ids=['sparse', 'full'])
+def test_physical_order_matches_serial(tmp_path, monkeypatch, sparse):
+    monkeypatch.setattr(settings, 'use_sparse_files', sparse)
+    ubifs = _image(tmp_path)
+    serial = _extract(ubifs, tmp_path / 'serial')
+
+    monkeypatch.setattr(settings, 'extract_physical_order', True)
+    physical = _extract(ubifs, tmp_path / 'physical')
+
+    assert len(serial) == 3 * 12 + 2
+    assert physical == serial
+    assert serial['bad'][3] == b'bad!' * (2 * BS // 4) + bytes(4 * BS)
+    assert serial['bad_first'][3] == bytes(2 * BS)
+
+
+@pytest.mark.parametrize('workers', [1, 4])
+def test_workers_match_serial(tmp_path, monkeypatch, workers):
+    ubifs = _image(tmp_path)
+    serial = _extract(ubifs, tmp_path / 'serial')
+
+    monkeypatch.setattr(settings, 'extract_workers', workers)
+    threaded = _extract(ubifs, tmp_path / 'threaded')
+
+    assert threaded == serial
+
+
+def test_workers_stop_on_error(tmp_path, monkeypatch, capsys):
+    from ubireader.ubifs import output
+
+    monkeypatch.setattr(settings, 'extract_workers', 2)
+    extract_dents = output.extract_dents
+    calls = []
+
+    def failing(*args):
+        calls.append(args[2].name)
+        if len(calls) == 2:
+            raise Exception('failed on purpose')
+        extract_dents(*args)
+
+    monkeypatch.setattr(output, 'extract_dents', failing)
+    os.mkdir(tmp_path / 'out')
+    extract_files(_image(tmp_path), str(tmp_path / 'out'))
+
+    assert 'failed on purpose' in capsys.readouterr().out
+    assert not [t for t in threading.enumerate() if t.name.startswith('extract')]
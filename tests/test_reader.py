@@ -0,0 +1,108 @@
+import io
+import os
+
+import pytest
+
+from ubireader.ubifs.defines import *
+
+from image import open_ubifs, ubifs_image
+
+BS = UBIFS_BLOCK_SIZE
+MASTER_KEY = bytes(range(64))
+
+CONTENT = bytes(i % 251 for i in range(3 * BS + 1000))
+
+# Block 1 is a hole, block 2 is short, the file ends inside the hole
+# after block 3.
+SPARSE_BLOCKS = {0: b'A' * BS, 2: b'B' * 100, 3: b'C' * BS}
+SPARSE_SIZE = 5 * BS + 10
+SPARSE = b'A' * BS + bytes(BS) + b'B' * 100 + bytes(BS - 100) + b'C' * BS + bytes(BS + 10)
+
+
+def _build(tmp_path, master_key=None):
+    b = ubifs_image(fanout=3, master_key=master_key)
+    etc = b.mkdir(UBIFS_ROOT_INO, 'etc')
+    b.add_file(etc, 'data', CONTENT, compr=[UBIFS_COMPR_ZLIB, UBIFS_COMPR_LZO, UBIFS_COMPR_NONE])
+    b.add_file(etc, 'sparse', size=SPARSE_SIZE, blocks=SPARSE_BLOCKS)
+    b.add_file(etc, 'empty')
+    b.mkdir(UBIFS_ROOT_INO, 'nothing')
+    if master_key is None:
+        b.symlink(UBIFS_ROOT_INO, 'link', 'etc/data')
+    return open_ubifs(tmp_path / 'ubifs.img', b.build(seed=3), master_key)
+
+
+@pytest.fixture(params=[None, MASTER_KEY], ids=['plain', 'encrypted'])
+def ubifs(request, tmp_path):
+    return _build(tmp_path, request.param)
+
+
+def test_read_all(ubifs):
+    assert ubifs.open('/etc/data').read() == CONTENT
+    assert ubifs.open('etc/sparse').read() == SPARSE
+    assert ubifs.open('etc/empty').read() == b''
+
+
+@pytest.mark.parametrize('path, expected', [('etc/data', CONTENT), ('etc/sparse', SPARSE)], ids=['data', 'sparse'])
+def test_seek_read(ubifs, path, expected):
+    f = ubifs.open(path)
+    assert f.name == path
+    assert f.seekable() and f.readable()
+
+    # Across block boundaries, into holes and short blocks.
+    for pos, size in [(0, 10), (BS - 5, 10), (BS - 1, BS + 2), (2 * BS + 90, 20),
+                      (100, 3 * BS), (3 * BS + 999, 5), (len(expected) - 3, 3)]:
+        assert f.seek(pos) == pos
+        assert f.read(size) == expected[pos:pos + size]
+        assert f.tell() == min(pos + size, len(expected))
+
+    assert f.seek(-10, os.SEEK_END) == len(expected) - 10
+    assert f.read() == expected[-10:]
+    f.seek(BS)
+    assert f.seek(-20, os.SEEK_CUR) == BS - 20
+    assert f.read(40) == expected[BS - 20:BS + 20]
+
+
+def test_read_eof(ubifs):
+    f = ubifs.open('etc/data')
+    f.seek(len(CONTENT))
+    assert f.read(10) == b''
+    f.seek(len(CONTENT) + 100)
+    assert f.read() == b''
+    assert f.tell() == len(CONTENT) + 100
+
+    f.seek(len(CONTENT) - 4)
+    buf = bytearray(10)
+    assert f.readinto(buf) == 4
+    assert bytes(buf[:4]) == CONTENT[-4:]
+
+
+def test_seek_invalid(ubifs):
+    f = ubifs.open('etc/data')
+    with pytest.raises(ValueError):
+        f.seek(-1)
+    with pytest.raises(ValueError):
+        f.seek(0, 3)
+
+
+def test_buffered(ubifs):
+    f = io.BufferedReader(ubifs.open('etc/data'), buffer_size=1000)
+    assert b''.join(iter(lambda: f.read(777), b'')) == CONTENT
+
+
+@pytest.mark.parametrize('path', ['nope', 'etc/nope', 'nothing/nope', 'etc/data/x', 'etc/empty/x/y'])
+def test_open_missing(ubifs, path):
+    with pytest.raises(FileNotFoundError):
+        ubifs.open(path)
+
+
+@pytest.mark.parametrize('path', ['/', 'etc', 'nothing/'])
+def test_open_dir(ubifs, path):
+    with pytest.raises(IsADirectoryError):
+        ubifs.open(path)
+
+
+def test_open_symlink(tmp_path):
+    ubifs = _build(tmp_path)
+    with pytest.raises(OSError) as e:
+        ubifs.open('link')
+    assert type(e.value) is OSError
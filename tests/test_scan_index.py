@@ -0,0 +1,154 @@
+import os
+import sqlite3
+
+import pytest
+
+from ubireader import scan_index, settings
+from ubireader.ubi import ubi
+from ubireader.ubi_io import ubi_file
+from ubireader.ubifs.defines import *
+
+from image import PEB_SIZE, ubi_image, ubifs_image
+
+HEADERS = [(0, b'\x01' * 128), (PEB_SIZE, b'\x02' * 128)]
+SCAN = (0, 2 * PEB_SIZE, PEB_SIZE)
+
+
+@pytest.fixture(autouse=True)
+def enabled(monkeypatch):
+    monkeypatch.setattr(scan_index, '_indexes', {})
+    monkeypatch.setattr(settings, 'use_scan_index', True)
+    monkeypatch.setattr(settings, 'scan_index_path', None)
+
+
+@pytest.fixture
+def image(tmp_path):
+    path = tmp_path / 'image.bin'
+    path.write_bytes(bytes(range(256)) * 1024)
+    return path
+
+
+def _store(path):
+    index = scan_index.scan_index(str(path), str(path) + scan_index.SCAN_INDEX_SUFFIX)
+    index.put_param('peb_size', PEB_SIZE)
+    index.put_blocks(*SCAN, HEADERS)
+    index.put_volumes(*SCAN, 1, {0: [3, 1, 2], 1: []})
+    index.close()
+
+
+def _load(path):
+    index = scan_index.scan_index(str(path), str(path) + scan_index.SCAN_INDEX_SUFFIX)
+    try:
+        return index.get_param('peb_size'), index.get_blocks(*SCAN), index.get_volumes(*SCAN, 1)
+    finally:
+        index.close()
+
+
+def test_hit_miss(image, monkeypatch):
+    assert _load(image) == (None, None, None)
+    _store(image)
+    assert _load(image) == (PEB_SIZE, HEADERS, {0: [3, 1, 2], 1: []})
+
+    index = scan_index.scan_index(str(image), str(image) + scan_index.SCAN_INDEX_SUFFIX)
+    assert index.get_blocks(0, 2 * PEB_SIZE, PEB_SIZE // 2) is None
+    assert index.get_volumes(*SCAN, 2) is None
+    # Volume lists depend on how blocks are resolved.
+    monkeypatch.setattr(settings, 'uboot_fix', not settings.uboot_fix)
+    assert index.get_volumes(*SCAN, 1) is None
+    index.close()
+
+
+def _grow(path):
+    with open(path, 'ab') as f:
+        f.write(b'\x00')
+
+
+def _touch(path):
+    st = os.stat(path)
+    os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns + 1000000000))
+
+
+def _sample(path):
+    # Same size and mtime, a byte in the first sample changed.
+    st = os.stat(path)
+    with open(path, 'r+b') as f:
+        f.write(b'\xff')
+    os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns))
+
+
+@pytest.mark.parametrize('change', [_grow, _touch, _sample], ids=['size', 'mtime', 'sample'])
+def test_invalidate_on_change(image, change):
+    _store(image)
+    key = scan_index.file_key(str(image))
+    change(image)
+    assert scan_index.file_key(str(image)) != key
+    assert _load(image) == (None, None, None)
+
+
+def test_version_bump(image, monkeypatch):
+    _store(image)
+    monkeypatch.setattr(scan_index, 'SCAN_INDEX_VERSION', scan_index.SCAN_INDEX_VERSION + 1)
+    assert _load(image) == (None, None, None)
+
+
+def test_open_scan_index(image, monkeypatch):
+    index = scan_index.open_scan_index(str(image))
+    assert index is not None
+    assert scan_index.open_scan_index(str(image)) is index
+    assert os.path.exists(str(image) + scan_index.SCAN_INDEX_SUFFIX)
+    index.close()
+
+    monkeypatch.setattr(settings, 'use_scan_index', False)
+    assert scan_index.open_scan_index(str(image)) is None
+
+
+def test_corrupt_db(image, capsys):
+    index_path = str(image) + scan_index.SCAN_INDEX_SUFFIX
+    with open(index_path, 'wb') as f:
+        f.write(b'not a database' * 1000)
+
+    assert scan_index.open_scan_index(str(image)) is None
+    assert 'Scan index %s disabled' % index_path in capsys.readouterr().out
+
+
+def test_locked_db(image, monkeypatch, capsys):
+    monkeypatch.setattr(scan_index, 'BUSY_TIMEOUT', 0.05)
+    _store(image)
+    index = scan_index.open_scan_index(str(image))
+
+    lock = sqlite3.connect(str(image) + scan_index.SCAN_INDEX_SUFFIX)
+    lock.execute('BEGIN EXCLUSIVE')
+    try:
+        # Open index degrades to misses, opening a new one fails.
+        assert index.get_blocks(*SCAN) is None
+        assert index.get_param('peb_size') is None
+        index.put_param('leb_size', 1)
+        monkeypatch.setattr(scan_index, '_indexes', {})
+        assert scan_index.open_scan_index(str(image)) is None
+    finally:
+        lock.rollback()
+        lock.close()
+
+    out = capsys.readouterr().out
+    assert 'loading block headers failed' in out
+    assert 'disabled' in out
+    assert index.get_blocks(*SCAN) == HEADERS
+    index.close()
+
+
+def test_ubi_uses_stored_blocks(tmp_path, monkeypatch):
+    b = ubifs_image()
+    b.add_file(UBIFS_ROOT_INO, 'file', b'data' * 5000)
+    path = tmp_path / 'image.ubi'
+    path.write_bytes(ubi_image([(b'rootfs', b.build())]))
+
+    first = ubi(ubi_file(str(path), PEB_SIZE))
+    scanned = scan_index.open_scan_index(str(path)).get_blocks(0, os.path.getsize(path), PEB_SIZE)
+    assert len(scanned) == len(first.blocks)
+
+    # Reads come from the stored headers now, not the file.
+    monkeypatch.setattr('ubireader.ubi.block._scan_blocks', None)
+    second = ubi(ubi_file(str(path), PEB_SIZE))
+    assert sorted(second.blocks) == sorted(first.blocks)
+    assert {name: vol.block_list for name, vol in second.images[0].volumes.items()} == \
+           {name: vol.block_list for name, vol in first.images[0].volumes.items()}
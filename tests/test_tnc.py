@@ -0,0 +1,158 @@
+from types import SimpleNamespace
+
+import pytest
+
+from ubireader.ubifs import tnc, walk
+from ubireader.ubifs.defines import *
+from ubireader.ubifs.list import find_dir
+
+from image import open_ubifs, r5_hash, ubifs_image
+
+# From key_r5_hash and key_test_hash of the kernel's fs/ubifs/key.h,
+# compiled and run on a little endian machine.
+KERNEL_HASHES = [
+    # name, r5, test
+    (b'', 3, 3),
+    (b'\x01', 176, 4),
+    (b'a', 17138, 97),
+    (b'al', 207592, 27745),
+    (b'ba', 207592, 24930),
+    (b'etc', 2401795, 6517861),
+    (b'passwd', 246479406, 326328688),
+    (b'lost+found', 467132283, 343109484),
+    (b'libc.so.6', 319340834, 56781164),
+    (b'ABCDEFGH', 123260672, 71516737),
+    ('\xe9t\xe9'.encode(), 360918509, 57977283),
+    (b'\xff\x80\x7f', 536621938, 8356095),
+]
+
+# Names with the same hash, the last one of each is never added.
+COLLISIONS = {
+    UBIFS_KEY_HASH_R5: [['all', 'ama', 'bal', 'bba'], ['alm', 'amb', 'bam', 'bbb']],
+    UBIFS_KEY_HASH_TEST: [['file_a', 'file_b', 'file_c', 'file_x'], ['lib0', 'lib00', 'lib01', 'lib02']],
+}
+
+
+@pytest.mark.parametrize('name, r5, test', KERNEL_HASHES)
+def test_name_hash_matches_kernel(name, r5, test):
+    for key_hash, expected in ((UBIFS_KEY_HASH_R5, r5), (UBIFS_KEY_HASH_TEST, test)):
+        ubifs = SimpleNamespace(superblock_node=SimpleNamespace(key_hash=key_hash))
+        assert tnc.name_hash(ubifs, name) == expected
+
+    # Test images are built with it.
+    assert r5_hash(name) == r5
+
+
+def _build(tmp_path, key_hash):
+    # Fanout 2, so entries with colliding keys end up in different
+    # index nodes.
+    b = ubifs_image(fanout=2, key_hash=key_hash)
+    etc = b.mkdir(UBIFS_ROOT_INO, 'etc')
+    b.add_file(etc, 'passwd', b'root:x:0:0:root:/root:/bin/sh\n')
+    sub = b.mkdir(etc, 'sub')
+    b.add_file(sub, 'deep.txt', b'deep' * 3000)
+    b.mkdir(UBIFS_ROOT_INO, 'empty')
+    b.symlink(UBIFS_ROOT_INO, 'link', 'etc/passwd')
+
+    coll = b.mkdir(UBIFS_ROOT_INO, 'coll')
+    for group in COLLISIONS[key_hash]:
+        for name in group[:-1]:
+            b.add_file(coll, name, name.encode() * 100)
+    for i in range(0, 20):
+        b.add_file(coll, 'f%02d' % i, b'%d' % i)
+
+    return open_ubifs(tmp_path / 'ubifs.img', b.build(seed=1))
+
+
+def _walk(ubifs):
+    inodes = {}
+    walk.index(ubifs, ubifs.master_node.root_lnum, ubifs.master_node.root_offs, inodes)
+    return inodes
+
+
+def _paths(inodes, inum=UBIFS_ROOT_INO, names=()):
+    for dent in inodes[inum].get('dent', []):
+        yield list(names) + [dent.name]
+        if dent.type == UBIFS_ITYPE_DIR:
+            yield from _paths(inodes, dent.inum, list(names) + [dent.name])
+
+
+@pytest.fixture(params=[UBIFS_KEY_HASH_R5, UBIFS_KEY_HASH_TEST], ids=['r5', 'test'])
+def key_hash(request):
+    return request.param
+
+
+def test_find_path_matches_walk(tmp_path, key_hash):
+    ubifs = _build(tmp_path, key_hash)
+    walked = _walk(ubifs)
+    paths = list(_paths(walked))
+    assert len(paths) == 33
+
+    for names in paths:
+        assert tnc.find_path(ubifs, names, {}) == find_dir(walked, UBIFS_ROOT_INO, names, 0)
+
+    assert tnc.find_path(ubifs, [], {}) == UBIFS_ROOT_INO
+
+
+def test_lookup_dent_collisions(tmp_path, key_hash):
+    ubifs = _build(tmp_path, key_hash)
+    walked = _walk(ubifs)
+    coll = find_dir(walked, UBIFS_ROOT_INO, ['coll'], 0)
+
+    for group in COLLISIONS[key_hash]:
+        hashes = {tnc.name_hash(ubifs, name.encode()) for name in group}
+        assert len(hashes) == 1
+
+        for name in group[:-1]:
+            inodes = {}
+            dent = tnc.lookup_dent(ubifs, coll, name, inodes)
+            assert dent.name == name
+            assert dent.inum == find_dir(walked, coll, [name], 0)
+            assert inodes[coll]['dent'] == [dent]
+
+        # Same hash, but not in the directory.
+        assert tnc.lookup_dent(ubifs, coll, group[-1], {}) is None
+
+
+def test_find_path_missing(tmp_path, key_hash):
+    ubifs = _build(tmp_path, key_hash)
+
+    assert tnc.find_path(ubifs, ['nope'], {}) is None
+    assert tnc.find_path(ubifs, ['etc', 'nope'], {}) is None
+    assert tnc.find_path(ubifs, ['empty', 'nope'], {}) is None
+    # File in the middle of the path.
+    assert tnc.find_path(ubifs, ['etc', 'passwd', 'x'], {}) is None
+
+
+def test_load_dir_matches_walk(tmp_path, key_hash):
+    ubifs = _build(tmp_path, key_hash)
+    walked = _walk(ubifs)
+
+    for names in [[]] + list(_paths(walked)):
+        inum = find_dir(walked, UBIFS_ROOT_INO, names, 0)
+        if not walked[inum]['ino'].mode & 0o040000:
+            continue
+
+        inodes = {}
+        tnc.load_dir(ubifs, inum, inodes)
+        assert sorted((d.name, d.inum) for d in inodes[inum]['dent']) == \
+               sorted((d.name, d.inum) for d in walked[inum].get('dent', []))
+        for dent in inodes[inum]['dent']:
+            assert inodes[dent.inum]['ino'].key == walked[dent.inum]['ino'].key
+
+    inodes = {}
+    tnc.load_dir(ubifs, UBIFS_ROOT_INO, inodes, recursive=True)
+    assert sorted(inodes) == sorted(walked)
+
+
+def test_load_inode_data(tmp_path, key_hash):
+    ubifs = _build(tmp_path, key_hash)
+    walked = _walk(ubifs)
+
+    for inum, inode in walked.items():
+        loaded = tnc.load_inode(ubifs, inum, {}, data=True)
+        assert loaded['ino'].key == inode['ino'].key
+        assert [d.key for d in loaded.get('data', [])] == [d.key for d in inode.get('data', [])]
+        assert 'data' not in tnc.load_inode(ubifs, inum, {})
+
+    assert tnc.load_inode(ubifs, 1000, {}) is None
@@ -0,0 +1,164 @@
+import os
+import sys
+
+import pytest
+
+from ubireader import scan_index, settings
+from ubireader.scripts import ubireader_extract_files, ubireader_extract_images
+from ubireader.ubi.defines import UBI_EC_HDR_MAGIC
+from ubireader.ubifs.defines import *
+from ubireader.utils import find_regions, probe
+
+from image import DATA_OFFSET, LEB_SIZE, PEB_SIZE, VID_HDR_OFFSET, ubi_image, ubifs_image
+
+PREFIX = b'\x00\x11\x22\x33' * 3000
+
+
+def _ubifs(junk=0):
+    b = ubifs_image()
+    for i in range(0, 4):
+        b.add_file(UBIFS_ROOT_INO, 'file%s' % i, b'%d' % i * 5000)
+    if junk:
+        # Magic numbers in file data are not headers.
+        b.add_file(UBIFS_ROOT_INO, 'junk', (UBI_EC_HDR_MAGIC + b'\x00' * 60) * junk, compr=UBIFS_COMPR_NONE)
+    return b.build()
+
+
+def _write(tmp_path, data):
+    path = tmp_path / 'image.bin'
+    path.write_bytes(data)
+    return str(path)
+
+
+@pytest.fixture(autouse=True)
+def no_scan_index(monkeypatch):
+    monkeypatch.setattr(settings, 'use_scan_index', False)
+
+
+def test_probe_ubi(tmp_path):
+    path = _write(tmp_path, PREFIX + ubi_image([(b'rootfs', _ubifs())]) + PREFIX)
+    assert probe(path) == dict(start_offset=len(PREFIX), filetype=UBI_EC_HDR_MAGIC, peb_size=PEB_SIZE,
+                               leb_size=LEB_SIZE, vid_hdr_offset=VID_HDR_OFFSET, data_offset=DATA_OFFSET,
+                               confidence=1.0)
+
+
+def test_probe_ubi_guess_offset(tmp_path):
+    image = ubi_image([(b'rootfs', _ubifs())])
+    path = _write(tmp_path, image + PREFIX + image)
+    assert probe(path)['start_offset'] == 0
+    assert probe(path, PEB_SIZE + 1)['start_offset'] == 2 * PEB_SIZE
+    assert probe(path, len(image))['start_offset'] == len(image) + len(PREFIX)
+
+
+def test_probe_ubi_junk_magic(tmp_path):
+    path = _write(tmp_path, PREFIX + ubi_image([(b'rootfs', _ubifs(junk=20))]))
+    result = probe(path)
+    assert result['start_offset'] == len(PREFIX)
+    assert result['peb_size'] == PEB_SIZE
+    assert 0.0 < result['confidence'] < 1.0
+
+
+def test_probe_ubifs(tmp_path):
+    path = _write(tmp_path, PREFIX + _ubifs())
+    assert probe(path) == dict(start_offset=len(PREFIX), filetype=UBIFS_NODE_MAGIC, peb_size=None,
+                               leb_size=LEB_SIZE, vid_hdr_offset=None, data_offset=None, confidence=1.0)
+
+
+def test_probe_ubifs_no_master(tmp_path):
+    image = bytearray(_ubifs())
+    # Master node CRC no longer matches.
+    image[LEB_SIZE * UBIFS_MST_LNUM + 30] ^= 0xff
+    result = probe(_write(tmp_path, PREFIX + bytes(image)))
+    assert result['leb_size'] == LEB_SIZE
+    assert result['confidence'] == 0.5
+
+
+def test_probe_nothing(tmp_path):
+    # Magic numbers without valid headers.
+    path = _write(tmp_path, PREFIX + UBI_EC_HDR_MAGIC + PREFIX + UBIFS_NODE_MAGIC + PREFIX)
+    with pytest.raises(SystemExit):
+        probe(path)
+
+
+def test_probe_scan_index(tmp_path, monkeypatch):
+    monkeypatch.setattr(scan_index, '_indexes', {})
+    monkeypatch.setattr(settings, 'use_scan_index', True)
+    monkeypatch.setattr(settings, 'scan_index_path', None)
+    path = _write(tmp_path, PREFIX + ubi_image([(b'rootfs', _ubifs())]))
+
+    first = probe(path)
+    monkeypatch.setattr('ubireader.utils._probe', None)
+    assert probe(path) == first
+
+
+def _tree(path):
+    files = {}
+    for root, dirs, names in os.walk(path):
+        for name in names:
+            with open(os.path.join(root, name), 'rb') as f:
+                files[os.path.relpath(os.path.join(root, name), path)] = f.read()
+    return files
+
+
+@pytest.fixture
+def regions(tmp_path):
+    """Two UBI images and a bare UBIFS image, with data around them."""
+    ubi1 = ubi_image([(b'rootfs', _ubifs())], image_seq=1)
+    ubifs = _ubifs()
+    ubi2 = ubi_image([(b'data', _ubifs(junk=2))], image_seq=7)
+
+    starts = [len(PREFIX)]
+    starts.append(starts[0] + len(ubi1) + len(PREFIX))
+    starts.append(starts[1] + len(ubifs) + len(PREFIX))
+    data = PREFIX + ubi1 + PREFIX + ubifs + PREFIX + ubi2 + PREFIX
+    return _write(tmp_path, data), starts, [len(ubi1), len(ubifs), len(ubi2)]
+
+
+def test_find_regions(regions):
+    path, starts, sizes = regions
+    assert find_regions(path) == [
+        dict(start_offset=starts[0], end_offset=starts[0] + sizes[0], filetype=UBI_EC_HDR_MAGIC, block_size=PEB_SIZE),
+        dict(start_offset=starts[1], end_offset=starts[1] + sizes[1], filetype=UBIFS_NODE_MAGIC, block_size=LEB_SIZE),
+        dict(start_offset=starts[2], end_offset=starts[2] + sizes[2], filetype=UBI_EC_HDR_MAGIC, block_size=PEB_SIZE),
+    ]
+    assert [r['start_offset'] for r in find_regions(path, starts[1])] == starts[1:]
+
+
+@pytest.fixture
+def cli_settings(monkeypatch):
+    # Scripts set all of them from their arguments.
+    for name, value in vars(settings).items():
+        if not name.startswith('_'):
+            monkeypatch.setattr(settings, name, value)
+
+
+@pytest.mark.parametrize('workers', [0, 2])
+def test_extract_all_regions(tmp_path, monkeypatch, cli_settings, regions, workers):
+    path, starts, sizes = regions
+    out = tmp_path / 'out'
+    monkeypatch.setattr(sys, 'argv', ['ubireader_extract_files', '-a', '-J', str(workers), '-o', str(out), path])
+    ubireader_extract_files.main()
+
+    assert sorted(os.listdir(out)) == sorted('offset-%s' % start for start in starts)
+    files = {'file%s' % i: b'%d' % i * 5000 for i in range(0, 4)}
+    assert _tree(out / ('offset-%s' % starts[0])) == {os.path.join('1', 'rootfs', name): data for name, data in files.items()}
+    assert _tree(out / ('offset-%s' % starts[1])) == files
+    carved = _tree(out / ('offset-%s' % starts[2]))
+    assert carved.pop(os.path.join('7', 'data', 'junk')) == (UBI_EC_HDR_MAGIC + b'\x00' * 60) * 2
+    assert carved == {os.path.join('7', 'data', name): data for name, data in files.items()}
+
+
+def test_extract_images_all_regions(tmp_path, monkeypatch, cli_settings, regions):
+    path, starts, sizes = regions
+    out = tmp_path / 'out'
+    monkeypatch.setattr(sys, 'argv', ['ubireader_extract_images', '-a', '-o', str(out), path])
+    ubireader_extract_images.main()
+
+    with open(path, 'rb') as f:
+        image = f.read()
+    # Written under a directory named after the image file.
+    assert _tree(out / 'image.bin') == {
+        os.path.join('offset-%s' % starts[0], 'img-1_vol-rootfs.ubifs'): _ubifs(),
+        'offset-%s.ubifs' % starts[1]: image[starts[1]:starts[1] + sizes[1]],
+        os.path.join('offset-%s' % starts[2], 'img-7_vol-data.ubifs'): _ubifs(junk=2),
+    }
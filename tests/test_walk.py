@@ -0,0 +1,122 @@
+import pytest
+
+from ubireader import settings
+from ubireader.ubifs import walk
+from ubireader.ubifs.defines import *
+
+from image import open_ubifs, root, set_branch, ubifs_image
+
+
+def _image(seed=None):
+    # Fanout 2 for a deep index.
+    b = ubifs_image(fanout=2)
+    for d in range(0, 3):
+        parent = b.mkdir(UBIFS_ROOT_INO, 'dir%s' % d)
+        for i in range(0, 6):
+            b.add_file(parent, 'file%s' % i, b'%d' % i * (i * 3000 + 1))
+    return bytearray(b.build(seed=seed))
+
+
+def _walk(ubifs, data=True):
+    inodes = {}
+    walk.index(ubifs, ubifs.master_node.root_lnum, ubifs.master_node.root_offs, inodes, [], data)
+    return inodes
+
+
+def _summary(inodes):
+    # Comparable contents of inodes, lists in order.
+    return {inum: (inode['ino'].key if 'ino' in inode else None,
+                   [(d.name, d.inum) for d in inode.get('dent', [])],
+                   [d.key['khash'] for d in inode.get('data', [])],
+                   [d.key['khash'] for d in inode.get('xent', [])])
+            for inum, inode in inodes.items()}
+
+
+@pytest.fixture
+def warn_only(monkeypatch):
+    monkeypatch.setattr(settings, 'warn_only_block_read_errors', True)
+
+
+@pytest.mark.parametrize('data', [True, False], ids=['data', 'no_data'])
+@pytest.mark.parametrize('seed', [None, 7], ids=['in_order', 'shuffled'])
+def test_physical_order_matches_dfs(tmp_path, monkeypatch, data, seed):
+    ubifs = open_ubifs(tmp_path / 'ubifs.img', bytes(_image(seed)))
+    dfs = _walk(ubifs, data)
+    monkeypatch.setattr(settings, 'walk_physical_order', True)
+    physical = _walk(ubifs, data)
+
+    assert len(dfs) == 1 + 3 + 3 * 6
+    assert _summary(physical) == _summary(dfs)
+    assert any('data' in inode for inode in dfs.values()) == data
+
+
+def test_self_referencing_index(tmp_path, monkeypatch, capsys):
+    image = _image()
+    lnum, offs = root(image)
+    set_branch(image, lnum, offs, 0, (lnum, offs))
+    ubifs = open_ubifs(tmp_path / 'ubifs.img', bytes(image))
+
+    with pytest.raises(SystemExit):
+        _walk(ubifs)
+    assert 'index has a loop' in capsys.readouterr().out
+
+    monkeypatch.setattr(settings, 'warn_only_block_read_errors', True)
+    for physical in (False, True):
+        monkeypatch.setattr(settings, 'walk_physical_order', physical)
+        inodes = _walk(ubifs)
+        assert 'LEB: %s at %s, Node already visited, index has a loop.' % (lnum, offs) in capsys.readouterr().out
+        # Nodes under the other branch are still read.
+        assert inodes
+
+
+def test_index_loop_to_ancestor(tmp_path, warn_only, capsys):
+    image = _image()
+    ubifs = open_ubifs(tmp_path / 'ubifs.img', bytes(image))
+    lnum, offs = root(image)
+    idxn = walk._node(ubifs, lnum, offs, {}, [])
+    child = idxn.branches[-1]
+    set_branch(image, child.lnum, child.offs, 0, (lnum, offs))
+
+    ubifs = open_ubifs(tmp_path / 'loop.img', bytes(image))
+    _walk(ubifs)
+    assert 'index has a loop' in capsys.readouterr().out
+
+
+def _depth(ubifs):
+    lnum, offs = ubifs.master_node.root_lnum, ubifs.master_node.root_offs
+    return walk._node(ubifs, lnum, offs, {}, []).level + 1
+
+
+def test_max_depth(tmp_path, monkeypatch, warn_only, capsys):
+    ubifs = open_ubifs(tmp_path / 'ubifs.img', bytes(_image()))
+    full = _walk(ubifs)
+    depth = _depth(ubifs)
+    assert depth > 3
+
+    monkeypatch.setattr(settings, 'walk_max_depth', depth)
+    assert _summary(_walk(ubifs)) == _summary(full)
+    assert 'deeper than' not in capsys.readouterr().out
+
+    monkeypatch.setattr(settings, 'walk_max_depth', depth - 1)
+    assert len(_walk(ubifs)) < len(full)
+    assert 'Index deeper than %s levels.' % (depth - 1) in capsys.readouterr().out
+
+    monkeypatch.setattr(settings, 'warn_only_block_read_errors', False)
+    with pytest.raises(SystemExit):
+        _walk(ubifs)
+
+
+def test_max_nodes(tmp_path, monkeypatch, warn_only, capsys):
+    ubifs = open_ubifs(tmp_path / 'ubifs.img', bytes(_image()))
+    full = _walk(ubifs)
+
+    monkeypatch.setattr(settings, 'walk_max_nodes', 10)
+    assert len(_walk(ubifs)) < len(full)
+    assert 'Index has more than 10 nodes.' in capsys.readouterr().out
+
+    monkeypatch.setattr(settings, 'warn_only_block_read_errors', False)
+    with pytest.raises(SystemExit):
+        _walk(ubifs)
+
+    monkeypatch.setattr(settings, 'walk_max_nodes', 100000)
+    assert _summary(_walk(ubifs)) == _summary(full)
@@ -0,0 +1,254 @@
+#!/usr/bin/env python
+#############################################################
+# ubi_reader/scan_index
+# (c) 2013 Jason Pruitt (jrspruitt@gmail.com)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#############################################################
+
+from __future__ import annotations
+import hashlib
+import os
+import sqlite3
+import zlib
+from array import array
+from ubireader import settings
+from ubireader.debug import error, log
+
+SCAN_INDEX_VERSION = 2
+SCAN_INDEX_SUFFIX = '.ubireader-index'
+SAMPLE_COUNT = 16
+SAMPLE_SZ = 4096
+# Seconds to wait for other processes writing the index.
+BUSY_TIMEOUT = 30
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value);
+CREATE TABLE IF NOT EXISTS params (name TEXT PRIMARY KEY, value INTEGER);
+CREATE TABLE IF NOT EXISTS scans (id INTEGER PRIMARY KEY, start_offset INTEGER, end_offset INTEGER,
+                                  block_size INTEGER, UNIQUE (start_offset, end_offset, block_size));
+CREATE TABLE IF NOT EXISTS pebs (scan_id INTEGER, file_offset INTEGER, headers BLOB,
+                                 PRIMARY KEY (scan_id, file_offset));
+CREATE TABLE IF NOT EXISTS volumes (scan_id INTEGER, options TEXT, image_seq INTEGER, vol_id INTEGER,
+                                    block_list BLOB, PRIMARY KEY (scan_id, options, image_seq, vol_id));
+'''
+
+_indexes: dict[str, scan_index | None] = {}
+
+
+def file_key(path: str) -> tuple[int, int, str]:
+    """Identify file contents without reading all of it.
+
+    Arguments:
+    Str:path    -- Path to file.
+
+    Returns:
+    Tuple       -- File size, mtime in ns and sha1 of SAMPLE_COUNT
+                   evenly spaced SAMPLE_SZ chunks of the file.
+    """
+    st = os.stat(path)
+    sha = hashlib.sha1()
+
+    with open(path, 'rb') as f:
+        step = max(0, st.st_size - SAMPLE_SZ) // (SAMPLE_COUNT - 1)
+        for i in range(0, SAMPLE_COUNT):
+            f.seek(i * step)
+            sha.update(f.read(SAMPLE_SZ))
+
+    return st.st_size, st.st_mtime_ns, sha.hexdigest()
+
+
+def open_scan_index(path: str) -> scan_index | None:
+    """Get scan index of file, if enabled in settings.
+
+    Arguments:
+    Str:path    -- Path to image file.
+
+    Returns:
+    Obj         -- scan_index object, None if disabled or it can't
+                   be opened. Same object for every call with path.
+    """
+    if not settings.use_scan_index:
+        return None
+
+    path = os.path.abspath(path)
+    if path not in _indexes:
+        index_path = settings.scan_index_path or path + SCAN_INDEX_SUFFIX
+        try:
+            _indexes[path] = scan_index(path, index_path)
+        except (OSError, sqlite3.Error) as e:
+            error(open_scan_index, 'Warn', 'Scan index %s disabled: %s' % (index_path, e))
+            _indexes[path] = None
+
+    return _indexes[path]
+
+
+class scan_index(object):
+    """Sidecar file of scan results of an image file
+
+    Arguments:
+    Str:path        -- Path to image file.
+    Str:index_path  -- Path to sidecar file.
+
+    Methods:
+    get_param       -- Returns stored guessed parameter or None.
+        Str:name
+    put_param       -- Store guessed parameter.
+        Str:name
+        Int:value
+    get_blocks      -- Returns stored block headers of a scan or None.
+        Int:start_offset
+        Int:end_offset
+        Int:block_size
+    put_blocks      -- Store block headers of a scan.
+        Int:start_offset
+        Int:end_offset
+        Int:block_size
+        List:headers
+    get_volumes     -- Returns stored volume block lists of an image or None.
+        Int:start_offset
+        Int:end_offset
+        Int:block_size
+        Int:image_seq
+    put_volumes     -- Store volume block lists of an image.
+        Int:start_offset
+        Int:end_offset
+        Int:block_size
+        Int:image_seq
+        Dict:volumes
+
+    SQLite database keyed by file size, mtime and a sampled hash of
+    the image, all stored results are dropped if the image changed.
+    Volume block lists are also keyed by the settings that change
+    how blocks are resolved. Database errors, e.g. it being locked by
+    other processes for longer than BUSY_TIMEOUT, are warned about and
+    handled as if nothing was stored.
+    """
+
+    def __init__(self, path: str, index_path: str) -> None:
+        self.__name__ = 'scan_index'
+        self._path = index_path
+        self._db = sqlite3.connect(index_path, timeout=BUSY_TIMEOUT)
+        self._db.executescript(_SCHEMA)
+
+        key = [SCAN_INDEX_VERSION, *file_key(path)]
+        stored = dict(self._db.execute('SELECT name, value FROM meta').fetchall())
+        if [stored.get(k) for k in ('version', 'size', 'mtime', 'hash')] != key:
+            if stored:
+                log(self, 'Image changed, dropping %s' % index_path)
+            with self._db:
+                for table in ('meta', 'params', 'scans', 'pebs', 'volumes'):
+                    self._db.execute('DELETE FROM %s' % table)
+                self._db.executemany('INSERT INTO meta VALUES (?, ?)', zip(('version', 'size', 'mtime', 'hash'), key))
+        log(self, 'Opened %s' % index_path)
+
+
+    def _scan_id(self, start_offset: int, end_offset: int, block_size: int, create: bool = False) -> int | None:
+        row = self._db.execute('SELECT id FROM scans WHERE start_offset = ? AND end_offset = ? AND block_size = ?',
+                               (start_offset, end_offset, block_size)).fetchone()
+        if row is None and create:
+            return self._db.execute('INSERT INTO scans (start_offset, end_offset, block_size) VALUES (?, ?, ?)',
+                                    (start_offset, end_offset, block_size)).lastrowid
+        return row[0] if row else None
+
+
+    def _failed(self, action: str, e: sqlite3.Error) -> None:
+        error(self, 'Warn', 'Scan index %s, %s failed: %s' % (self._path, action, e))
+
+
+    def get_param(self, name: str) -> int | None:
+        try:
+            row = self._db.execute('SELECT value FROM params WHERE name = ?', (name,)).fetchone()
+        except sqlite3.Error as e:
+            self._failed('loading %s' % name, e)
+            return None
+
+        if row is None:
+            return None
+        log(self, 'Loaded %s: %s' % (name, row[0]))
+        return row[0]
+
+
+    def put_param(self, name: str, value: int) -> None:
+        try:
+            with self._db:
+                self._db.execute('INSERT OR REPLACE INTO params VALUES (?, ?)', (name, value))
+        except sqlite3.Error as e:
+            self._failed('storing %s' % name, e)
+
+
+    def get_blocks(self, start_offset: int, end_offset: int, block_size: int) -> list[tuple[int, bytes]] | None:
+        try:
+            scan_id = self._scan_id(start_offset, end_offset, block_size)
+            if scan_id is None:
+                return None
+
+            rows = self._db.execute('SELECT file_offset, headers FROM pebs WHERE scan_id = ? ORDER BY file_offset', (scan_id,))
+            headers = [(file_offset, zlib.decompress(buf)) for file_offset, buf in rows]
+        except sqlite3.Error as e:
+            self._failed('loading block headers', e)
+            return None
+
+        log(self, 'Loaded %s block headers' % len(headers))
+        return headers
+
+
+    def put_blocks(self, start_offset: int, end_offset: int, block_size: int, headers: list[tuple[int, bytes]]) -> None:
+        try:
+            with self._db:
+                scan_id = self._scan_id(start_offset, end_offset, block_size, create=True)
+                self._db.execute('DELETE FROM pebs WHERE scan_id = ?', (scan_id,))
+                self._db.executemany('INSERT INTO pebs VALUES (?, ?, ?)',
+                                     ((scan_id, file_offset, zlib.compress(buf, 1)) for file_offset, buf in headers))
+        except sqlite3.Error as e:
+            self._failed('storing block headers', e)
+            return
+
+        log(self, 'Stored %s block headers' % len(headers))
+
+
+    def get_volumes(self, start_offset: int, end_offset: int, block_size: int, image_seq: int) -> dict[int, list[int]] | None:
+        try:
+            scan_id = self._scan_id(start_offset, end_offset, block_size)
+            rows = self._db.execute('SELECT vol_id, block_list FROM volumes WHERE scan_id = ? AND options = ? AND image_seq = ?',
+                                    (scan_id, _options(), image_seq)).fetchall()
+        except sqlite3.Error as e:
+            self._failed('loading volume block lists', e)
+            return None
+
+        if not rows:
+            return None
+
+        log(self, 'Loaded volume block lists of image %s' % image_seq)
+        return {vol_id: array('q', block_list).tolist() for vol_id, block_list in rows}
+
+
+    def put_volumes(self, start_offset: int, end_offset: int, block_size: int, image_seq: int, volumes: dict[int, list[int]]) -> None:
+        try:
+            with self._db:
+                scan_id = self._scan_id(start_offset, end_offset, block_size, create=True)
+                self._db.executemany('INSERT OR REPLACE INTO volumes VALUES (?, ?, ?, ?, ?)',
+                                     ((scan_id, _options(), image_seq, vol_id, array('q', block_list).tobytes())
+                                      for vol_id, block_list in volumes.items()))
+        except sqlite3.Error as e:
+            self._failed('storing volume block lists', e)
+
+
+    def close(self) -> None:
+        self._db.close()
+
+
+def _options() -> str:
+    """Settings that change which blocks end up in a volume."""
+    return 'ignore_block_header_errors=%s,uboot_fix=%s' % (settings.ignore_block_header_errors, settings.uboot_fix)
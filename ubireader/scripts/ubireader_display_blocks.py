@@ -30,7 +30,7 @@ from ubireader.ubi_io import ubi_file
 from ubireader import settings
 from ubireader.ubi.defines import UBI_EC_HDR_MAGIC
 from ubireader.ubifs.defines import UBIFS_NODE_MAGIC
-from ubireader.utils import guess_filetype, guess_start_offset, guess_leb_size, guess_peb_size
+from ubireader.utils import guess_filetype, probe
 
 
 def main():
@@ -78,6 +78,15 @@ def main():
     parser.add_argument('-f', '--u-boot-fix', action='store_true', dest='uboot_fix',
                       help='Assume blocks with image_seq 0 are because of older U-boot implementations and include them. (default: False)')
 
+    parser.add_argument('-m', '--mmap', action='store_true', dest='mmap',
+                      help='Memory map the image file instead of using buffered reads. (default: False)')
+
+    parser.add_argument('-j', '--scan-workers', type=int, dest='scan_workers', default=0,
+                        help='Number of processes used to scan the PEBs, 0 scans in this process. (default: 0)')
+
+    parser.add_argument('-x', '--scan-index', action='store_true', dest='scan_index',
+                      help='Store scan results in a sidecar file next to the image and reuse them on later runs. (default: False)')
+
     parser.add_argument('block_search_params',
                       help="""
                       Double quoted Dict of ubi.block.description attributes, which is run through eval().
@@ -101,6 +110,15 @@ def main():
 
     settings.uboot_fix = args.uboot_fix
 
+    settings.use_mmap = args.mmap
+
+    settings.scan_workers = args.scan_workers
+
+    settings.use_scan_index = args.scan_index
+
+    # Reports on every PEB, a fastmap attach only reads those it lists.
+    settings.use_fastmap = False
+
     if args.filepath:
         path = args.filepath
         if not os.path.exists(path):
@@ -111,27 +129,31 @@ def main():
 
     if args.start_offset:
         start_offset = args.start_offset
-    elif args.guess_offset:
-        start_offset = guess_start_offset(path, args.guess_offset)
+        filetype = guess_filetype(path, start_offset)
+        params = None
     else:
-        start_offset = guess_start_offset(path)
+        params = probe(path, args.guess_offset or 0)
+        start_offset = params['start_offset']
+        filetype = params['filetype']
 
     if args.end_offset:
         end_offset = args.end_offset
     else:
         end_offset = None
 
-    filetype = guess_filetype(path, start_offset)
     if not filetype:
         parser.error('Could not determine file type.')
 
     if args.block_size:
         block_size = args.block_size
     else:
+        if params is None:
+            params = probe(path, start_offset)
+
         if filetype == UBI_EC_HDR_MAGIC:
-            block_size = guess_peb_size(path)
+            block_size = params['peb_size']
         elif filetype == UBIFS_NODE_MAGIC:
-            block_size = guess_leb_size(path)
+            block_size = params['leb_size']
 
         if not block_size:
             parser.error('Block size could not be determined.')
@@ -26,12 +26,12 @@ import argparse
 from ubireader import settings
 from ubireader.ubi import ubi
 from ubireader.ubi.defines import UBI_EC_HDR_MAGIC
-from ubireader.ubifs import ubifs
+from ubireader.ubifs import compression, ubifs
 from ubireader.ubifs.output import extract_files
-from ubireader.ubifs.defines import UBIFS_NODE_MAGIC
+from ubireader.ubifs.defines import PRINT_UBIFS_COMPR, UBIFS_NODE_MAGIC
 from ubireader.ubi_io import ubi_file, leb_virtual_file
 from ubireader.debug import error, log
-from ubireader.utils import guess_filetype, guess_start_offset, guess_leb_size, guess_peb_size
+from ubireader.utils import Region, guess_filetype, probe, find_regions, process_regions
 
 def create_output_dir(outpath):
     if os.path.exists(outpath):
@@ -83,6 +83,36 @@ def main():
     parser.add_argument('-f', '--u-boot-fix', action='store_true', dest='uboot_fix',
                       help='Assume blocks with image_seq 0 are because of older U-boot implementations and include them. (default: False)')
 
+    parser.add_argument('-m', '--mmap', action='store_true', dest='mmap',
+                      help='Memory map the image file instead of using buffered reads. (default: False)')
+
+    parser.add_argument('-j', '--scan-workers', type=int, dest='scan_workers', default=0,
+                        help='Number of processes used to scan the PEBs, 0 scans in this process. (default: 0)')
+
+    parser.add_argument('-x', '--scan-index', action='store_true', dest='scan_index',
+                      help='Store scan results in a sidecar file next to the image and reuse them on later runs. (default: False)')
+
+    parser.add_argument('-F', '--ignore-fastmap', action='store_true', dest='ignore_fastmap',
+                      help='Scan all PEBs even if the image has a valid fastmap. (default: False)')
+
+    parser.add_argument('-O', '--physical-order', action='store_true', dest='physical_order',
+                      help='Read UBIFS index nodes and file data in file order instead of key order, fewer seeks on slow storage. (default: False)')
+
+    parser.add_argument('-t', '--extract-workers', type=int, dest='extract_workers', default=0,
+                        help='Number of threads used to write regular files, 0 writes them in this thread. (default: 0)')
+
+    parser.add_argument('-z', '--decompress-workers', type=int, dest='decompress_workers', default=0,
+                        help='Number of threads used to decrypt and decompress file data, 0 does it in this thread. (default: 0)')
+
+    parser.add_argument('-B', '--decompress-backend', action='append', dest='decompress_backends', default=[],
+                        metavar='COMPR=NAME', help='Decompressor to use for a compression, e.g. zlib=isal, can be given for each compression. (default: fastest installed)')
+
+    parser.add_argument('-a', '--all-regions', action='store_true', dest='all_regions',
+                      help='Extract every UBI and UBIFS region found in file, each to its own offset-<start offset> directory. (default: False)')
+
+    parser.add_argument('-J', '--region-workers', type=int, dest='region_workers', default=0,
+                        help='Number of processes used to extract regions with --all-regions, 0 extracts in this process. (default: 0)')
+
     parser.add_argument('-o', '--output-dir', dest='outpath',
                         help='Specify output directory path.')
 
@@ -107,6 +137,34 @@ def main():
 
     settings.uboot_fix = args.uboot_fix
 
+    settings.use_mmap = args.mmap
+
+    settings.scan_workers = args.scan_workers
+
+    settings.use_scan_index = args.scan_index
+
+    settings.use_fastmap = not args.ignore_fastmap
+
+    settings.walk_physical_order = args.physical_order
+
+    settings.extract_physical_order = args.physical_order
+
+    settings.extract_workers = args.extract_workers
+
+    settings.decompress_workers = args.decompress_workers
+
+    settings.decompress_backends = dict(settings.decompress_backends)
+    for backend in args.decompress_backends:
+        compr, _, name = backend.partition('=')
+        if compr not in PRINT_UBIFS_COMPR:
+            parser.error('Unknown compression %s, one of %s.' % (compr, ', '.join(PRINT_UBIFS_COMPR)))
+        names = [b.name for b in compression.backends(PRINT_UBIFS_COMPR.index(compr))]
+        if name not in names:
+            parser.error('Decompressor %s not available for %s, one of %s.' % (name, compr, ', '.join(names) or 'none'))
+        settings.decompress_backends[compr] = name
+
+    settings.region_workers = args.region_workers
+
     if args.master_key:
         path = args.master_key
         if not os.path.exists(path):
@@ -125,42 +183,66 @@ def main():
         if not os.path.exists(path):
             parser.error("File path doesn't exist.")
 
+    if args.outpath:
+        outpath = args.outpath
+    else:
+        outpath = settings.output_dir
+
+    perms = args.permissions
+
+    if args.all_regions:
+        # Each UBI or UBIFS region found goes to its own directory.
+        regions = find_regions(path, args.guess_offset or 0)
+        if not regions:
+            parser.error('No UBI or UBIFS data found.')
+
+        process_regions(extract_found_region, path, regions, outpath, perms, master_key)
+        return
+
     if args.start_offset:
         start_offset = args.start_offset
-    elif args.guess_offset:
-        start_offset = guess_start_offset(path, args.guess_offset)
+        filetype = guess_filetype(path, start_offset)
+        params = None
     else:
-        start_offset = guess_start_offset(path)
+        params = probe(path, args.guess_offset or 0)
+        start_offset = params['start_offset']
+        filetype = params['filetype']
 
     if args.end_offset:
         end_offset = args.end_offset
     else:
         end_offset = None
 
-    filetype = guess_filetype(path, start_offset)
     if not filetype:
         parser.error('Could not determine file type.')
 
-    if args.outpath:
-        outpath = args.outpath
-    else:
-        outpath = settings.output_dir
-
     if args.block_size:
         block_size = args.block_size
     else:
+        if params is None:
+            params = probe(path, start_offset)
+
         if filetype == UBI_EC_HDR_MAGIC:
-            block_size = guess_peb_size(path)
+            block_size = params['peb_size']
         elif filetype == UBIFS_NODE_MAGIC:
-            block_size = guess_leb_size(path)
+            block_size = params['leb_size']
 
         if not block_size:
             parser.error('Block size could not be determined.')
 
-    perms = args.permissions
+    region = Region(start_offset=start_offset, end_offset=end_offset, filetype=filetype, block_size=block_size)
+    extract_region(path, region, outpath, perms, master_key)
+
+
+def extract_found_region(path, region, outpath, perms, master_key):
+    outpath = os.path.join(outpath, 'offset-%s' % region['start_offset'])
+    extract_region(path, region, outpath, perms, master_key)
+
 
+def extract_region(path, region, outpath, perms, master_key):
     # Create file object.
-    ufile_obj = ubi_file(path, block_size, start_offset, end_offset)
+    ufile_obj = ubi_file(path, region['block_size'], region['start_offset'], region['end_offset'])
+    filetype = region['filetype']
 
     if filetype == UBI_EC_HDR_MAGIC:
         # Create UBI object
@@ -28,7 +28,8 @@ from ubireader.ubi import ubi
 from ubireader.ubi.defines import UBI_EC_HDR_MAGIC
 from ubireader.ubi_io import ubi_file
 from ubireader.debug import error, log
-from ubireader.utils import guess_filetype, guess_start_offset, guess_peb_size
+from ubireader.ubifs.defines import UBIFS_NODE_MAGIC
+from ubireader.utils import Region, guess_filetype, probe, find_regions, process_regions
 
 def create_output_dir(outpath):
     if not os.path.exists(outpath):
@@ -74,6 +75,21 @@ def main():
     parser.add_argument('-f', '--u-boot-fix', action='store_true', dest='uboot_fix',
                       help='Assume blocks with image_seq 0 are because of older U-boot implementations and include them. (default: False)')
 
+    parser.add_argument('-m', '--mmap', action='store_true', dest='mmap',
+                      help='Memory map the image file instead of using buffered reads. (default: False)')
+
+    parser.add_argument('-j', '--scan-workers', type=int, dest='scan_workers', default=0,
+                        help='Number of processes used to scan the PEBs, 0 scans in this process. (default: 0)')
+
+    parser.add_argument('-x', '--scan-index', action='store_true', dest='scan_index',
+                      help='Store scan results in a sidecar file next to the image and reuse them on later runs. (default: False)')
+
+    parser.add_argument('-a', '--all-regions', action='store_true', dest='all_regions',
+                      help='Extract images from every UBI region found in file, each to its own offset-<start offset> directory. Bare UBIFS regions are copied to offset-<start offset>.ubifs. (default: False)')
+
+    parser.add_argument('-J', '--region-workers', type=int, dest='region_workers', default=0,
+                        help='Number of processes used to extract regions with --all-regions, 0 extracts in this process. (default: 0)')
+
     parser.add_argument('-o', '--output-dir', dest='outpath',
                         help='Specify output directory path.')
 
@@ -95,48 +111,90 @@ def main():
 
     settings.uboot_fix = args.uboot_fix
 
+    settings.use_mmap = args.mmap
+
+    settings.scan_workers = args.scan_workers
+
+    settings.use_scan_index = args.scan_index
+
+    # Dumps every PEB, a fastmap attach only reads those it lists.
+    settings.use_fastmap = False
+
+    settings.region_workers = args.region_workers
+
     if args.filepath:
         path = args.filepath
         if not os.path.exists(path):
             parser.error("File path doesn't exist.")
 
+    img_name = os.path.basename(path)
+    if args.outpath:
+        outpath = os.path.abspath(os.path.join(args.outpath, img_name))
+    else:
+        outpath = os.path.join(settings.output_dir, img_name)
+
+    if args.image_type:
+        image_type = args.image_type.upper()
+    else:
+        image_type = 'UBIFS'
+
+    if args.all_regions:
+        # Each UBI region found goes to its own directory.
+        regions = find_regions(path, args.guess_offset or 0)
+        if not regions:
+            parser.error('No UBI or UBIFS data found.')
+
+        process_regions(extract_found_region, path, regions, outpath, image_type)
+        return
+
     if args.start_offset:
         start_offset = args.start_offset
-    elif args.guess_offset:
-        start_offset = guess_start_offset(path, args.guess_offset)
+        filetype = guess_filetype(path, start_offset)
+        params = None
     else:
-        start_offset = guess_start_offset(path)
+        params = probe(path, args.guess_offset or 0)
+        start_offset = params['start_offset']
+        filetype = params['filetype']
 
     if args.end_offset:
         end_offset = args.end_offset
     else:
         end_offset = None
 
-    filetype = guess_filetype(path, start_offset)
     if filetype != UBI_EC_HDR_MAGIC:
         parser.error('File does not look like UBI data.')
 
-    img_name = os.path.basename(path)
-    if args.outpath:
-        outpath = os.path.abspath(os.path.join(args.outpath, img_name))
-    else:
-        outpath = os.path.join(settings.output_dir, img_name)
-
     if args.block_size:
         block_size = args.block_size
     else:
-        block_size = guess_peb_size(path)
+        if params is None:
+            params = probe(path, start_offset)
+
+        block_size = params['peb_size']
 
         if not block_size:
             parser.error('Block size could not be determined.')
 
-    if args.image_type:
-        image_type = args.image_type.upper()
+    region = Region(start_offset=start_offset, end_offset=end_offset, filetype=filetype, block_size=block_size)
+    extract_region(path, region, outpath, image_type)
+
+
+def extract_found_region(path, region, outpath, image_type):
+    if region['filetype'] == UBIFS_NODE_MAGIC:
+        # Bare UBIFS is already an image, copy it out as is.
+        create_output_dir(outpath)
+        ufile_obj = ubi_file(path, region['block_size'], region['start_offset'], region['end_offset'])
+        with open(os.path.join(outpath, 'offset-%s.ubifs' % region['start_offset']), 'wb') as f:
+            for block in ufile_obj.reader():
+                f.write(block)
+        ufile_obj.close()
     else:
-        image_type = 'UBIFS'
+        extract_region(path, region, os.path.join(outpath, 'offset-%s' % region['start_offset']), image_type)
+
 
+def extract_region(path, region, outpath, image_type):
     # Create file object.
-    ufile_obj = ubi_file(path, block_size, start_offset, end_offset)
+    ufile_obj = ubi_file(path, region['block_size'], region['start_offset'], region['end_offset'])
 
     # Create UBI object
     ubi_obj = ubi(ufile_obj)
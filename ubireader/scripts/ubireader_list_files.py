@@ -33,7 +33,7 @@ from ubireader.ubifs.list import list_files, copy_file
 from ubireader.ubifs.defines import UBIFS_NODE_MAGIC
 from ubireader.ubi_io import ubi_file, leb_virtual_file
 from ubireader.debug import error, log
-from ubireader.utils import guess_filetype, guess_start_offset, guess_leb_size, guess_peb_size
+from ubireader.utils import guess_filetype, probe
 
 class _Args(Protocol):
     log: bool
@@ -45,6 +45,11 @@ class _Args(Protocol):
     warn_only_block_read_errors: bool
     ignore_block_header_errors: bool
     uboot_fix: bool
+    mmap: bool
+    scan_workers: int
+    scan_index: bool
+    ignore_fastmap: bool
+    physical_order: bool
     listpath: str | None
     copyfile: str | None
     copyfiledest: str | None
@@ -88,6 +93,21 @@ def main():
     parser.add_argument('-f', '--u-boot-fix', action='store_true', dest='uboot_fix',
                       help='Assume blocks with image_seq 0 are because of older U-boot implementations and include them. (default: False)')
 
+    parser.add_argument('-m', '--mmap', action='store_true', dest='mmap',
+                      help='Memory map the image file instead of using buffered reads. (default: False)')
+
+    parser.add_argument('-j', '--scan-workers', type=int, dest='scan_workers', default=0,
+                        help='Number of processes used to scan the PEBs, 0 scans in this process. (default: 0)')
+
+    parser.add_argument('-x', '--scan-index', action='store_true', dest='scan_index',
+                      help='Store scan results in a sidecar file next to the image and reuse them on later runs. (default: False)')
+
+    parser.add_argument('-F', '--ignore-fastmap', action='store_true', dest='ignore_fastmap',
+                      help='Scan all PEBs even if the image has a valid fastmap. (default: False)')
+
+    parser.add_argument('-O', '--physical-order', action='store_true', dest='physical_order',
+                      help='Read UBIFS index nodes in file order instead of key order, fewer seeks on slow storage. (default: False)')
+
     parser.add_argument('-P', '--path', dest='listpath',
                         help='Path to list.')
 
@@ -121,6 +141,16 @@ def main():
 
     settings.uboot_fix = args.uboot_fix
 
+    settings.use_mmap = args.mmap
+
+    settings.scan_workers = args.scan_workers
+
+    settings.use_scan_index = args.scan_index
+
+    settings.use_fastmap = not args.ignore_fastmap
+
+    settings.walk_physical_order = args.physical_order
+
     if args.recursive and not args.listpath:
         parser.error("Recursive option needs a path to start with.")
 
@@ -144,27 +174,31 @@ def main():
 
     if args.start_offset:
         start_offset = args.start_offset
-    elif args.guess_offset:
-        start_offset = guess_start_offset(path, args.guess_offset)
+        filetype = guess_filetype(path, start_offset)
+        params = None
     else:
-        start_offset = guess_start_offset(path)
+        params = probe(path, args.guess_offset or 0)
+        start_offset = params['start_offset']
+        filetype = params['filetype']
 
     if args.end_offset:
         end_offset = args.end_offset
     else:
         end_offset = None
 
-    filetype = guess_filetype(path, start_offset)
     if not filetype:
         parser.error('Could not determine file type.')
 
     if args.block_size:
         block_size = args.block_size
     else:
+        if params is None:
+            params = probe(path, start_offset)
+
         if filetype == UBI_EC_HDR_MAGIC:
-            block_size = guess_peb_size(path)
+            block_size = params['peb_size']
         elif filetype == UBIFS_NODE_MAGIC:
-            block_size = guess_leb_size(path)
+            block_size = params['leb_size']
 
         if not block_size:
             parser.error('Block size could not be determined.')
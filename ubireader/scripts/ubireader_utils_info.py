@@ -33,7 +33,7 @@ from ubireader.ubifs import ubifs
 from ubireader.ubifs.defines import PRINT_UBIFS_KEY_HASH, PRINT_UBIFS_COMPR
 from ubireader.ubi_io import ubi_file, leb_virtual_file
 from ubireader.debug import error, log
-from ubireader.utils import guess_filetype, guess_start_offset, guess_peb_size
+from ubireader.utils import guess_filetype, probe
 
 def create_output_dir(outpath):
     if os.path.exists(outpath):
@@ -273,6 +273,18 @@ def main():
     parser.add_argument('-f', '--u-boot-fix', action='store_true', dest='uboot_fix',
                       help='Assume blocks with image_seq 0 are because of older U-boot implementations and include them. (default: False)')
 
+    parser.add_argument('-m', '--mmap', action='store_true', dest='mmap',
+                      help='Memory map the image file instead of using buffered reads. (default: False)')
+
+    parser.add_argument('-j', '--scan-workers', type=int, dest='scan_workers', default=0,
+                        help='Number of processes used to scan the PEBs, 0 scans in this process. (default: 0)')
+
+    parser.add_argument('-x', '--scan-index', action='store_true', dest='scan_index',
+                      help='Store scan results in a sidecar file next to the image and reuse them on later runs. (default: False)')
+
+    parser.add_argument('-F', '--ignore-fastmap', action='store_true', dest='ignore_fastmap',
+                      help='Scan all PEBs even if the image has a valid fastmap. (default: False)')
+
     parser.add_argument('-o', '--output-dir', dest='outpath',
                         help='Specify output directory path.')
 
@@ -294,6 +306,14 @@ def main():
 
     settings.uboot_fix = args.uboot_fix
 
+    settings.use_mmap = args.mmap
+
+    settings.scan_workers = args.scan_workers
+
+    settings.use_scan_index = args.scan_index
+
+    settings.use_fastmap = not args.ignore_fastmap
+
     if args.filepath:
         path = args.filepath
         if not os.path.exists(path):
@@ -301,17 +321,18 @@ def main():
 
     if args.start_offset:
         start_offset = args.start_offset
-    elif args.guess_offset:
-        start_offset = guess_start_offset(path, args.guess_offset)
+        filetype = guess_filetype(path, start_offset)
+        params = None
     else:
-        start_offset = guess_start_offset(path)
+        params = probe(path, args.guess_offset or 0)
+        start_offset = params['start_offset']
+        filetype = params['filetype']
 
     if args.end_offset:
         end_offset = args.end_offset
     else:
         end_offset = None
 
-    filetype = guess_filetype(path, start_offset)
     if filetype != UBI_EC_HDR_MAGIC:
         parser.error('File does not look like UBI data.')
 
@@ -324,7 +345,10 @@ def main():
     if args.block_size:
         block_size = args.block_size
     else:
-        block_size = guess_peb_size(path)
+        if params is None:
+            params = probe(path, start_offset)
+
+        block_size = params['peb_size']
 
         if not block_size:
             parser.error('Block size could not be determined.')
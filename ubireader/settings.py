@@ -30,5 +30,30 @@ logging_on_verbose = False              # Print verbose debug info on.
 
 use_dummy_socket_file = False           # Create regular file place holder for sockets.
 use_dummy_devices = False               # Create regular file place holder for devices.
+use_sparse_files = True                 # Leave holes in extracted files for blocks of all \x00.
 
 uboot_fix = False                       # Older u-boot sets image_seq to 0 on blocks it's written to.
+
+use_mmap = False                        # Memory map image file, reads return memoryview slices.
+
+leb_cache_size = 16 * 1024 * 1024       # Byte budget of the LEB buffer cache in leb_virtual_file.
+
+scan_workers = 0                        # Parallel PEB scan workers, 0 scans serially.
+scan_use_threads = False                # Use a thread pool instead of a process pool for the PEB scan.
+
+use_scan_index = False                  # Load/store scan results in a sidecar file next to the image.
+scan_index_path = None                  # Path of the sidecar file, default is <image path>.ubireader-index
+
+use_fastmap = True                      # Attach UBI images from fastmap if present, instead of scanning all PEBs.
+
+region_workers = 0                      # Processes used to handle regions found in a file, 0 handles them serially.
+
+walk_max_depth = 512                    # Deepest UBIFS index branch followed, UBIFS_MAX_LEVELS.
+walk_max_nodes = 0                      # Most UBIFS index nodes walked, 0 for no limit.
+walk_physical_order = False             # Read UBIFS index nodes in file order instead of key order.
+extract_physical_order = False          # Read data of all extracted files in one pass in file order.
+extract_workers = 0                     # Threads writing regular files, 0 writes them while extracting the tree.
+
+decompress_workers = 0                  # Parallel data node decryption and decompression workers, 0 is serial.
+decompress_use_processes = False        # Use a process pool instead of a thread pool for data nodes.
+decompress_backends = {}                # Backend to use per compression, e.g. {'zlib': 'isal'}, default is fastest installed.
@@ -20,6 +20,7 @@
 from __future__ import annotations
 from typing import TYPE_CHECKING
 from ubireader.debug import error
+from ubireader.scan_index import open_scan_index
 from ubireader.ubi.block import sort, extract_blocks
 from ubireader.ubi import display
 from ubireader.ubi.image import description as image
@@ -44,12 +45,16 @@ class ubi_base(object):
     Int:peb_size       -- Size of Physical Erase Blocks.
     Int:min_io         -- Size of min I/O from vid_hdr_offset.
     Dict:blocks        -- Dict keyed by PEB number of all blocks.
+    Bool:from_fastmap  -- Blocks are only those listed in the fastmap.
     """
 
     def __init__(self, ubi_file: UbiFile) -> None:
         self.__name__ = 'UBI'
         self._file = ubi_file
         self._first_peb_num = 0
+        self._from_fastmap = False
+        # extract_blocks moves start_offset past non UBI blocks.
+        self._scan_range = (ubi_file.start_offset, ubi_file.end_offset, ubi_file.block_size)
         self._blocks = extract_blocks(self)
         self._block_count = len(self.blocks)
 
@@ -93,6 +98,18 @@ class ubi_base(object):
     first_peb_num = property(_get_first_peb_num, _set_first_peb_num)
 
 
+    def _set_from_fastmap(self, i: bool) -> None:
+        self._from_fastmap = i
+    def _get_from_fastmap(self) -> bool:
+        """Attached from fastmap
+
+        Returns:
+        Bool -- True if only the PEBs listed in the fastmap were read.
+        """
+        return self._from_fastmap
+    from_fastmap = property(_get_from_fastmap, _set_from_fastmap)
+
+
     def _get_leb_size(self) -> int:
         """LEB size of UBI blocks in file.
 
@@ -152,12 +169,12 @@ class ubi(ubi_base):
     def __init__(self, ubi_file: UbiFile) -> None:
         super(ubi, self).__init__(ubi_file)
 
-        layout_list, data_list, int_vol_list, unknown_list = sort.by_type(self.blocks)
+        index = sort.build_index(self.blocks)
 
-        self._layout_blocks_list = layout_list
-        self._data_blocks_list = data_list
-        self._int_vol_blocks_list = int_vol_list
-        self._unknown_blocks_list = unknown_list
+        self._layout_blocks_list = index['layout']
+        self._data_blocks_list = index['data']
+        self._int_vol_blocks_list = index['int_vol']
+        self._unknown_blocks_list = index['unknown']
         
         newest_layout_list = rm_old_blocks(self.blocks, self.layout_blocks_list)
         
@@ -166,11 +183,23 @@ class ubi(ubi_base):
 
         layout_pairs = layout.group_pairs(self.blocks, newest_layout_list)
 
-        layout_infos = layout.associate_blocks(self.blocks, layout_pairs)
+        layout_infos = layout.associate_blocks(self.blocks, layout_pairs, index)
 
+        # Volume block lists of a fastmap attach only cover the PEBs it
+        # lists, they are neither stored nor taken from the index.
+        scan_index = None if self.from_fastmap else open_scan_index(self.file.path)
         self._images: list[Image] = []
         for i in range(0, len(layout_infos)):
-            self._images.append(image(self.blocks, layout_infos[i]))
+            image_seq = self.blocks[layout_infos[i][0]].ec_hdr.image_seq
+            vol_blocks_lists = None
+            if scan_index:
+                vol_blocks_lists = scan_index.get_volumes(*self._scan_range, image_seq)
+
+            self._images.append(image(self.blocks, layout_infos[i], index, vol_blocks_lists))
+
+            if scan_index and vol_blocks_lists is None:
+                scan_index.put_volumes(*self._scan_range, image_seq,
+                                       {vol.vol_id: vol.block_list for vol in self._images[-1].volumes.values()})
 
 
     def _get_images(self) -> list[Image]:
@@ -18,18 +18,27 @@
 #############################################################
 
 from __future__ import annotations
-from typing import TYPE_CHECKING
+import struct
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import TYPE_CHECKING, Any
 from zlib import crc32
 from ubireader import settings
-from ubireader.debug import error, log, verbose_display, verbose_log
-from ubireader.ubi import display
-from ubireader.ubi.defines import UBI_EC_HDR_SZ, UBI_VID_HDR_SZ, UBI_INTERNAL_VOL_START, UBI_EC_HDR_MAGIC, UBI_CRC32_INIT
+from ubireader.debug import log, verbose_display, verbose_log
+from ubireader.scan_index import open_scan_index
+from ubireader.ubi import display, fastmap
+from ubireader.ubi.defines import UBI_EC_HDR_SZ, UBI_VID_HDR_SZ, UBI_INTERNAL_VOL_START, UBI_EC_HDR_MAGIC, UBI_CRC32_INIT, \
+                                   EC_HDR_FORMAT, EC_HDR_FIELDS, VID_HDR_FORMAT, VID_HDR_FIELDS
 from ubireader.ubi.headers import ec_hdr, vid_hdr, vtbl_recs
 
 if TYPE_CHECKING:
     from collections.abc import Iterable, Mapping
     from ubireader.ubi import ubi_base as UbiBase
     from ubireader.ubi.headers import _vtbl_rec as VtblRec
+    from ubireader.ubi_io import ubi_file as UbiFile
+
+# Settings a process pool worker needs to scan like the parent does.
+_SCAN_SETTINGS = ('error_action', 'fatal_traceback', 'ignore_block_header_errors',
+                  'logging_on', 'logging_on_verbose', 'use_mmap')
 
 class description(object):
     """UBI Block description Object
@@ -50,13 +59,19 @@ class description(object):
     Int:leb_num          -- Logical Erase Block number.
     Int:file_offset      -- Address location in file of this block.
     Int:size             -- Size of total block data or PEB size.
-    Int:data_crc         -- crc32 of block data.
+    Int:data_crc         -- crc32 of block data, read from file on
+                            first use if created with ubi_file.
     Will print out all information when invoked as a string.
-    """
 
-    data_crc: int
+    Arguments:
+    Bin:block_buf        -- Block data, at least up to the end of the
+                            VID header. The volume table records are
+                            only parsed if it holds the data area too.
+    Obj:ubi_file         -- (optional) File the block is in, data_crc
+                            is computed from block_buf if not given.
+    """
 
-    def __init__(self, block_buf: bytes) -> None:
+    def __init__(self, block_buf: bytes, ubi_file: UbiFile | None = None) -> None:
  
         self.file_offset = -1
         self.peb_num = -1
@@ -66,6 +81,8 @@ class description(object):
         self.vid_hdr: vid_hdr | None = None
         self.is_internal_vol = False
         self.vtbl_recs: list[VtblRec] = []
+        self._file = ubi_file
+        self._data_crc: int | None = None
 
         # TODO better understanding of block types/errors
         self.ec_hdr = ec_hdr(block_buf[0:UBI_EC_HDR_SZ])
@@ -81,10 +98,30 @@ class description(object):
 
                 self.leb_num = self.vid_hdr.lnum
 
+            if ubi_file is None:
+                self._data_crc = (~crc32(block_buf[self.ec_hdr.data_offset:self.ec_hdr.data_offset+self.vid_hdr.data_size]) & UBI_CRC32_INIT)
+
         self.is_vtbl = bool(self.vtbl_recs) or False
         self.is_valid = not self.ec_hdr.errors and not self.vid_hdr.errors or settings.ignore_block_header_errors
 
 
+    def __getstate__(self) -> dict:
+        state = self.__dict__.copy()
+        state['_file'] = None
+        return state
+
+
+    def _get_data_crc(self) -> int:
+        if self._data_crc is None:
+            size = min(self.vid_hdr.data_size, self.size - self.ec_hdr.data_offset)
+            buf = self._file.read_at(self.file_offset + self.ec_hdr.data_offset, size)
+            self._data_crc = (~crc32(buf) & UBI_CRC32_INIT)
+        return self._data_crc
+    def _set_data_crc(self, crc: int) -> None:
+        self._data_crc = crc
+    data_crc = property(_get_data_crc, _set_data_crc)
+
+
     def __repr__(self) -> str:
         return 'Block: PEB# %s: LEB# %s' % (self.peb_num, self.leb_num)
 
@@ -111,6 +148,148 @@ def get_blocks_in_list(blocks: Mapping[int, description], idx_list: Iterable[int
 
 
 
+def _read_block_headers(ubi_file: UbiFile, offset: int) -> bytes:
+    """Read block up to the end of its VID header
+
+    Arguments:
+    Obj:ubi_file -- UBI file object.
+    Int:offset   -- Address of the block in file.
+
+    Returns:
+    Bin -- Block headers, or the whole block if it belongs to an
+           internal volume, as its data holds the volume table.
+    """
+    ec_buf = ubi_file.read_at(offset, UBI_EC_HDR_SZ)
+    vid_hdr_offset = struct.unpack(EC_HDR_FORMAT, ec_buf)[EC_HDR_FIELDS.index('vid_hdr_offset')]
+
+    buf = ubi_file.read_at(offset, min(vid_hdr_offset + UBI_VID_HDR_SZ, ubi_file.block_size))
+    vid_buf = buf[vid_hdr_offset:vid_hdr_offset + UBI_VID_HDR_SZ]
+
+    if len(vid_buf) == UBI_VID_HDR_SZ and \
+        struct.unpack(VID_HDR_FORMAT, vid_buf)[VID_HDR_FIELDS.index('vol_id')] >= UBI_INTERNAL_VOL_START:
+        buf = ubi_file.read_at(offset, ubi_file.block_size)
+
+    return buf
+
+
+def _scan_blocks(ubi_file: UbiFile, offsets: Iterable[int]) -> list[description]:
+    """Find UBI blocks at block offsets in file
+
+    Arguments:
+    Obj:ubi_file -- UBI file object.
+    List:offsets -- Addresses of blocks to check.
+
+    Returns:
+    List -- Of block objects in order of offsets, peb_num is not set.
+    """
+    blocks: list[description] = []
+
+    for i in offsets:
+        buf = ubi_file.read_at(i, UBI_EC_HDR_SZ)
+
+        if buf[:len(UBI_EC_HDR_MAGIC)] == UBI_EC_HDR_MAGIC:
+            blk = description(_read_block_headers(ubi_file, i), ubi_file)
+            blk.file_offset = i
+            blk.size = ubi_file.block_size
+            blocks.append(blk)
+
+    return blocks
+
+
+def _scan_shard(path: str, block_size: int, start_offset: int, end_offset: int,
+                start: int, end: int, options: dict[str, Any]) -> list[description]:
+    """Process pool worker of _parallel_scan
+
+    Arguments:
+    Str:path          -- Path to the image file.
+    Int:block_size    -- PEB size.
+    Int:start_offset  -- start_offset of the parent ubi_file.
+    Int:end_offset    -- end_offset of the parent ubi_file.
+    Int:start         -- Address to start scanning at.
+    Int:end           -- Address to stop scanning at.
+    Dict:options      -- Settings of the parent process.
+
+    Returns:
+    List -- Of block objects in file order, without file object.
+    """
+    from ubireader.ubi_io import ubi_file
+
+    for key, value in options.items():
+        setattr(settings, key, value)
+
+    # Parent already warned about a partial last block.
+    end_offset -= (end_offset - start_offset) % block_size
+
+    with ubi_file(path, block_size, start_offset, end_offset) as shard_file:
+        return _scan_blocks(shard_file, range(start, end, block_size))
+
+
+def _parallel_scan(ubi_file: UbiFile, workers: int) -> list[description]:
+    """Scan file for UBI blocks with a pool of workers
+
+    Arguments:
+    Obj:ubi_file -- UBI file object.
+    Int:workers  -- Number of pool workers.
+
+    Returns:
+    List -- Of block objects in file order, peb_num is not set.
+
+    File is split into block aligned shards, a few per worker so
+    they even out. Uses a process pool, unless settings.scan_use_threads
+    is set.
+    """
+    offsets = range(ubi_file.start_offset, ubi_file.end_offset, ubi_file.block_size)
+    shard_len = max(1, -(-len(offsets) // (workers * 4))) * ubi_file.block_size
+    shards = [(i, min(i + shard_len, ubi_file.end_offset)) for i in offsets[::shard_len // ubi_file.block_size]]
+    log(extract_blocks, 'Scanning %s shards with %s workers' % (len(shards), workers))
+
+    if settings.scan_use_threads:
+        with ThreadPoolExecutor(workers) as executor:
+            futures = [executor.submit(_scan_blocks, ubi_file, range(start, end, ubi_file.block_size)) for start, end in shards]
+            return [blk for future in futures for blk in future.result()]
+
+    options = {key: getattr(settings, key) for key in _SCAN_SETTINGS}
+    with ProcessPoolExecutor(workers) as executor:
+        futures = [executor.submit(_scan_shard, ubi_file.path, ubi_file.block_size, ubi_file.start_offset,
+                                   ubi_file.end_offset, start, end, options) for start, end in shards]
+        blocks = [blk for future in futures for blk in future.result()]
+
+    for blk in blocks:
+        blk._file = ubi_file
+
+    return blocks
+
+
+def _fastmap_blocks(ubi_file: UbiFile) -> list[description] | None:
+    """Read blocks listed in the fastmap of the image
+
+    Arguments:
+    Obj:ubi_file -- UBI file object.
+
+    Returns:
+    List -- Of block objects in file order, peb_num is not set.
+            None if there is no valid fastmap.
+
+    Reads the fastmap blocks, the pool PEBs and the PEBs mapped in
+    the EBA tables, instead of every block in file.
+    """
+    anchor = fastmap.find_anchor(ubi_file)
+    if anchor is None:
+        return None
+
+    fm = fastmap.fastmap(ubi_file, anchor)
+    if not fm.is_valid:
+        return None
+
+    offsets = [ubi_file.start_offset + peb_num * ubi_file.block_size for peb_num in sorted(fm.pebs)]
+    blocks = _scan_blocks(ubi_file, [i for i in offsets if i < ubi_file.end_offset])
+
+    if not fm.check_blocks({(blk.file_offset - ubi_file.start_offset) // ubi_file.block_size: blk for blk in blocks}):
+        return None
+
+    return blocks
+
+
 def extract_blocks(ubi: UbiBase) -> dict[int, description]:
     """Get a list of UBI block objects from file
 
@@ -119,99 +298,137 @@ def extract_blocks(ubi: UbiBase) -> dict[int, description]:
     
     Returns:
     Dict -- Of block objects keyed by PEB number.
+
+    Only block headers are read, block data is read when
+    needed, e.g. for data_crc. If settings.scan_workers is set
+    the file is scanned in parallel. Block headers are loaded from
+    and stored in the scan index, if enabled. If the image has a valid
+    fastmap and settings.use_fastmap is set, only the blocks it lists
+    are read.
     """
 
     blocks: dict[int, description] = {}
-    ubi.file.seek(ubi.file.start_offset)
-    peb_count = 0
-    cur_offset = 0
     bad_blocks: list[int] = []
-
-    # range instead of xrange, as xrange breaks > 4GB end_offset.
-    for i in range(ubi.file.start_offset, ubi.file.end_offset, ubi.file.block_size):
-        buf = ubi.file.read(ubi.file.block_size)
-
-        if buf.startswith(UBI_EC_HDR_MAGIC):
-            blk = description(buf)
-            blk.file_offset = i
-            blk.peb_num = ubi.first_peb_num + peb_count
+    start = ubi.file.start_offset
+    block_count = len(range(start, ubi.file.end_offset, ubi.file.block_size))
+
+    scan_index = open_scan_index(ubi.file.path)
+    headers = None
+    if scan_index:
+        headers = scan_index.get_blocks(start, ubi.file.end_offset, ubi.file.block_size)
+
+    fm_blocks = None
+    if headers is None and settings.use_fastmap:
+        fm_blocks = _fastmap_blocks(ubi.file)
+
+    if headers is not None:
+        found = []
+        for file_offset, buf in headers:
+            blk = description(buf, ubi.file)
+            blk.file_offset = file_offset
             blk.size = ubi.file.block_size
-            blk.data_crc = (~crc32(buf[blk.ec_hdr.data_offset:blk.ec_hdr.data_offset+blk.vid_hdr.data_size]) & UBI_CRC32_INIT)
-            blocks[blk.peb_num] = blk
-            peb_count += 1
-            log(extract_blocks, blk)
-            verbose_log(extract_blocks, 'file addr: %s' % (ubi.file.last_read_addr()))
-            ec_hdr_errors = ''
-            vid_hdr_errors = ''
-
-            if blk.ec_hdr.errors:
-                ec_hdr_errors = ','.join(blk.ec_hdr.errors)
-
-            if blk.vid_hdr and blk.vid_hdr.errors:
-                vid_hdr_errors = ','.join(blk.vid_hdr.errors)
-
-            if ec_hdr_errors or vid_hdr_errors:
-                if blk.peb_num not in bad_blocks:
-                    bad_blocks.append(blk.peb_num)
-                    log(extract_blocks, 'PEB: %s has possible issue EC_HDR [%s], VID_HDR [%s]' % (blk.peb_num, ec_hdr_errors, vid_hdr_errors))
-
-            verbose_display(blk)
-
-        else:
-            cur_offset += ubi.file.block_size
-            ubi.first_peb_num = cur_offset//ubi.file.block_size
-            ubi.file.start_offset = cur_offset
+            found.append(blk)
+
+    elif fm_blocks is not None:
+        found = fm_blocks
+        ubi.from_fastmap = True
+        log(extract_blocks, 'Attached from fastmap, read %s of %s PEBs' % (len(found), block_count))
+
+    elif settings.scan_workers > 0:
+        found = _parallel_scan(ubi.file, settings.scan_workers)
+    else:
+        found = _scan_blocks(ubi.file, range(start, ubi.file.end_offset, ubi.file.block_size))
+
+    # Headers are read again, they are not kept while scanning. Fastmap
+    # results are not stored, it only lists some blocks and is cheap to read.
+    if scan_index and headers is None and fm_blocks is None:
+        scan_index.put_blocks(start, ubi.file.end_offset, ubi.file.block_size,
+                              [(blk.file_offset, bytes(_read_block_headers(ubi.file, blk.file_offset))) for blk in found])
+
+    for blk in found:
+        # PEB numbers count from start_offset, non UBI blocks included.
+        blk.peb_num = (blk.file_offset - start) // ubi.file.block_size
+        blocks[blk.peb_num] = blk
+        log(extract_blocks, blk)
+        verbose_log(extract_blocks, 'file addr: %s' % (blk.file_offset))
+        ec_hdr_errors = ''
+        vid_hdr_errors = ''
+
+        if blk.ec_hdr.errors:
+            ec_hdr_errors = ','.join(blk.ec_hdr.errors)
+
+        if blk.vid_hdr and blk.vid_hdr.errors:
+            vid_hdr_errors = ','.join(blk.vid_hdr.errors)
+
+        if ec_hdr_errors or vid_hdr_errors:
+            if blk.peb_num not in bad_blocks:
+                bad_blocks.append(blk.peb_num)
+                log(extract_blocks, 'PEB: %s has possible issue EC_HDR [%s], VID_HDR [%s]' % (blk.peb_num, ec_hdr_errors, vid_hdr_errors))
+
+        verbose_display(blk)
+
+    non_ubi_count = block_count - len(found)
+    if non_ubi_count and fm_blocks is None:
+        ubi.first_peb_num = non_ubi_count
+        ubi.file.start_offset = non_ubi_count * ubi.file.block_size
 
     return blocks
 
 
 def rm_old_blocks(blocks: Mapping[int, description], block_list: Iterable[int]) -> list[int]:
-    del_blocks: list[int] = []
-
-    for i in block_list:
-        if i in del_blocks:
-            continue
+    """Remove invalid blocks and old copies of LEBs from block list
 
-        if blocks[i].is_valid is not True:
-            del_blocks.append(i)
-            continue
+    Arguments:
+    Dict:blocks      -- Block objects keyed by PEB number.
+    List:block_list  -- PEB numbers to filter.
 
-        for k in block_list:
-            if i == k:
-                continue
+    Returns:
+    List -- PEB numbers of block_list left, in the same order.
 
-            if k in del_blocks:
-                continue
+    Blocks are grouped by (image_seq, leb_num), each block of a
+    group is resolved against the current survivor of the group.
+    The newer block by sqnum wins if its copy_flag is 0, otherwise
+    the newer block only wins if its data_crc checks out.
+    """
+    block_list = list(block_list)
+    del_blocks: set[int] = set()
+    # (image_seq, leb_num): [surviving PEB, survivor came first in the comparison]
+    newest: dict[tuple[int, int], list[Any]] = {}
+
+    for j in block_list:
+        if blocks[j].is_valid is not True:
+            del_blocks.add(j)
+            continue
 
-            if blocks[k].is_valid is not True:
-                del_blocks.append(k)
-                continue
+        key = (blocks[j].ec_hdr.image_seq, blocks[j].leb_num)
+        if key not in newest:
+            newest[key] = [j, True]
+            continue
 
-            if blocks[i].leb_num != blocks[k].leb_num:
-                continue
+        cur, cur_first = newest[key]
+        if cur_first:
+            i, k = cur, j
+        else:
+            i, k = j, cur
 
-            if blocks[i].ec_hdr.image_seq != blocks[k].ec_hdr.image_seq:
-                continue
+        second_newer =  blocks[k].vid_hdr.sqnum > blocks[i].vid_hdr.sqnum
+        del_block = None
+        use_block = None
 
-            second_newer =  blocks[k].vid_hdr.sqnum > blocks[i].vid_hdr.sqnum
-            del_block = None
-            use_block = None
-            
-            if second_newer:
-                if blocks[k].vid_hdr.copy_flag == 0:
-                    del_block = i
-                    use_block = k
+        if second_newer:
+            if blocks[k].vid_hdr.copy_flag == 0:
+                del_block = i
+                use_block = k
 
-            else:
-                if blocks[i].vid_hdr.copy_flag == 0:
-                    del_block = k
-                    use_block = i
+        else:
+            if blocks[i].vid_hdr.copy_flag == 0:
+                del_block = k
+                use_block = i
 
-            if del_block is not None:
-                del_blocks.append(del_block)
-                log(rm_old_blocks, 'Old block removed (copy_flag): PEB %s, LEB %s, Using PEB%s' % (blocks[del_block].peb_num, blocks[del_block].leb_num, use_block))
-                break
+        if del_block is not None:
+            log(rm_old_blocks, 'Old block removed (copy_flag): PEB %s, LEB %s, Using PEB%s' % (blocks[del_block].peb_num, blocks[del_block].leb_num, use_block))
 
+        else:
             if second_newer:
                 if blocks[k].data_crc != blocks[k].vid_hdr.data_crc:
                     del_block = k
@@ -227,19 +444,15 @@ def rm_old_blocks(blocks: Mapping[int, description], block_list: Iterable[int])
                     del_block = k
                     use_block = i
 
-            if del_block is not None:
-                del_blocks.append(del_block)
-                log(rm_old_blocks, 'Old block removed (data_crc): PEB %s, LEB %s, vid_hdr.data_crc %s / %s, Using PEB %s' % (blocks[del_block].peb_num,
-                                                                                                                           blocks[del_block].leb_num,
-                                                                                                                           blocks[del_block].vid_hdr.data_crc,
-                                                                                                                           blocks[del_block].data_crc,
-                                                                                                                           use_block))
-
-            else:
-                use_block = min(k, i)
-                del_blocks.append(use_block)
-                error('Warn', rm_old_blocks, 'Multiple PEB [%s] for LEB %s: Using first.' % (', '.join(i, k), blocks[i].leb_num, use_block))
+            log(rm_old_blocks, 'Old block removed (data_crc): PEB %s, LEB %s, vid_hdr.data_crc %s / %s, Using PEB %s' % (blocks[del_block].peb_num,
+                                                                                                                       blocks[del_block].leb_num,
+                                                                                                                       blocks[del_block].vid_hdr.data_crc,
+                                                                                                                       blocks[del_block].data_crc,
+                                                                                                                       use_block))
 
-            break
+        del_blocks.add(del_block)
+        # Same comparison order as the old pairwise scan, a block that
+        # came second or won as first is compared second from then on.
+        newest[key] = [use_block, cur_first and use_block == j]
 
     return [j for j in block_list if j not in del_blocks]
@@ -25,6 +25,7 @@ from ubireader.ubi.block import sort
 if TYPE_CHECKING:
     from collections.abc import Iterable, Mapping
     from ubireader.ubi.block import description as Block
+    from ubireader.ubi.block.sort import BlockIndex
 
 class _LayoutPair(Protocol):
     def __getitem__(self, idx: Literal[0, 1], /) -> int: ...
@@ -59,12 +60,13 @@ class _LayoutInfo(_LayoutPair, Protocol):
     @overload
     def __getitem__(self, idx: Literal[2], /) -> list[int]: ...
 
-def associate_blocks(blocks: Mapping[int, Block], layout_pairs: list[_LayoutPair]) -> list[_LayoutInfo]:
+def associate_blocks(blocks: Mapping[int, Block], layout_pairs: list[_LayoutPair], index: BlockIndex | None = None) -> list[_LayoutInfo]:
     """Group block indexes with appropriate layout pairs
 
     Arguments:
     List:blocks        -- List of block objects
     List:layout_pairs  -- List of grouped layout blocks
+    Dict:index         -- (optional) Block index from sort.build_index().
 
     Returns:
     List -- Layout block pairs grouped with associated block ranges.
@@ -72,7 +74,10 @@ def associate_blocks(blocks: Mapping[int, Block], layout_pairs: list[_LayoutPair
 
     seq_blocks: list[int] = []
     for layout_pair in layout_pairs:
-        seq_blocks = sort.by_image_seq(blocks, blocks[layout_pair[0]].ec_hdr.image_seq)
+        if index is None:
+            seq_blocks = sort.by_image_seq(blocks, blocks[layout_pair[0]].ec_hdr.image_seq)
+        else:
+            seq_blocks = sort.index_by_image_seq(index, blocks[layout_pair[0]].ec_hdr.image_seq)
         seq_blocks = [b for b in seq_blocks if b not in layout_pair]
         layout_pair.append(seq_blocks)
 
@@ -18,13 +18,107 @@
 #############################################################
 
 from __future__ import annotations
-from typing import TYPE_CHECKING, Literal
+from typing import TYPE_CHECKING, Literal, TypedDict
 from ubireader import settings
 
 if TYPE_CHECKING:
-    from collections.abc import Mapping
+    from collections.abc import Iterable, Mapping
     from ubireader.ubi.block import description as Block
 
+class BlockIndex(TypedDict):
+    image_seq: dict[int, list[int]]
+    vol_id: dict[int, dict[int, list[int]]]
+    layout: list[int]
+    data: list[int]
+    int_vol: list[int]
+    unknown: list[int]
+
+def build_index(blocks: Mapping[int, Block]) -> BlockIndex:
+    """Index blocks by image_seq, volume id and type in one pass.
+
+    Arguments:
+    List:blocks      -- List of block objects to index.
+
+    Returns:
+    Dict:BlockIndex  -- Lists of block indexes, in order of blocks.
+        'image_seq'  -- All blocks keyed by ec_hdr image_seq.
+        'vol_id'     -- Valid blocks keyed by image_seq, then by
+                        volume id.
+        'layout', 'data', 'int_vol', 'unknown'
+                     -- Blocks by type, same as by_type().
+    """
+    index: BlockIndex = {'image_seq': {}, 'vol_id': {}, 'layout': [], 'data': [], 'int_vol': [], 'unknown': []}
+
+    for i in blocks:
+        image_seq = blocks[i].ec_hdr.image_seq
+        index['image_seq'].setdefault(image_seq, []).append(i)
+
+        if not blocks[i].is_valid:
+            index['unknown'].append(i)
+            continue
+
+        vol_ids = index['vol_id'].setdefault(image_seq, {})
+        vol_ids.setdefault(blocks[i].vid_hdr.vol_id, []).append(blocks[i].peb_num)
+
+        if blocks[i].is_vtbl:
+            index['layout'].append(i)
+
+        elif blocks[i].is_internal_vol:
+            index['int_vol'].append(i)
+
+        else:
+            index['data'].append(i)
+
+    return index
+
+def _index_image_seqs(index: BlockIndex, image_seq: int) -> list[int]:
+    """image_seq numbers of blocks that belong to image_seq, see by_image_seq()."""
+    if settings.uboot_fix:
+        if image_seq == 0:
+            return list(index['image_seq'])
+        return [seq for seq in (image_seq, 0) if seq in index['image_seq']]
+
+    return [image_seq] if image_seq in index['image_seq'] else []
+
+def index_by_image_seq(index: BlockIndex, image_seq: int) -> list[int]:
+    """Same as by_image_seq(), looked up in a block index.
+
+    Argument:
+    Dict:index     -- Block index from build_index().
+    Int:image_seq  -- image_seq number found in ec_hdr.
+
+    Returns:
+    List        -- List of block indexes matching image_seq number.
+    """
+    seqs = _index_image_seqs(index, image_seq)
+    if len(seqs) == 1:
+        return list(index['image_seq'][seqs[0]])
+
+    return sorted(i for seq in seqs for i in index['image_seq'][seq])
+
+def index_by_vol_id(index: BlockIndex, image_seq: int) -> dict[int, list[int]]:
+    """Same as by_vol_id() of blocks matching image_seq, looked up in a block index.
+
+    Argument:
+    Dict:index     -- Block index from build_index().
+    Int:image_seq  -- image_seq number found in ec_hdr.
+
+    Return:
+    Dict -- blocks grouped in lists with dict key as volume id.
+    """
+    vol_blocks: dict[int, list[int]] = {}
+    seqs = _index_image_seqs(index, image_seq)
+
+    for seq in seqs:
+        for vol_id, vol_list in index['vol_id'].get(seq, {}).items():
+            vol_blocks.setdefault(vol_id, []).extend(vol_list)
+
+    if len(seqs) > 1:
+        for vol_id in vol_blocks:
+            vol_blocks[vol_id].sort()
+
+    return vol_blocks
+
 def by_image_seq(blocks: Mapping[int, Block], image_seq: int) -> list[int]:
     """Filter blocks to return only those associated with the provided image_seq number.
        If uboot_fix is set, associate blocks with an image_seq of 0 also.
@@ -65,7 +159,7 @@ def by_leb(blocks: Mapping[int, Block]) -> list[Literal['x'] | int]:
     return slist
 
 
-def by_vol_id(blocks: Mapping[int, Block], slist: list[int] | None = None) -> dict[int, list[int]]:
+def by_vol_id(blocks: Mapping[int, Block], slist: Iterable[int] | None = None) -> dict[int, list[int]]:
     """Sort blocks by volume id
 
     Arguments:
@@ -78,6 +172,9 @@ def by_vol_id(blocks: Mapping[int, Block], slist: list[int] | None = None) -> di
 
     vol_blocks: dict[int, list[int]] = {}
 
+    if slist:
+        slist = set(slist)
+
     # sort block by volume
     # not reliable with multiple partitions (fifo)
 
@@ -94,7 +191,7 @@ def by_vol_id(blocks: Mapping[int, Block], slist: list[int] | None = None) -> di
 
     return vol_blocks
 
-def by_type(blocks: Mapping[int, Block], slist: list[int] | None = None) -> tuple[list[int], list[int], list[int], list[int]]:
+def by_type(blocks: Mapping[int, Block], slist: Iterable[int] | None = None) -> tuple[list[int], list[int], list[int], list[int]]:
     """Sort blocks into layout, internal volume, data or unknown
 
     Arguments:
@@ -116,7 +213,10 @@ def by_type(blocks: Mapping[int, Block], slist: list[int] | None = None) -> tupl
     data: list[int] = []
     int_vol: list[int] = []
     unknown: list[int] = []
-    
+
+    if slist:
+        slist = set(slist)
+
     for i in blocks:
         if slist and i not in slist:
             continue
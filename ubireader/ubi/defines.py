@@ -115,5 +115,74 @@ UBI_COMPAT_PRESERVE = 4 # Preserve this internal volume - touch nothing.
 UBI_COMPAT_REJECT   = 5 # Reject this UBI image
 PRINT_COMPAT_LIST = [0, 'Delete', 'Read Only', 0, 'Preserve', 'Reject']
 
+# Fastmap
+UBI_FM_SB_VOLUME_ID   = UBI_INTERNAL_VOL_START + 1 # Fastmap anchor, holds the superblock.
+UBI_FM_DATA_VOLUME_ID = UBI_INTERNAL_VOL_START + 2 # Rest of the fastmap data.
+UBI_FM_FMT_VERSION    = 2
+UBI_FM_MAX_START      = 64  # Anchor is within this many PEBs of the start.
+UBI_FM_MAX_BLOCKS     = 32
+UBI_FM_MAX_POOL_SIZE  = 256
+UBI_FM_SB_MAGIC       = 0x7B11D69F
+UBI_FM_HDR_MAGIC      = 0xD4B82EF7
+UBI_FM_VHDR_MAGIC     = 0xFA370ED1
+UBI_FM_POOL_MAGIC     = 0x67AF4D08
+UBI_FM_EBA_MAGIC      = 0xF0C040A8
+UBI_FM_UNMAPPED       = 0xFFFFFFFF  # -1 pnum in EBA table.
+
+# Fastmap superblock.
+FM_SB_FORMAT = '>IB3sII%ss%ssQ32s' % (UBI_FM_MAX_BLOCKS * 4, UBI_FM_MAX_BLOCKS * 4)
+FM_SB_FIELDS = ['magic',        # Fastmap superblock magic.
+                'version',      # Fastmap format version.
+                'padding1',     # Reserved for future, zeros.
+                'data_crc',     # CRC32 of fastmap data, with this field zeroed.
+                'used_blocks',  # Number of PEBs used by fastmap.
+                'block_loc',    # PEB numbers of fastmap blocks.
+                'block_ec',     # Erase counters of fastmap blocks.
+                'sqnum',        # Highest sequence number when fastmap was written.
+                'padding2']     # Reserved for future, zeros.
+UBI_FM_SB_SZ = struct.calcsize(FM_SB_FORMAT) # 312
+
+# Fastmap header.
+FM_HDR_FORMAT = '>IIIIIII4s'
+FM_HDR_FIELDS = ['magic',           # Fastmap header magic.
+                 'free_peb_count',  # Number of free PEBs.
+                 'used_peb_count',  # Number of used PEBs.
+                 'scrub_peb_count', # Number of PEBs to scrub.
+                 'bad_peb_count',   # Number of bad PEBs.
+                 'erase_peb_count', # Number of PEBs to erase.
+                 'vol_count',       # Number of volumes.
+                 'padding']         # Reserved for future, zeros.
+UBI_FM_HDR_SZ = struct.calcsize(FM_HDR_FORMAT) # 32
+
+# Fastmap pool, PEBs that may have been written after the fastmap.
+FM_POOL_FORMAT = '>IHH%ss16s' % (UBI_FM_MAX_POOL_SIZE * 4)
+FM_POOL_FIELDS = ['magic',      # Fastmap pool magic.
+                  'size',       # Number of PEBs in pool.
+                  'max_size',   # Max number of PEBs in pool.
+                  'pebs',       # PEB numbers in pool.
+                  'padding']    # Reserved for future, zeros.
+UBI_FM_POOL_SZ = struct.calcsize(FM_POOL_FORMAT) # 1048
+
+# Fastmap erase counter record, after the pools.
+UBI_FM_EC_SZ = struct.calcsize('>II') # 8
+
+# Fastmap volume header.
+FM_VHDR_FORMAT = '>IIB3sIII8s'
+FM_VHDR_FIELDS = ['magic',          # Fastmap volume header magic.
+                  'vol_id',         # Volume ID.
+                  'vol_type',       # Volume type.
+                  'padding1',       # Reserved for future, zeros.
+                  'data_pad',       # Data padding.
+                  'used_ebs',       # Number of used LEBs, static only.
+                  'last_eb_bytes',  # Bytes in last LEB, static only.
+                  'padding2']       # Reserved for future, zeros.
+UBI_FM_VHDR_SZ = struct.calcsize(FM_VHDR_FORMAT) # 32
+
+# Fastmap EBA table, followed by reserved_pebs PEB numbers.
+FM_EBA_FORMAT = '>II'
+FM_EBA_FIELDS = ['magic',           # Fastmap EBA table magic.
+                 'reserved_pebs']   # Number of PEB numbers following.
+UBI_FM_EBA_SZ = struct.calcsize(FM_EBA_FORMAT) # 8
+
 # File chunk size for reads.
 FILE_CHUNK_SZ = 5 * 1024 * 1024
\ No newline at end of file
@@ -0,0 +1,237 @@
+#!/usr/bin/env python
+#############################################################
+# ubi_reader/ubi
+# (c) 2013 Jason Pruitt (jrspruitt@gmail.com)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#############################################################
+
+from __future__ import annotations
+import struct
+from typing import TYPE_CHECKING
+from zlib import crc32
+from ubireader.debug import log
+from ubireader.ubi.defines import *
+from ubireader.ubi.headers import ec_hdr, vid_hdr
+
+if TYPE_CHECKING:
+    from collections.abc import Mapping
+    from ubireader.ubi.block import description as Block
+    from ubireader.ubi_io import ubi_file as UbiFile
+
+
+def _unpack(fmt: str, fields: list[str], buf: bytes, offset: int) -> dict:
+    size = struct.calcsize(fmt)
+    if len(buf) < offset + size:
+        raise ValueError('Fastmap data too short.')
+    return dict(zip(fields, struct.unpack(fmt, buf[offset:offset + size])))
+
+
+def _read_headers(ubi_file: UbiFile, peb_num: int) -> tuple[ec_hdr, vid_hdr] | None:
+    """EC and VID header of PEB, None if they are not both valid."""
+    offset = ubi_file.start_offset + peb_num * ubi_file.block_size
+    if offset + ubi_file.block_size > ubi_file.end_offset:
+        return None
+
+    buf = ubi_file.read_at(offset, UBI_EC_HDR_SZ)
+    if buf[:len(UBI_EC_HDR_MAGIC)] != UBI_EC_HDR_MAGIC:
+        return None
+
+    ec = ec_hdr(buf)
+    if ec.errors or ec.vid_hdr_offset + UBI_VID_HDR_SZ > ubi_file.block_size:
+        return None
+
+    vid = vid_hdr(ubi_file.read_at(offset + ec.vid_hdr_offset, UBI_VID_HDR_SZ))
+    if vid.errors or vid.magic != UBI_VID_HDR_MAGIC:
+        return None
+
+    return ec, vid
+
+
+def find_anchor(ubi_file: UbiFile) -> int | None:
+    """Find fastmap anchor PEB
+
+    Arguments:
+    Obj:ubi_file -- UBI file object.
+
+    Returns:
+    Int          -- PEB number of the newest anchor, relative to
+                    start_offset, None if there is none.
+
+    Only the first UBI_FM_MAX_START PEBs can hold the anchor.
+    """
+    anchor = None
+    anchor_sqnum = -1
+
+    for peb_num in range(0, UBI_FM_MAX_START):
+        headers = _read_headers(ubi_file, peb_num)
+        if headers is None:
+            continue
+
+        _, vid = headers
+        if vid.vol_id == UBI_FM_SB_VOLUME_ID and vid.sqnum > anchor_sqnum:
+            anchor = peb_num
+            anchor_sqnum = vid.sqnum
+
+    return anchor
+
+
+class fastmap(object):
+    """UBI fastmap
+
+    Arguments:
+    Obj:ubi_file    -- UBI file object.
+    Int:anchor      -- PEB number of fastmap anchor.
+
+    Attributes:
+    Bool:is_valid   -- If fastmap was read and validated.
+    Int:sqnum       -- Highest sequence number when fastmap was written.
+    List:block_loc  -- PEB numbers of fastmap blocks.
+    List:pools      -- PEB numbers in the pools, these may have been
+                       written after the fastmap.
+    Dict:eba        -- Lists of PEB numbers indexed by LEB, keyed by
+                       volume id. UBI_FM_UNMAPPED if LEB is unmapped.
+    Set:pebs        -- All PEB numbers needed to attach the image.
+
+    PEB numbers are relative to start_offset of ubi_file.
+    """
+
+    def __init__(self, ubi_file: UbiFile, anchor: int) -> None:
+        self.__name__ = 'fastmap'
+        self.is_valid = False
+        self.sqnum = -1
+        self.block_loc: list[int] = []
+        self.pools: list[int] = []
+        self.eba: dict[int, list[int]] = {}
+
+        try:
+            self._parse(self._read_data(ubi_file, anchor))
+            self.is_valid = True
+            log(self, 'Found at PEB %s, %s volumes, %s pool PEBs' % (anchor, len(self.eba), len(self.pools)))
+        except ValueError as e:
+            log(self, 'Invalid fastmap at PEB %s: %s' % (anchor, e))
+
+
+    def __repr__(self) -> str:
+        return 'Fastmap'
+
+
+    def _read_data(self, ubi_file: UbiFile, anchor: int) -> bytearray:
+        headers = _read_headers(ubi_file, anchor)
+        if headers is None:
+            raise ValueError('Bad anchor headers.')
+
+        ec, _ = headers
+        leb_size = ubi_file.block_size - ec.data_offset
+        anchor_offset = ubi_file.start_offset + anchor * ubi_file.block_size
+        sb = _unpack(FM_SB_FORMAT, FM_SB_FIELDS, ubi_file.read_at(anchor_offset + ec.data_offset, UBI_FM_SB_SZ), 0)
+
+        if sb['magic'] != UBI_FM_SB_MAGIC:
+            raise ValueError('Bad superblock magic.')
+
+        if sb['version'] > UBI_FM_FMT_VERSION:
+            raise ValueError('Unsupported version %s.' % sb['version'])
+
+        if not 0 < sb['used_blocks'] <= UBI_FM_MAX_BLOCKS:
+            raise ValueError('Bad used block count %s.' % sb['used_blocks'])
+
+        self.sqnum = sb['sqnum']
+        self.block_loc = list(struct.unpack('>%sI' % UBI_FM_MAX_BLOCKS, sb['block_loc'])[:sb['used_blocks']])
+        if self.block_loc[0] != anchor:
+            raise ValueError('Anchor is not first fastmap block.')
+
+        data = bytearray()
+        for i, peb_num in enumerate(self.block_loc):
+            headers = _read_headers(ubi_file, peb_num)
+            vol_id = UBI_FM_SB_VOLUME_ID if i == 0 else UBI_FM_DATA_VOLUME_ID
+            if headers is None or headers[1].vol_id != vol_id:
+                raise ValueError('Bad fastmap block PEB %s.' % peb_num)
+            data += ubi_file.read_at(ubi_file.start_offset + peb_num * ubi_file.block_size + headers[0].data_offset, leb_size)
+
+        crc = sb['data_crc']
+        data[8:12] = b'\x00' * 4
+        if crc != (~crc32(data) & UBI_CRC32_INIT):
+            raise ValueError('Data CRC failed.')
+
+        return data
+
+
+    def _parse(self, data: bytes) -> None:
+        offset = UBI_FM_SB_SZ
+        hdr = _unpack(FM_HDR_FORMAT, FM_HDR_FIELDS, data, offset)
+        offset += UBI_FM_HDR_SZ
+        if hdr['magic'] != UBI_FM_HDR_MAGIC:
+            raise ValueError('Bad header magic.')
+
+        for _ in range(0, 2):
+            pool = _unpack(FM_POOL_FORMAT, FM_POOL_FIELDS, data, offset)
+            offset += UBI_FM_POOL_SZ
+            if pool['magic'] != UBI_FM_POOL_MAGIC:
+                raise ValueError('Bad pool magic.')
+            if pool['size'] > pool['max_size'] or pool['max_size'] > UBI_FM_MAX_POOL_SIZE:
+                raise ValueError('Bad pool size.')
+            self.pools += struct.unpack('>%sI' % UBI_FM_MAX_POOL_SIZE, pool['pebs'])[:pool['size']]
+
+        # Erase counters of free, used, scrub and erase PEBs are not needed.
+        offset += UBI_FM_EC_SZ * (hdr['free_peb_count'] + hdr['used_peb_count'] +
+                                  hdr['scrub_peb_count'] + hdr['erase_peb_count'])
+
+        for _ in range(0, hdr['vol_count']):
+            vhdr = _unpack(FM_VHDR_FORMAT, FM_VHDR_FIELDS, data, offset)
+            offset += UBI_FM_VHDR_SZ
+            if vhdr['magic'] != UBI_FM_VHDR_MAGIC:
+                raise ValueError('Bad volume header magic.')
+
+            eba = _unpack(FM_EBA_FORMAT, FM_EBA_FIELDS, data, offset)
+            offset += UBI_FM_EBA_SZ
+            if eba['magic'] != UBI_FM_EBA_MAGIC:
+                raise ValueError('Bad EBA table magic.')
+
+            size = eba['reserved_pebs'] * 4
+            if len(data) < offset + size:
+                raise ValueError('Fastmap data too short.')
+            self.eba[vhdr['vol_id']] = list(struct.unpack('>%sI' % eba['reserved_pebs'], data[offset:offset + size]))
+            offset += size
+
+
+    def check_blocks(self, blocks: Mapping[int, Block]) -> bool:
+        """Check EBA tables against block headers
+
+        Arguments:
+        Dict:blocks -- Block objects keyed by PEB number.
+
+        Returns:
+        Bool        -- If every mapped LEB is in blocks, at the PEB
+                       the EBA table says.
+        """
+        for vol_id, pebs in self.eba.items():
+            for lnum, peb_num in enumerate(pebs):
+                if peb_num == UBI_FM_UNMAPPED:
+                    continue
+
+                blk = blocks.get(peb_num)
+                if blk is None or not blk.is_valid or blk.vid_hdr.vol_id != vol_id or blk.leb_num != lnum:
+                    log(self, 'PEB %s is not LEB %s of volume %s.' % (peb_num, lnum, vol_id))
+                    return False
+
+        return True
+
+
+    def _get_pebs(self) -> set[int]:
+        pebs = set(self.block_loc) | set(self.pools)
+        for vol_pebs in self.eba.values():
+            pebs.update(vol_pebs)
+        pebs.discard(UBI_FM_UNMAPPED)
+        return pebs
+    pebs = property(_get_pebs)
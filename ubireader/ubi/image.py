@@ -28,17 +28,19 @@ if TYPE_CHECKING:
     from collections.abc import Mapping
     from ubireader.ubi.block import description as Block
     from ubireader.ubi.block.layout import _LayoutInfo
+    from ubireader.ubi.block.sort import BlockIndex
     from ubireader.ubi.volume import description as Volume
 
 class description(object):
-    def __init__(self, blocks: dict[int, Block], layout_info: _LayoutInfo) -> None:
+    def __init__(self, blocks: dict[int, Block], layout_info: _LayoutInfo, index: BlockIndex | None = None,
+                 resolved_lists: Mapping[int, list[int]] | None = None) -> None:
         self._image_seq = blocks[layout_info[0]].ec_hdr.image_seq
         self.vid_hdr_offset = blocks[layout_info[0]].ec_hdr.vid_hdr_offset
         self.version = blocks[layout_info[0]].ec_hdr.version
         self._block_list = layout_info[2]
         self._start_peb = min(layout_info[2])
         self._end_peb = max(layout_info[2])
-        self._volumes = get_volumes(blocks, layout_info)
+        self._volumes = get_volumes(blocks, layout_info, index, resolved_lists)
         log(description, 'Created Image: %s, Volume Cnt: %s' % (self.image_seq, len(self.volumes)))
 
     def __repr__(self) -> str:
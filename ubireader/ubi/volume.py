@@ -28,6 +28,7 @@ if TYPE_CHECKING:
     from ubireader.ubi import ubi as Ubi
     from ubireader.ubi.block import description as Block
     from ubireader.ubi.block.layout import _LayoutInfo
+    from ubireader.ubi.block.sort import BlockIndex
     from ubireader.ubi.headers import _vtbl_rec as VtblRec
 
 class description(object):
@@ -104,13 +105,17 @@ class description(object):
                 yield ubi.file.read_block_data(ubi.blocks[block])
 
 
-def get_volumes(blocks: Mapping[int, Block], layout_info: _LayoutInfo) -> dict[str, description]:
+def get_volumes(blocks: Mapping[int, Block], layout_info: _LayoutInfo, index: BlockIndex | None = None,
+                resolved_lists: Mapping[int, list[int]] | None = None) -> dict[str, description]:
     """Get a list of UBI volume objects from list of blocks
 
     Arguments:
     List:blocks            -- List of layout block objects
     List:layout_info    -- Layout info (indexes of layout blocks and
                                         associated data blocks.)
+    Dict:index          -- (optional) Block index from sort.build_index().
+    Dict:resolved_lists -- (optional) Block lists keyed by volume id,
+                           with old blocks already removed.
 
     Returns:
     Dict -- Of Volume objects by volume name, including any
@@ -118,13 +123,19 @@ def get_volumes(blocks: Mapping[int, Block], layout_info: _LayoutInfo) -> dict[s
     """
     volumes: dict[str, description] = {}
 
-    vol_blocks_lists = sort.by_vol_id(blocks, layout_info[2])
+    if index is None:
+        vol_blocks_lists = sort.by_vol_id(blocks, layout_info[2])
+    else:
+        vol_blocks_lists = sort.index_by_vol_id(index, blocks[layout_info[0]].ec_hdr.image_seq)
     for vol_rec in blocks[layout_info[0]].vtbl_recs:
         vol_name = vol_rec.name.strip(b'\x00').decode('utf-8')
         if vol_rec.rec_index not in vol_blocks_lists:
             vol_blocks_lists[vol_rec.rec_index] = []
 
-        vol_blocks_lists[vol_rec.rec_index] = rm_old_blocks(blocks, vol_blocks_lists[vol_rec.rec_index])
+        if resolved_lists and vol_rec.rec_index in resolved_lists:
+            vol_blocks_lists[vol_rec.rec_index] = resolved_lists[vol_rec.rec_index]
+        else:
+            vol_blocks_lists[vol_rec.rec_index] = rm_old_blocks(blocks, vol_blocks_lists[vol_rec.rec_index])
         volumes[vol_name] = description(vol_rec.rec_index, vol_rec, vol_blocks_lists[vol_rec.rec_index])
             
     return volumes
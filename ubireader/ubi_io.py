@@ -18,7 +18,12 @@
 #############################################################
 
 from __future__ import annotations
+import mmap
+import os
+import threading
+from collections import OrderedDict
 from typing import TYPE_CHECKING
+from ubireader import settings
 from ubireader.debug import error, log, verbose_log
 from ubireader.ubi.block import sort
 from ubireader.ubi.defines import UBI_VID_STATIC
@@ -44,6 +49,12 @@ class ubi_file(object):
         Int:offset
     read            -- Read specified bytes from file handle.
         Int:size
+    read_at         -- Read specified bytes at offset without moving
+                       the file position. Safe to use from threads.
+        Int:offset
+        Int:size
+    physical_addr   -- Returns file address of provided offset.
+        Int:offset
     tell            -- Returns byte offset of current file location.
     read_block      -- Returns complete PEB data of provided block
                        description.
@@ -56,11 +67,15 @@ class ubi_file(object):
 
     Handles all the actual file interactions, read, seek,
     extract blocks, etc.
+
+    If settings.use_mmap is set, the file is memory mapped and reads
+    return memoryview slices of the mapping instead of bytes copies.
     """
 
     def __init__(self, path: str, block_size: int, start_offset: int = 0, end_offset: int | None = None) -> None:
         self.__name__ = 'UBI_File'
         self.is_valid = False
+        self._path = path
         try:
             log(self, 'Open Path: %s' % path)
             self._fhandle = open(path, 'rb')
@@ -68,9 +83,20 @@ class ubi_file(object):
             error(self, 'Fatal', 'Open file: %s' % e)
 
         self._fhandle.seek(0,2)
-        file_size = self.tell()
+        file_size = self._fhandle.tell()
         log(self, 'File Size: %s' % file_size)
 
+        self._mmap = None
+        self._view = None
+        self._pos = 0
+        if settings.use_mmap:
+            try:
+                self._mmap = mmap.mmap(self._fhandle.fileno(), 0, access=mmap.ACCESS_READ)
+                self._view = memoryview(self._mmap)
+                log(self, 'Memory mapped file.')
+            except Exception as e:
+                error(self, 'Warn', 'mmap failed, using buffered reads: %s' % e)
+
         self._start_offset = start_offset
         log(self, 'Start Offset: %s' % (self._start_offset))
 
@@ -93,8 +119,8 @@ class ubi_file(object):
         if remainder != 0:
             error(self, 'Warning', 'end_offset - start_offset length is not block aligned, could mean missing data.')
 
-        self._fhandle.seek(self._start_offset)
-        self._last_read_addr = self._fhandle.tell()
+        self.seek(self._start_offset)
+        self._last_read_addr = self.tell()
         self.is_valid = True
 
     def __enter__(self) -> Self:
@@ -103,6 +129,11 @@ class ubi_file(object):
     def __exit__(self, exc_type, exc_value, traceback) -> None:
         self.close()
 
+    def _get_path(self) -> str:
+        return self._path
+    path = property(_get_path)
+
+
     def _set_start(self, i: int) -> None:
         self._start_offset = i
     def _get_start(self) -> int:
@@ -120,34 +151,66 @@ class ubi_file(object):
     block_size = property(_get_block_size)
 
     def close(self) -> None:
+        if self._mmap is not None:
+            try:
+                self._view.release()
+                self._mmap.close()
+            except BufferError:
+                # Slices of the mapping are still referenced, it is
+                # unmapped once the last of them is garbage collected.
+                log(self, 'Mapping still in use, not unmapped.')
         self._fhandle.close()
 
     def seek(self, offset: int) -> None:
-        self._fhandle.seek(offset)
+        if self._view is not None:
+            self._pos = offset
+        else:
+            self._fhandle.seek(offset)
+
+
+    def _read(self, size: int) -> bytes | memoryview:
+        if self._view is not None:
+            buf = self._view[self._pos:self._pos + size]
+            self._pos += len(buf)
+            return buf
+        return self._fhandle.read(size)
 
 
-    def read(self, size: int) -> bytes:
+    def read(self, size: int) -> bytes | memoryview:
         self._last_read_addr = self.tell()
         verbose_log(self, 'read loc: %s, size: %s' % (self._last_read_addr, size))
-        return self._fhandle.read(size)
+        return self._read(size)
+
+
+    def read_at(self, offset: int, size: int) -> bytes | memoryview:
+        verbose_log(self, 'read loc: %s, size: %s' % (offset, size))
+        if self._view is not None:
+            return self._view[offset:offset + size]
+        return os.pread(self._fhandle.fileno(), size, offset)
 
 
     def tell(self) -> int:
+        if self._view is not None:
+            return self._pos
         return self._fhandle.tell()
 
 
+    def physical_addr(self, offset: int) -> int:
+        return offset
+
+
     def last_read_addr(self) -> int:
         return self._last_read_addr
 
 
     def reset(self) -> None:
-        self._fhandle.seek(self.start_offset)
+        self.seek(self.start_offset)
 
 
-    def reader(self) -> Iterator[bytes]:
+    def reader(self) -> Iterator[bytes | memoryview]:
         self.reset()
         while True:
-            cur_loc = self._fhandle.tell()
+            cur_loc = self.tell()
             if self.end_offset and cur_loc > self.end_offset:
                 break            
             elif self.end_offset and self.end_offset - cur_loc < self.block_size:
@@ -162,77 +225,237 @@ class ubi_file(object):
             yield buf
 
 
-    def read_block(self, block: Block) -> bytes:
+    def read_block(self, block: Block) -> bytes | memoryview:
         """Read complete PEB data from file.
         
         Argument:
         Obj:block -- Block data is desired for.
+
+        Does not move the file position.
         """
-        self.seek(block.file_offset)
-        return self._fhandle.read(block.size)
+        return self.read_at(block.file_offset, block.size)
 
 
-    def read_block_data(self, block: Block) -> bytes:
+    def read_block_data(self, block: Block) -> bytes | memoryview:
         """Read LEB data from file
         
         Argument:
         Obj:block -- Block data is desired for.
+
+        Does not move the file position.
         """
-        self.seek(block.file_offset + block.ec_hdr.data_offset)
         if block.vid_hdr.vol_type == UBI_VID_STATIC:
-            buf = self._fhandle.read(block.vid_hdr.data_size)
+            size = block.vid_hdr.data_size
         else:
-            buf = self._fhandle.read(block.size - block.ec_hdr.data_offset - block.vid_hdr.data_pad)
-        return buf
+            size = block.size - block.ec_hdr.data_offset - block.vid_hdr.data_pad
+        return self.read_at(block.file_offset + block.ec_hdr.data_offset, size)
+
+
+
+class region_file(object):
+    """View of a ubi_file addressed from its start_offset
+
+    Arguments:
+    Obj:ubi_file    -- ubi_file object of the region.
+
+    UBIFS addresses nodes from the start of its image, this makes a
+    bare UBIFS image work at any start_offset in the file. Addresses
+    given by physical_addr and last_read_addr are still file addresses.
+    """
+
+    def __init__(self, ubi_file: ubi_file) -> None:
+        self.__name__ = 'region_file'
+        self._file = ubi_file
+        self._base = ubi_file.start_offset
+
+
+    def _get_start(self) -> int:
+        return 0
+    start_offset = property(_get_start)
+
+
+    def _get_end(self) -> int:
+        return self._file.end_offset - self._base
+    end_offset = property(_get_end)
+
+
+    def _get_block_size(self) -> int:
+        return self._file.block_size
+    block_size = property(_get_block_size)
+
+
+    def close(self) -> None:
+        self._file.close()
+
+
+    def seek(self, offset: int) -> None:
+        self._file.seek(self._base + offset)
+
+
+    def read(self, size: int) -> bytes | memoryview:
+        return self._file.read(size)
+
+
+    def read_at(self, offset: int, size: int) -> bytes | memoryview:
+        return self._file.read_at(self._base + offset, size)
+
+
+    def tell(self) -> int:
+        return self._file.tell() - self._base
+
+
+    def physical_addr(self, offset: int) -> int:
+        return self._base + offset
+
+
+    def last_read_addr(self) -> int:
+        return self._file.last_read_addr()
+
+
+    def reset(self) -> None:
+        self._file.reset()
+
+
+    def reader(self) -> Iterator[bytes | memoryview]:
+        return self._file.reader()
+
+
+
+class leb_cache(object):
+    """Bounded LRU cache of LEB buffers
+
+    Arguments:
+    Int:max_size -- Byte budget for cached LEB buffers, 0 disables caching.
+
+    Attributes:
+    Int:size     -- Bytes currently held by the cache.
+    Int:hits     -- Number of lookups served from the cache.
+    Int:misses   -- Number of lookups that had to read from file.
+    """
+
+    def __init__(self, max_size: int) -> None:
+        self.__name__ = 'leb_cache'
+        self._max_size = max_size
+        self._bufs: OrderedDict[int, bytes | memoryview] = OrderedDict()
+        self._lock = threading.Lock()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+
+
+    def get(self, leb: int) -> bytes | memoryview | None:
+        with self._lock:
+            buf = self._bufs.get(leb)
+            if buf is None:
+                self.misses += 1
+                return None
+
+            self._bufs.move_to_end(leb)
+            self.hits += 1
+            return buf
+
+
+    def put(self, leb: int, buf: bytes | memoryview) -> None:
+        if len(buf) > self._max_size:
+            return
+
+        with self._lock:
+            if leb in self._bufs:
+                self.size -= len(self._bufs.pop(leb))
+
+            while self._bufs and self.size + len(buf) > self._max_size:
+                _, old_buf = self._bufs.popitem(last=False)
+                self.size -= len(old_buf)
+
+            self._bufs[leb] = buf
+            self.size += len(buf)
+
+
+    def clear(self) -> None:
+        with self._lock:
+            self._bufs.clear()
+            self.size = 0
 
 
 
 class leb_virtual_file():
-    def __init__(self, ubi: Ubi, block_list: Mapping[int, Block]) -> None:
+    """LEB backed virtual file of a UBI volume
+
+    Arguments:
+    Obj:ubi         -- UBI object.
+    Dict:block_list -- Blocks of the volume keyed by PEB number.
+    Int:cache_size  -- (optional) Byte budget of the LEB cache,
+                       defaults to settings.leb_cache_size.
+
+    Attributes:
+    Obj:cache       -- LRU cache of LEB buffers with hit/miss counters,
+                       shared by everything reading through this file.
+    """
+
+    def __init__(self, ubi: Ubi, block_list: Mapping[int, Block], cache_size: int | None = None) -> None:
         self.__name__ = 'leb_virtual_file'
         self.is_valid = False
         self._ubi = ubi
         self._last_read_addr = 0
 
+        if cache_size is None:
+            cache_size = settings.leb_cache_size
+        self.cache = leb_cache(cache_size)
+
         if not len(block_list):
             error(self, 'Info', 'Empty block list')
         else:
             self._blocks = sort.by_leb(block_list)
             self._seek = 0
-            self._last_leb = -1
-            self._last_buf = ''
             self.is_valid = True
 
 
-    def read(self, size: int) -> bytes:
-        buf = ''
-        leb = int(self.tell() / self._ubi.leb_size)
-        offset = self.tell() % self._ubi.leb_size
+    def _leb_data(self, leb: int) -> bytes | memoryview:
+        buf = self.cache.get(leb)
+        if buf is None:
+            buf = self._ubi.file.read_block_data(self._ubi.blocks[self._blocks[leb]])
+            self.cache.put(leb, buf)
+        return buf
+
 
+    def physical_addr(self, offset: int) -> int:
+        """File address of provided offset in the volume, -1 if unmapped"""
+        leb = offset // self._ubi.leb_size
         try:
-            if size < 0:
-                raise Exception('Bad Read Offset Request')
+            block = self._ubi.blocks[self._blocks[leb]]
+        except (IndexError, KeyError):
+            return -1
+        return block.file_offset + block.ec_hdr.data_offset + offset % self._ubi.leb_size
 
-            self._last_read_addr = self._ubi.blocks[self._blocks[leb]].file_offset + self._ubi.blocks[self._blocks[leb]].ec_hdr.data_offset + offset
 
-        except Exception as e:
+    def read(self, size: int) -> bytes | memoryview:
+        buf = self.read_at(self.tell(), size)
+        self._last_read_addr = self.physical_addr(self.tell())
+        self.seek(self.tell() + size)
+        return buf
+
+
+    def read_at(self, offset: int, size: int) -> bytes | memoryview:
+        """Read size bytes at offset, without moving the file position.
+
+        Safe to use from multiple threads.
+        """
+        leb = offset // self._ubi.leb_size
+        leb_offset = offset % self._ubi.leb_size
+        addr = self.physical_addr(offset)
+
+        if size < 0 or addr < 0:
             error(self.read, 'Error', 'LEB: %s is corrupted or has no data.' % (leb))
             raise Exception('Bad Read Offset Request')
 
-        verbose_log(self, 'read loc: %s, size: %s' % (self._last_read_addr, size))
+        verbose_log(self, 'read loc: %s, size: %s' % (addr, size))
 
-        if leb == self._last_leb:
-            self.seek(self.tell() + size)
-            return self._last_buf[offset:offset+size]
-        else:
-            try:
-                buf = self._ubi.file.read_block_data(self._ubi.blocks[self._blocks[leb]])
-                self._last_buf = buf
-                self._last_leb = leb
-                self.seek(self.tell() + size)
-                return buf[offset:offset+size]
-            except Exception as e:
-                error(self, 'Fatal', 'read loc: %s, size: %s, LEB: %s, offset: %s, error: %s' % (self._last_read_addr, size, leb, offset, e))
+        try:
+            buf = self._leb_data(leb)
+        except Exception as e:
+            error(self, 'Fatal', 'read loc: %s, size: %s, LEB: %s, offset: %s, error: %s' % (addr, size, leb, leb_offset, e))
+
+        return buf[leb_offset:leb_offset+size]
 
 
     def reset(self) -> None:
@@ -252,7 +475,7 @@ class leb_virtual_file():
         return self._last_read_addr
 
 
-    def reader(self) -> Iterator[bytes]:
+    def reader(self) -> Iterator[bytes | memoryview]:
         last_leb = 0
         for block in self._blocks:
             while 0 != (self._ubi.blocks[block].leb_num - last_leb):
@@ -18,13 +18,19 @@
 #############################################################
 
 from __future__ import annotations
+import stat
 from typing import TYPE_CHECKING
 from ubireader.debug import error, log, verbose_display
 from ubireader.ubifs.defines import *
 from ubireader.ubifs import nodes, display
+from ubireader.ubifs import tnc, walk
+from ubireader.ubifs.list import find_dir
+from ubireader.ubifs.reader import file_reader
+from ubireader.ubi_io import ubi_file, region_file
 
 if TYPE_CHECKING:
-    from ubireader.ubi_io import ubi_file as UbiFile, leb_virtual_file as LebVirtualFile
+    from ubireader.ubi_io import ubi_file as UbiFile, region_file as RegionFile, leb_virtual_file as LebVirtualFile
+    from ubireader.ubifs.walk import Inode
 from typing import Optional
 from zlib import crc32
 
@@ -42,8 +48,11 @@ class ubifs():
     Obj:mst_node       -- Master Node of UBIFS image LEB1
     Obj:mst_node2      -- Master Node 2 of UBIFS image LEB2
     """
-    def __init__(self, ubifs_file: UbiFile | LebVirtualFile, master_key: bytes | None = None) -> None:
+    def __init__(self, ubifs_file: UbiFile | RegionFile | LebVirtualFile, master_key: bytes | None = None) -> None:
         self.__name__ = 'UBIFS'
+        # Node addresses are from the start of the image.
+        if isinstance(ubifs_file, ubi_file) and ubifs_file.start_offset:
+            ubifs_file = region_file(ubifs_file)
         self._file = ubifs_file
         self.master_key = master_key
         try:
@@ -120,7 +129,7 @@ class ubifs():
             log(self , 'Swapping Master Nodes due to bad first node.')
 
 
-    def _get_file(self) -> UbiFile | LebVirtualFile:
+    def _get_file(self) -> UbiFile | RegionFile | LebVirtualFile:
         return self._file
     file = property(_get_file)
 
@@ -173,7 +182,42 @@ class ubifs():
         """
         return self._min_io_size
     min_io_size = property(_get_min_io_size)
-    
+
+
+    def open(self, path: str) -> file_reader:
+        """Open regular file for reading.
+
+        Arguments:
+        Str:path   -- Path of file in the filesystem.
+
+        Returns:
+        Obj:file_reader -- Read-only, seekable io.RawIOBase of the file,
+                           wrap in io.BufferedReader for buffered reads.
+        """
+        pnames = [name for name in path.split('/') if name]
+        inodes: dict[int, Inode] = {}
+
+        if self.master_key is None:
+            inum = tnc.find_path(self, pnames, inodes)
+            if inum is not None:
+                tnc.load_inode(self, inum, inodes, data=True)
+        else:
+            # Encrypted names can't be hashed, gather everything.
+            walk.index(self, self.master_node.root_lnum, self.master_node.root_offs, inodes, [])
+            inum = find_dir(inodes, UBIFS_ROOT_INO, pnames, 0) if UBIFS_ROOT_INO in inodes else None
+
+        if inum is None or 'ino' not in inodes.get(inum, {}):
+            raise FileNotFoundError('No such file in UBIFS: %s' % path)
+
+        mode = inodes[inum]['ino'].mode
+        if stat.S_ISDIR(mode):
+            raise IsADirectoryError('Is a directory: %s' % path)
+        elif not stat.S_ISREG(mode):
+            raise OSError('Not a regular file: %s' % path)
+
+        return file_reader(self, inodes[inum], inodes, path)
+
+
     def display(self, tab: str = '') -> str:
         """Print information about this object.
         
@@ -0,0 +1,187 @@
+#!/usr/bin/env python
+#############################################################
+# ubi_reader/ubifs
+# (c) 2013 Jason Pruitt (jrspruitt@gmail.com)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#############################################################
+
+from __future__ import annotations
+import threading
+import time
+import zlib
+from collections.abc import Callable
+from typing import TypedDict
+
+import zstandard
+from lzallright import LZOCompressor
+
+from ubireader import settings
+from ubireader.ubifs.defines import *
+
+# func(data, unc_len), unc_len is the size of the uncompressed data.
+Decompressor = Callable[[bytes, int], bytes]
+
+
+class BackendStats(TypedDict):
+    compr: str          # Compression name, PRINT_UBIFS_COMPR.
+    name: str           # Backend name.
+    calls: int          # Blocks decompressed.
+    in_bytes: int       # Compressed bytes in.
+    out_bytes: int      # Uncompressed bytes out.
+    seconds: float      # Time spent decompressing.
+
+
+class backend(object):
+    """Decompressor implementation for one compression type
+
+    Arguments:
+    Int:ctype    -- UBIFS_COMPR_* type.
+    Str:name     -- Name of implementation, e.g. python module.
+    Obj:func     -- Decompressor, func(data, unc_len).
+
+    Attributes:
+    Int:calls    -- Blocks decompressed.
+    Int:in_bytes -- Compressed bytes in.
+    Int:out_bytes -- Uncompressed bytes out.
+    Float:seconds -- Time spent decompressing.
+    """
+
+    def __init__(self, ctype: int, name: str, func: Decompressor) -> None:
+        self.ctype = ctype
+        self.name = name
+        self._func = func
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.in_bytes = 0
+        self.out_bytes = 0
+        self.seconds = 0.0
+
+
+    def __repr__(self) -> str:
+        return '%s (%s)' % (PRINT_UBIFS_COMPR[self.ctype], self.name)
+
+
+    def decompress(self, data: bytes, unc_len: int) -> bytes:
+        start = time.perf_counter()
+        buf = self._func(data, unc_len)
+        elapsed = time.perf_counter() - start
+
+        with self._lock:
+            self.calls += 1
+            self.in_bytes += len(data)
+            self.out_bytes += len(buf)
+            self.seconds += elapsed
+        return buf
+
+
+    def _get_stats(self) -> BackendStats:
+        return BackendStats(compr=PRINT_UBIFS_COMPR[self.ctype], name=self.name, calls=self.calls,
+                            in_bytes=self.in_bytes, out_bytes=self.out_bytes, seconds=self.seconds)
+    stats = property(_get_stats)
+
+
+# Backends by compression type, preferred first.
+_backends: dict[int, list[backend]] = {}
+
+
+def register(ctype: int, name: str, func: Decompressor) -> backend:
+    """Add decompressor, preferred over those registered before it.
+
+    Arguments:
+    Int:ctype    -- UBIFS_COMPR_* type.
+    Str:name     -- Name of implementation.
+    Obj:func     -- Decompressor, func(data, unc_len).
+
+    Returns:
+    Obj:backend  -- Registered backend.
+    """
+    b = backend(ctype, name, func)
+    _backends.setdefault(ctype, []).insert(0, b)
+    return b
+
+
+def backends(ctype: int) -> list[backend]:
+    """Backends available for compression type, preferred first."""
+    return list(_backends.get(ctype, []))
+
+
+def get_backend(ctype: int) -> backend | None:
+    """Backend used for compression type.
+
+    Arguments:
+    Int:ctype    -- UBIFS_COMPR_* type.
+
+    Returns:
+    Obj:backend  -- Backend named in settings.decompress_backends if it
+                    is available, else the preferred one. None if the
+                    type is not supported.
+    """
+    candidates = _backends.get(ctype)
+    if not candidates:
+        return None
+
+    if settings.decompress_backends and ctype < len(PRINT_UBIFS_COMPR):
+        name = settings.decompress_backends.get(PRINT_UBIFS_COMPR[ctype])
+        for b in candidates:
+            if b.name == name:
+                return b
+    return candidates[0]
+
+
+def stats() -> list[BackendStats]:
+    """Timing of every backend that has been used."""
+    return [b.stats for ctype in sorted(_backends) for b in _backends[ctype] if b.calls]
+
+
+def _lzallright(data: bytes, unc_len: int) -> bytes:
+    return LZOCompressor.decompress(data, output_size_hint=unc_len)
+
+
+def _zlib(data: bytes, unc_len: int) -> bytes:
+    # Kernel deflate uses a 2 KiB window, without header.
+    return zlib.decompress(data, -11, unc_len or zlib.DEF_BUF_SIZE)
+
+
+# Decompression contexts aren't thread safe, keep one per thread.
+_zstd = threading.local()
+
+
+def _zstandard(data: bytes, unc_len: int) -> bytes:
+    dctx = getattr(_zstd, 'dctx', None)
+    if dctx is None:
+        dctx = _zstd.dctx = zstandard.ZstdDecompressor()
+    # Frame may not carry content size, unc_len bounds the output.
+    return dctx.decompress(data, max_output_size=unc_len)
+
+
+def _register_defaults() -> None:
+    register(UBIFS_COMPR_LZO, 'lzallright', _lzallright)
+    register(UBIFS_COMPR_ZLIB, 'zlib', _zlib)
+    register(UBIFS_COMPR_ZSTD, 'zstandard', _zstandard)
+
+    # Faster implementations, if installed.
+    try:
+        import lzo
+        register(UBIFS_COMPR_LZO, 'lzo', lambda data, unc_len: lzo.decompress(data, False, unc_len))
+    except ImportError:
+        pass
+
+    try:
+        from isal import isal_zlib
+        register(UBIFS_COMPR_ZLIB, 'isal', lambda data, unc_len: isal_zlib.decompress(data, -11, unc_len or zlib.DEF_BUF_SIZE))
+    except ImportError:
+        pass
+
+_register_defaults()
@@ -36,6 +36,19 @@ def derive_key_from_nonce(master_key: bytes, nonce: bytes) -> bytes:
     return derived_key
 
 
+def inode_key(ubifs: Ubifs, inodes: Mapping[int, Inode], inode: Inode) -> algorithms.AES | None:
+    # Key derived from the inode nonce, kept in inode so it is
+    # derived once for all its data blocks.
+    if ubifs.master_key is None:
+        return None
+
+    key = inode.get('fscrypt_key')
+    if key is None:
+        nonce = lookup_inode_nonce(inodes, inode)
+        key = inode['fscrypt_key'] = algorithms.AES(derive_key_from_nonce(ubifs.master_key, nonce))
+    return key
+
+
 def filename_decrypt(key: bytes, ciphertext: bytes) -> bytes:
     
     # using AES CTS-CBC mode not supported by pyca cryptography 
@@ -66,9 +79,11 @@ def filename_decrypt(key: bytes, ciphertext: bytes) -> bytes:
     return plaintext.rstrip(b'\x00')
     
 
-def datablock_decrypt(block_key: bytes, block_iv: bytes, block_data: bytes) -> bytes:
+def datablock_decrypt(block_key: bytes | algorithms.AES, block_iv: bytes, block_data: bytes) -> bytes:
+    if not isinstance(block_key, algorithms.AES):
+        block_key = algorithms.AES(block_key)
     decryptor = Cipher(
-        algorithms.AES(block_key),
+        block_key,
         modes.XTS(block_iv),
     ).decryptor()
     return decryptor.update(block_data) + decryptor.finalize()
@@ -86,8 +101,7 @@ def decrypt_filenames(ubifs: Ubifs, inodes: Mapping[int, Inode]) -> None:
         for inode in inodes.values():
             if "dent" not in inode:
                 continue
-            nonce = lookup_inode_nonce(inodes, inode)
-            dec_key = derive_key_from_nonce(ubifs.master_key, nonce)
+            dec_key = inode_key(ubifs, inodes, inode).key
             for dent in inode['dent']:
                 dent.name = filename_decrypt(dec_key, dent.raw_name).decode()
     except Exception as e:
@@ -99,11 +113,10 @@ def decrypt_symlink_target(ubifs: Ubifs, inodes: Mapping[int, Inode], dent_node:
         return inodes[dent_node.inum]['ino'].data.decode()
     inode = inodes[dent_node.inum]
     ino = inode['ino']
-    nonce = lookup_inode_nonce(inodes, inode)
     # the first two bytes is just header 0x10 0x00 all the time
     # the second byte is a null byte (0x00) added, need to be removed
     # before decryption
     encrypted_name = ino.data[2:-1]
-    dec_key = derive_key_from_nonce(ubifs.master_key, nonce)
+    dec_key = inode_key(ubifs, inodes, inode).key
     lnkname = filename_decrypt(dec_key, encrypted_name)
     return lnkname.decode()
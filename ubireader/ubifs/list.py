@@ -24,9 +24,9 @@ import time
 from typing import TYPE_CHECKING
 from ubireader.ubifs.decrypt import decrypt_symlink_target
 from ubireader.ubifs.defines import *
-from ubireader.ubifs import walk
-from ubireader.ubifs.misc import process_reg_file
-from ubireader.debug import error
+from ubireader.ubifs import tnc, walk
+from ubireader.ubifs.misc import iter_reg_file
+from ubireader.debug import error, log
 
 if TYPE_CHECKING:
     from collections.abc import Mapping
@@ -40,15 +40,26 @@ def list_files(ubifs: Ubifs, list_path: PurePath | str, *, recursive: bool = Fal
         inodes: dict[int, Inode] = {}
         bad_blocks: list[int] = []
 
-        walk.index(ubifs, ubifs.master_node.root_lnum, ubifs.master_node.root_offs, inodes, bad_blocks)
+        if ubifs.master_key is None:
+            # Look up only the path and the listed directories.
+            inum = tnc.find_path(ubifs, pnames, inodes)
 
-        if len(inodes) < 2:
-            raise Exception('No inodes found')
+            if inum == None:
+                return
 
-        inum = find_dir(inodes, 1, pnames, 0)
+            tnc.load_dir(ubifs, inum, inodes, recursive)
 
-        if inum == None:
-            return
+        else:
+            # Encrypted names can't be hashed, gather everything.
+            walk.index(ubifs, ubifs.master_node.root_lnum, ubifs.master_node.root_offs, inodes, bad_blocks, data=False)
+
+            if len(inodes) < 2:
+                raise Exception('No inodes found')
+
+            inum = find_dir(inodes, 1, pnames, 0)
+
+            if inum == None:
+                return
 
         if not 'dent' in inodes[inum]:
             return
@@ -62,6 +73,10 @@ def list_files(ubifs: Ubifs, list_path: PurePath | str, *, recursive: bool = Fal
         if len(bad_blocks):
             error(list_files, 'Warn', 'Data may be missing or corrupted, bad blocks, LEB [%s]' % ','.join(map(str, bad_blocks)))
 
+        cache = getattr(ubifs.file, 'cache', None)
+        if cache is not None:
+            log(list_files, 'LEB cache hits: %s, misses: %s' % (cache.hits, cache.misses))
+
     except Exception as e:
         error(list_files, 'Error', '%s' % e)
 
@@ -79,6 +94,20 @@ def copy_file(ubifs: Ubifs, filepath: str, destpath: str) -> bool:
     inodes: dict[int, Inode] = {}
     bad_blocks: list[int] = []
 
+    if ubifs.master_key is None:
+        # Look up only the path and the nodes of the file.
+        inum = tnc.find_path(ubifs, pnames, inodes)
+
+        if inum == None:
+            return False
+
+        dent = tnc.lookup_dent(ubifs, inum, filename, inodes)
+
+        if dent == None or tnc.load_inode(ubifs, dent.inum, inodes, data=True) == None:
+            return False
+
+        return _write_file(ubifs, inodes, dent, filepath, destpath)
+
     walk.index(ubifs, ubifs.master_node.root_lnum, ubifs.master_node.root_offs, inodes, bad_blocks)
 
     if len(inodes) < 2:
@@ -94,19 +123,24 @@ def copy_file(ubifs: Ubifs, filepath: str, destpath: str) -> bool:
 
     for dent in inodes[inum]['dent']:
         if dent.name == filename:
-            filedata = process_reg_file(ubifs, inodes[dent.inum], filepath, inodes)
-            if os.path.isdir(destpath):
-                destpath = os.path.join(destpath, filename)
-            with open(destpath, 'wb') as f:
-                f.write(filedata)
-            return True
+            return _write_file(ubifs, inodes, dent, filepath, destpath)
     return False
 
 
+def _write_file(ubifs: Ubifs, inodes: Mapping[int, Inode], dent: nodes.dent_node, filepath: str, destpath: str) -> bool:
+    if os.path.isdir(destpath):
+        destpath = os.path.join(destpath, dent.name)
+    with open(destpath, 'wb') as f:
+        for block in iter_reg_file(ubifs, inodes[dent.inum], filepath, inodes):
+            f.write(block)
+    return True
+
+
 def find_dir(inodes: Mapping[int, Inode], inum: int, names: list[str], idx: int) -> int | None:
     if len(names) == 0:
         return 1
-    for dent in inodes[inum]['dent']:
+    # Files and empty directories have no entries.
+    for dent in inodes.get(inum, {}).get('dent', []):
         if dent.name == names[idx]:
             if len(names) == idx+1:
                 return dent.inum
@@ -120,7 +154,7 @@ def print_dent(ubifs: Ubifs, inodes: Mapping[int, Inode], dent_node: nodes.dent_
     display_path = str(dent_path) if dent_path is not None else dent_node.name
 
     if long:
-        fl = file_leng(ubifs, inode)
+        fl = inode['ino'].size
 
         lnk = ""
         if dent_node.type == UBIFS_ITYPE_LNK:
@@ -146,20 +180,3 @@ def print_dent_recursive(ubifs: Ubifs, inodes: Mapping[int, Inode], dent_node: n
 
     for dnode in inode.get('dent', []):
         print_dent_recursive(ubifs, inodes, dnode, long=long, longts=longts, dent_path=dent_path / dnode.name)
-
-
-def file_leng(ubifs: Ubifs, inode: Inode) -> int:
-    fl = 0
-    if 'data' in inode:
-        compr_type = 0
-        sorted_data = sorted(inode['data'], key=lambda x: x.key['khash'])
-        last_khash = sorted_data[0].key['khash']-1
-
-        for data in sorted_data:
-            if data.key['khash'] - last_khash != 1:
-                while 1 != (data.key['khash'] - last_khash):
-                    last_khash += 1
-                    fl = fl + UBIFS_BLOCK_SIZE
-            fl = fl + data.size
-        return fl
-    return 0
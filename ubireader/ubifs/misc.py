@@ -18,18 +18,23 @@
 #############################################################
 
 from __future__ import annotations
-from typing import TYPE_CHECKING, TypedDict
-from lzallright import LZOCompressor
+from collections import deque
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from itertools import islice
+from typing import TYPE_CHECKING, Any, TypedDict, TypeVar
 import struct
-import zlib
+import threading
+from ubireader import settings
 from ubireader.ubifs.defines import *
+from ubireader.ubifs.compression import get_backend
 from ubireader.debug import error, verbose_log
 from ubireader.debug import error
-from ubireader.ubifs.decrypt import lookup_inode_nonce, derive_key_from_nonce, datablock_decrypt
+from ubireader.ubifs.decrypt import datablock_decrypt, inode_key
 
 if TYPE_CHECKING:
-    from collections.abc import Mapping
-    from ubireader.ubifs import ubifs as Ubifs
+    from collections.abc import Iterable, Iterator, Mapping
+    from cryptography.hazmat.primitives.ciphers import algorithms
+    from ubireader.ubifs import ubifs as Ubifs, nodes
     from ubireader.ubifs.walk import Inode
 
 # For happy printing
@@ -62,75 +67,232 @@ def parse_key(key: bytes) -> ParsedKey:
     return {'type':key_type, 'ino_num':ino_num, 'khash': khash}
 
 
+# Names used in decompression warnings.
+_COMPR_ERROR_NAMES = {UBIFS_COMPR_LZO: 'LZO', UBIFS_COMPR_ZLIB: 'ZLib', UBIFS_COMPR_ZSTD: 'ZSTD'}
+
+
 def decompress(ctype: int, unc_len: int, data: bytes) -> bytes | None:
     """Decompress data.
 
     Arguments:
-    Int:ctype    -- Compression type LZO, ZLIB (*currently unused*).
+    Int:ctype    -- Compression type LZO, ZLIB, ZSTD.
     Int:unc_len  -- Uncompressed data lenth.
     Str:data     -- Data to be uncompessed.
 
     Returns:
-    Uncompressed Data.
+    Uncompressed Data, always bytes, also for uncompressed memoryview
+    slices of a memory mapped file.
+
+    Uses the backend compression.get_backend picks for ctype.
     """
-    if ctype == UBIFS_COMPR_LZO:
-        try:
-            return LZOCompressor.decompress(data, output_size_hint=unc_len)
-        except Exception as e:
-            error(decompress, 'Warn', 'LZO Error: %s' % e)
-    elif ctype == UBIFS_COMPR_ZLIB:
+    backend = get_backend(ctype)
+    if backend is None:
+        return bytes(data)
+
+    try:
+        return backend.decompress(data, unc_len)
+    except Exception as e:
+        error(decompress, 'Warn', '%s Error: %s' % (_COMPR_ERROR_NAMES.get(ctype, backend), e))
+
+
+def read_data(ubifs: Ubifs, inode: Inode, data: nodes.data_node, inodes: Mapping[int, Inode]) -> bytes | None:
+    """Read, decrypt and decompress one data node.
+
+    Arguments:
+    Obj:ubifs     -- UBIFS object.
+    Dict:inode    -- Inode the data node belongs to.
+    Obj:data      -- Data node.
+    Dict:inodes   -- Inodes, for the encryption nonce.
+
+    Returns:
+    Bin           -- Uncompressed block data, None if it could not be
+                     decompressed.
+    """
+    return decode_data(ubifs, inode, data, inodes, ubifs.file.read_at(data.offset, data.compr_len))
+
+
+def decode_data(ubifs: Ubifs, inode: Inode, data: nodes.data_node, inodes: Mapping[int, Inode], d: bytes) -> bytes | None:
+    """Decrypt and decompress payload of data node already read.
+
+    Arguments:
+    Obj:ubifs     -- UBIFS object.
+    Dict:inode    -- Inode the data node belongs to.
+    Obj:data      -- Data node.
+    Dict:inodes   -- Inodes, for the encryption nonce.
+    Bin:d         -- compr_len bytes of payload.
+
+    Returns:
+    Bin           -- Uncompressed block data, None if it could not be
+                     decrypted or decompressed.
+    """
+    return _decode(data, d, inode_key(ubifs, inodes, inode))
+
+
+def _decode(data: nodes.data_node, d: bytes, key: algorithms.AES | None) -> bytes | None:
+    if key is not None:
         try:
-            return zlib.decompress(data, -11)
+            # block_id is based on the current hash
+            # there could be empty blocks
+            block_id = data.key['khash'] - (UBIFS_DATA_KEY << UBIFS_S_KEY_BLOCK_BITS)
+            block_iv = struct.pack("<QQ", block_id, 0)
+            # if unpading is needed the plaintext_size is valid and set to the
+            # original size of current block, so we can use this to get the amout
+            # of bytes to unpad
+            d = datablock_decrypt(key, block_iv, d)[:data.plaintext_size]
         except Exception as e:
-            error(decompress, 'Warn', 'ZLib Error: %s' % e)
-    else:
-        return data
+            error(decode_data, 'Warn', 'Decrypt Error: %s' % e)
+            return None
+
+    return decompress(data.compr_type, data.size, d)
+
+
+# Data nodes handed to a worker at once.
+DECODE_BATCH = 64
+
+# Pools by (workers, use processes), shared by all threads. A pool
+# is never shut down, other threads may still be submitting to it.
+_pools: dict[tuple[int, bool], Executor] = {}
+_pools_lock = threading.Lock()
+
+T = TypeVar('T')
+
+
+def _decompress_pool(workers: int, use_processes: bool) -> Executor:
+    key = (workers, use_processes)
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is None:
+            if use_processes:
+                options = {name: value for name, value in vars(settings).items() if not name.startswith('_')}
+                pool = ProcessPoolExecutor(workers, initializer=_init_decompress_worker, initargs=(options,))
+            else:
+                pool = ThreadPoolExecutor(workers, thread_name_prefix='decompress')
+            _pools[key] = pool
+
+    return pool
 
 
-def process_reg_file(ubifs: Ubifs, inode: Inode, path: str, inodes: Mapping[int, Inode]) -> bytes:
+def _init_decompress_worker(options: dict[str, Any]) -> None:
+    """Apply settings of the parent in a worker process."""
+    for key, value in options.items():
+        setattr(settings, key, value)
+
+
+def _decode_batch(jobs: list[tuple[nodes.data_node, bytes, algorithms.AES | None]]) -> list[bytes | None]:
+    return [_decode(data, d, key) for data, d, key in jobs]
+
+
+def decode_iter(jobs: Iterable[tuple[T, nodes.data_node, bytes, algorithms.AES | None]]) -> Iterator[tuple[T, bytes | None]]:
+    """Decrypt and decompress many data nodes, in parallel if set.
+
+    Arguments:
+    Iter:jobs     -- (tag, data node, payload, key from
+                     decrypt.inode_key or None).
+
+    Returns:
+    Iter          -- (tag, uncompressed data or None), in order of jobs.
+
+    Jobs are sent in batches to a pool of settings.decompress_workers
+    threads, or processes with settings.decompress_use_processes. Jobs
+    are only taken as results are used, at most two batches per worker
+    are in flight. With 0 workers blocks are decoded here.
+    """
+    workers = settings.decompress_workers
+    if workers < 1:
+        for tag, data, d, key in jobs:
+            yield tag, _decode(data, d, key)
+        return
+
+    # Slices of a memory mapped file don't pickle.
+    copy = settings.decompress_use_processes
+    pool = _decompress_pool(workers, copy)
+    jobs = iter(jobs)
+    pending: deque = deque()
+
+    try:
+        while True:
+            while len(pending) < workers * 2:
+                batch = list(islice(jobs, DECODE_BATCH))
+                if not batch:
+                    break
+                work = [(data, bytes(d) if copy else d, key) for tag, data, d, key in batch]
+                pending.append(([job[0] for job in batch], pool.submit(_decode_batch, work)))
+
+            if not pending:
+                return
+
+            tags, future = pending.popleft()
+            yield from zip(tags, future.result())
+
+    finally:
+        for tags, future in pending:
+            future.cancel()
+
+
+ZERO_BLOCK = bytes(UBIFS_BLOCK_SIZE)
+
+
+def iter_reg_file(ubifs: Ubifs, inode: Inode, path: str, inodes: Mapping[int, Inode]) -> Iterator[bytes]:
+    """Regular file contents, one block at a time.
+
+    Arguments:
+    Obj:ubifs     -- UBIFS object.
+    Dict:inode    -- Inode of file.
+    Str:path      -- Path of file, for messages.
+    Dict:inodes   -- Inodes, for the encryption nonce.
+
+    Yields:
+    Bin           -- UBIFS_BLOCK_SIZE bytes of file in order, the last
+                     block cut at ino.size. Missing blocks and short
+                     blocks are filled with \x00, holes yield ZERO_BLOCK.
+
+    Only one block is held at a time. On an error the rest of the file
+    is filled with \x00.
+    """
+    size = inode['ino'].size
+    end_block = (size + UBIFS_BLOCK_SIZE - 1) // UBIFS_BLOCK_SIZE
+    block_num = 0
+
+    def cut(buf: bytes) -> bytes:
+        return buf[:size - block_num * UBIFS_BLOCK_SIZE] if block_num == end_block - 1 else buf
+
     try:
-        buf = bytearray()
         start_key = (UBIFS_DATA_KEY << UBIFS_S_KEY_BLOCK_BITS)
-        if 'data' in inode:
-            compr_type = 0
-            sorted_data = sorted(inode['data'], key=lambda x: x.key['khash'])
-            last_khash = start_key - 1
-
-            for data in sorted_data:
-                # If data nodes are missing in sequence, fill in blanks
-                # with \x00 * UBIFS_BLOCK_SIZE
-                if data.key['khash'] - last_khash != 1:
-                    while 1 != (data.key['khash'] - last_khash):
-                        buf += b'\x00' * UBIFS_BLOCK_SIZE
-                        last_khash += 1
-
-                compr_type = data.compr_type
-                ubifs.file.seek(data.offset)
-                d = ubifs.file.read(data.compr_len)
-
-                if ubifs.master_key is not None:
-                    nonce = lookup_inode_nonce(inodes, inode)
-                    block_key = derive_key_from_nonce(ubifs.master_key, nonce)
-                    # block_id is based on the current hash
-                    # there could be empty blocks
-                    block_id = data.key['khash']-start_key
-                    block_iv = struct.pack("<QQ", block_id, 0)
-                    d = datablock_decrypt(block_key, block_iv, d)
-                    # if unpading is needed the plaintext_size is valid and set to the
-                    # original size of current block, so we can use this to get the amout
-                    # of bytes to unpad
-                    d = d[:data.plaintext_size]
-
-                buf += decompress(compr_type, data.size, d)
-
-                last_khash = data.key['khash']
-                verbose_log(process_reg_file, 'ino num: %s, compression: %s, path: %s' % (inode['ino'].key['ino_num'], compr_type, path))
+        blocks = []
+        for data in sorted(inode.get('data', []), key=lambda x: x.key['khash']):
+            data_block = data.key['khash'] - start_key
+            if blocks and data_block <= blocks[-1][0]:
+                continue
+            if data_block >= end_block:
+                break
+            blocks.append((data_block, data))
+
+        key = inode_key(ubifs, inodes, inode)
+        jobs = (((data_block, data), data, ubifs.file.read_at(data.offset, data.compr_len), key)
+                for data_block, data in blocks)
+
+        for (data_block, data), buf in decode_iter(jobs):
+            # If data nodes are missing in sequence, fill in blanks
+            # with \x00 * UBIFS_BLOCK_SIZE
+            while block_num < data_block:
+                yield cut(ZERO_BLOCK)
+                block_num += 1
+
+            if buf is None:
+                raise Exception('Block %s could not be decompressed.' % block_num)
+
+            if len(buf) < UBIFS_BLOCK_SIZE:
+                buf += ZERO_BLOCK[len(buf):]
+
+            verbose_log(iter_reg_file, 'ino num: %s, compression: %s, path: %s' % (inode['ino'].key['ino_num'], data.compr_type, path))
+            yield cut(buf)
+            block_num += 1
 
     except Exception as e:
-        error(process_reg_file, 'Warn', 'inode num:%s path:%s :%s' % (inode['ino'].key['ino_num'], path, e))
+        error(iter_reg_file, 'Warn', 'inode num:%s path:%s :%s' % (inode['ino'].key['ino_num'], path, e))
 
     # Pad end of file with \x00 if needed.
-    if inode['ino'].size > len(buf):
-        buf += b'\x00' * (inode['ino'].size - len(buf))
+    while block_num < end_block:
+        yield cut(ZERO_BLOCK)
+        block_num += 1
 
-    return bytes(buf)
@@ -107,7 +107,7 @@ class ino_node(object):
             else:
                 setattr(self, key, fields[key])
 
-        setattr(self, 'data', buf[UBIFS_INO_NODE_SZ:])
+        setattr(self, 'data', bytes(buf[UBIFS_INO_NODE_SZ:]))
         setattr(self, 'errors', [])
 
     def __repr__(self) -> str:
@@ -146,7 +146,7 @@ class xent_node(object):
                 setattr(self, key, parse_key(fields[key]))
             else:
                 setattr(self, key, fields[key])
-        setattr(self, 'name', buf[-self.nlen-1:-1].decode())
+        setattr(self, 'name', bytes(buf[-self.nlen-1:-1]).decode())
         setattr(self, 'errors', [])
 
     def __repr__(self):
@@ -186,7 +186,7 @@ class dent_node(object):
                 setattr(self, key, parse_key(fields[key]))
             else:
                 setattr(self, key, fields[key])
-        setattr(self, 'raw_name', buf[-self.nlen-1:-1])
+        setattr(self, 'raw_name', bytes(buf[-self.nlen-1:-1]))
         setattr(self, 'name', "")
         setattr(self, 'errors', [])
 
@@ -206,8 +206,10 @@ class data_node(object):
     """Get data node at given LEB number + offset.
 
     Arguments:
-    Bin:buf     -- Raw data to extract header information from.
-    Int:offset  -- Offset in LEB of data node.
+    Bin:buf        -- Raw data to extract header information from.
+    Int:offset     -- Offset in LEB of data node.
+    Int:compr_len  -- (optional) Length of compressed data, if buf only
+                      holds the header. Default is the rest of buf.
 
     See ubifs/defines.py for object attributes.
     """
@@ -220,7 +222,7 @@ class data_node(object):
     compr_type: int
     plaintext_size: int
 
-    def __init__(self, buf: bytes, file_offset: int) -> None:
+    def __init__(self, buf: bytes, file_offset: int, compr_len: int | None = None) -> None:
 
         fields = dict(list(zip(UBIFS_DATA_NODE_FIELDS, struct.unpack(UBIFS_DATA_NODE_FORMAT, buf[0:UBIFS_DATA_NODE_SZ]))))
         for key in fields:
@@ -230,7 +232,9 @@ class data_node(object):
                 setattr(self, key, fields[key])
 
         setattr(self, 'offset', file_offset)
-        setattr(self, 'compr_len', (len(buf) - UBIFS_DATA_NODE_SZ))
+        if compr_len is None:
+            compr_len = len(buf) - UBIFS_DATA_NODE_SZ
+        setattr(self, 'compr_len', compr_len)
         setattr(self, 'errors', [])
 
     def __repr__(self) -> str:
@@ -306,7 +310,7 @@ class branch(object):
                 setattr(self, key, fields[key])
 
         if len(buf) > UBIFS_BRANCH_SZ:
-            setattr(self, 'hash', buf[UBIFS_BRANCH_SZ:])
+            setattr(self, 'hash', bytes(buf[UBIFS_BRANCH_SZ:]))
 
         setattr(self, 'errors', [])
 
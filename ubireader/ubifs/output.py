@@ -20,13 +20,16 @@
 from __future__ import annotations
 import os
 import struct
+from collections import OrderedDict
+from contextlib import ExitStack
+from concurrent.futures import Future, ThreadPoolExecutor
 from typing import TYPE_CHECKING
 
-from ubireader.ubifs.decrypt import decrypt_symlink_target
+from ubireader.ubifs.decrypt import decrypt_symlink_target, inode_key
 from ubireader import settings
 from ubireader.ubifs.defines import *
-from ubireader.ubifs import walk
-from ubireader.ubifs.misc import process_reg_file
+from ubireader.ubifs import compression, walk
+from ubireader.ubifs.misc import ZERO_BLOCK, decode_iter, iter_reg_file
 from ubireader.debug import error, log, verbose_log
 
 if TYPE_CHECKING:
@@ -56,17 +59,39 @@ def extract_files(ubifs: Ubifs, out_path: str, perms: bool = False) -> None:
         if len(inodes) < 2:
             raise Exception('No inodes found')
 
-        for dent in inodes[1]['dent']:
-            extract_dents(ubifs, inodes, dent, out_path, perms)
+        with ExitStack() as stack:
+            plan: extract_plan | extract_scheduler | None = None
+            if settings.extract_physical_order:
+                plan = extract_plan(ubifs, inodes, perms)
+            elif settings.extract_workers > 0:
+                executor = ThreadPoolExecutor(settings.extract_workers, thread_name_prefix='extract')
+                # Nothing is left writing files once this returns or
+                # raises, queued files are dropped on errors.
+                stack.callback(executor.shutdown, wait=True, cancel_futures=True)
+                plan = extract_scheduler(ubifs, inodes, perms, executor)
+                log(extract_files, 'Extracting files with %s workers' % settings.extract_workers)
+
+            for dent in inodes[1]['dent']:
+                extract_dents(ubifs, inodes, dent, out_path, perms, plan)
+
+            if plan is not None:
+                plan.run()
 
         if len(bad_blocks):
             error(extract_files, 'Warn', 'Data may be missing or corrupted, bad blocks, LEB [%s]' % ','.join(map(str, bad_blocks)))
 
+        cache = getattr(ubifs.file, 'cache', None)
+        if cache is not None:
+            log(extract_files, 'LEB cache hits: %s, misses: %s' % (cache.hits, cache.misses))
+
+        for b in compression.stats():
+            log(extract_files, 'Decompressed %s blocks with %s (%s), %s > %s bytes in %.3fs' % (b['calls'], b['compr'], b['name'], b['in_bytes'], b['out_bytes'], b['seconds']))
+
     except Exception as e:
         error(extract_files, 'Error', '%s' % e)
 
 
-def extract_dents(ubifs: Ubifs, inodes: Mapping[int, Inode], dent_node: nodes.dent_node, path: str = '', perms: bool = False) -> None:
+def extract_dents(ubifs: Ubifs, inodes: Mapping[int, Inode], dent_node: nodes.dent_node, path: str = '', perms: bool = False, plan: extract_plan | extract_scheduler | None = None) -> None:
     if dent_node.inum not in inodes:
         error(extract_dents, 'Error', 'inum: %s not found in inodes' % (dent_node.inum))
         return
@@ -91,23 +116,27 @@ def extract_dents(ubifs: Ubifs, inodes: Mapping[int, Inode], dent_node: nodes.de
 
         if 'dent' in inode:
             for dnode in inode['dent']:
-                extract_dents(ubifs, inodes, dnode, dent_path, perms)
+                extract_dents(ubifs, inodes, dnode, dent_path, perms, plan)
 
         _set_file_timestamps(dent_path, inode)
 
     elif dent_node.type == UBIFS_ITYPE_REG:
         try:
-            if inode['ino'].nlink > 1:
-                if 'hlink' not in inode:
-                    inode['hlink'] = dent_path
-                    buf = process_reg_file(ubifs, inode, dent_path, inodes)
-                    _write_reg_file(dent_path, buf)
-                else:
-                    os.link(inode['hlink'], dent_path)
-                    log(extract_dents, 'Make Link: %s > %s' % (dent_path, inode['hlink']))
+            if inode['ino'].nlink > 1 and 'hlink' in inode:
+                os.link(inode['hlink'], dent_path)
+                log(extract_dents, 'Make Link: %s > %s' % (dent_path, inode['hlink']))
+                # Planned file, contents and attributes are set by plan.
+                if plan is not None:
+                    return
             else:
-                buf = process_reg_file(ubifs, inode, dent_path, inodes)
-                _write_reg_file(dent_path, buf)
+                if inode['ino'].nlink > 1:
+                    inode['hlink'] = dent_path
+
+                if plan is not None:
+                    plan.add(dent_path, inode)
+                    return
+
+                _write_reg_blocks(dent_path, iter_reg_file(ubifs, inode, dent_path, inodes))
 
             _set_file_timestamps(dent_path, inode)
 
@@ -185,3 +214,275 @@ def _write_reg_file(path, data):
     with open(path, 'wb') as f:
         f.write(data)
     log(_write_reg_file, 'Make File: %s' % (path))
+
+def _write_reg_blocks(path, blocks):
+    size = 0
+    with open(path, 'wb') as f:
+        for block in blocks:
+            size += len(block)
+            # Leave a hole for all \x00 blocks, if sparse files are on.
+            if settings.use_sparse_files and ZERO_BLOCK.startswith(block):
+                f.seek(size)
+            else:
+                f.write(block)
+        f.truncate(size)
+    log(_write_reg_blocks, 'Make File: %s' % (path))
+
+
+class extract_plan(object):
+    """Extract regular file contents of whole image in physical order
+
+    Arguments:
+    Obj:ubifs     -- UBIFS object.
+    Dict:inodes   -- Inodes from walk.index.
+    Bool:perms    -- Set owner and mode of files once written.
+
+    Files are created, sized and registered with add() while the tree
+    is extracted. run() collects every data node of them, sorts them by
+    offset in the image file and reads runs of neighbouring nodes in one
+    read. Each block is decompressed and written at its offset in its
+    file, so the image is read once front to back no matter how the
+    files are laid out. Timestamps and permissions are set after all
+    contents are written.
+
+    As with iter_reg_file, a file is filled with \x00 from the first
+    block that can't be decoded to its end, so damaged images extract
+    the same as serially.
+    """
+
+    # Largest read, and largest gap between nodes still read through.
+    max_read = 1024 * 1024
+    max_gap = UBIFS_BLOCK_SIZE
+    # Output files kept open at once.
+    max_open = 64
+
+    def __init__(self, ubifs: Ubifs, inodes: Mapping[int, Inode], perms: bool = False) -> None:
+        self.__name__ = 'extract_plan'
+        self._ubifs = ubifs
+        self._inodes = inodes
+        self._perms = perms
+        self._files: list[tuple[str, Inode]] = []
+        self._fds: OrderedDict[int, int] = OrderedDict()
+        # First failed block number, by file index.
+        self._failed: dict[int, int] = {}
+        self._reads = 0
+
+
+    def __repr__(self) -> str:
+        return 'UBIFS Extract Plan'
+
+
+    def add(self, path: str, inode: Inode) -> None:
+        """Create file at path and schedule its contents.
+
+        Arguments:
+        Str:path      -- Path of file.
+        Dict:inode    -- Inode of file.
+        """
+        with open(path, 'wb') as f:
+            f.truncate(inode['ino'].size)
+            if not settings.use_sparse_files and inode['ino'].size and hasattr(os, 'posix_fallocate'):
+                os.posix_fallocate(f.fileno(), 0, inode['ino'].size)
+        self._files.append((path, inode))
+        log(self, 'Make File: %s' % (path))
+
+
+    def _nodes(self) -> list[tuple[int, int, int, nodes.data_node]]:
+        # (physical address, file index, block number, data node)
+        start_key = UBIFS_DATA_KEY << UBIFS_S_KEY_BLOCK_BITS
+        plan = []
+        for file_idx, (path, inode) in enumerate(self._files):
+            end_block = (inode['ino'].size + UBIFS_BLOCK_SIZE - 1) // UBIFS_BLOCK_SIZE
+            last_block = -1
+            for data in sorted(inode.get('data', []), key=lambda x: x.key['khash']):
+                block_num = data.key['khash'] - start_key
+                # Same as iter_reg_file, first node of a block wins and
+                # nodes past the end of file are dropped.
+                if block_num <= last_block or block_num >= end_block:
+                    continue
+                last_block = block_num
+                plan.append((self._ubifs.file.physical_addr(data.offset), file_idx, block_num, data))
+
+        plan.sort(key=lambda x: x[0])
+        return plan
+
+
+    def _runs(self, plan: list[tuple[int, int, int, nodes.data_node]]):
+        leb_size = self._ubifs.leb_size
+        run: list[tuple[int, int, int, nodes.data_node]] = []
+        for item in plan:
+            data = item[3]
+            if run:
+                start = run[0][3].offset
+                end = run[-1][3].offset + run[-1][3].compr_len
+                # Reads don't span LEBs, they may not be adjacent in file.
+                if (data.offset < end or
+                        data.offset - end > self.max_gap or
+                        data.offset // leb_size != start // leb_size or
+                        data.offset + data.compr_len - start > self.max_read):
+                    yield run
+                    run = []
+            run.append(item)
+
+        if run:
+            yield run
+
+
+    def _fd(self, file_idx: int) -> int:
+        if file_idx in self._fds:
+            self._fds.move_to_end(file_idx)
+            return self._fds[file_idx]
+
+        if len(self._fds) >= self.max_open:
+            os.close(self._fds.popitem(last=False)[1])
+
+        fd = os.open(self._files[file_idx][0], os.O_WRONLY)
+        self._fds[file_idx] = fd
+        return fd
+
+
+    def _fail(self, file_idx: int, block_num: int, e: Exception) -> None:
+        # Warn once per file, keep the first failed block.
+        if file_idx not in self._failed:
+            path, inode = self._files[file_idx]
+            error(self, 'Warn', 'inode num:%s path:%s :%s' % (inode['ino'].key['ino_num'], path, e))
+        self._failed[file_idx] = min(block_num, self._failed.get(file_idx, block_num))
+
+
+    def _zero_failed(self) -> None:
+        # Blocks after a failed one may be written already, blocks are
+        # written in physical order.
+        for file_idx, block_num in self._failed.items():
+            path, inode = self._files[file_idx]
+            size = inode['ino'].size
+            offset = min(block_num * UBIFS_BLOCK_SIZE, size)
+            os.truncate(path, offset)
+            os.truncate(path, size)
+            if not settings.use_sparse_files and size > offset and hasattr(os, 'posix_fallocate'):
+                fd = os.open(path, os.O_WRONLY)
+                try:
+                    os.posix_fallocate(fd, offset, size - offset)
+                finally:
+                    os.close(fd)
+
+
+    def _jobs(self, plan: list[tuple[int, int, int, nodes.data_node]]):
+        # Read runs in order, payloads go to decode_iter.
+        for run in self._runs(plan):
+            start = run[0][3].offset
+            buf = self._ubifs.file.read_at(start, run[-1][3].offset + run[-1][3].compr_len - start)
+            self._reads += 1
+
+            for addr, file_idx, block_num, data in run:
+                try:
+                    key = inode_key(self._ubifs, self._inodes, self._files[file_idx][1])
+                except Exception as e:
+                    self._fail(file_idx, 0, e)
+                    continue
+                yield (file_idx, block_num), data, buf[data.offset - start:data.offset - start + data.compr_len], key
+
+
+    def run(self) -> None:
+        """Read, decompress and write all scheduled file contents."""
+        plan = self._nodes()
+        self._failed.clear()
+        self._reads = 0
+
+        try:
+            for (file_idx, block_num), block in decode_iter(self._jobs(plan)):
+                inode = self._files[file_idx][1]
+                try:
+                    if block_num > self._failed.get(file_idx, block_num):
+                        continue
+
+                    if block is None:
+                        raise Exception('Block %s could not be decompressed.' % block_num)
+
+                    file_offset = block_num * UBIFS_BLOCK_SIZE
+                    block = block[:min(UBIFS_BLOCK_SIZE, inode['ino'].size - file_offset)]
+                    # File is already sized, holes read as zeros.
+                    if settings.use_sparse_files and ZERO_BLOCK.startswith(block):
+                        continue
+
+                    os.pwrite(self._fd(file_idx), block, file_offset)
+
+                except Exception as e:
+                    self._fail(file_idx, block_num, e)
+
+        finally:
+            while self._fds:
+                os.close(self._fds.popitem()[1])
+
+        self._zero_failed()
+
+        log(self, 'Wrote %s data nodes of %s files in %s reads' % (len(plan), len(self._files), self._reads))
+
+        for path, inode in self._files:
+            try:
+                _set_file_timestamps(path, inode)
+
+                if self._perms:
+                    _set_file_perms(path, inode)
+
+            except Exception as e:
+                error(self, 'Warn', 'FILE Fail: %s' % e)
+
+
+class extract_scheduler(object):
+    """Extract regular file contents in a pool of threads
+
+    Arguments:
+    Obj:ubifs     -- UBIFS object.
+    Dict:inodes   -- Inodes from walk.index.
+    Bool:perms    -- Set owner and mode of files once written.
+    Obj:executor  -- Thread pool, shut down by the caller.
+
+    Files, like everything else in the tree, are created while it is
+    extracted, so directory entries and timestamps end up as they do
+    when extracting serially. add() hands writing the contents to the
+    pool, the file's timestamps and permissions are set once it is
+    written. run() waits for all of them.
+    """
+
+    def __init__(self, ubifs: Ubifs, inodes: Mapping[int, Inode], perms: bool, executor: ThreadPoolExecutor) -> None:
+        self.__name__ = 'extract_scheduler'
+        self._ubifs = ubifs
+        self._inodes = inodes
+        self._perms = perms
+        self._executor = executor
+        self._futures: list[Future] = []
+
+
+    def __repr__(self) -> str:
+        return 'UBIFS Extract Scheduler'
+
+
+    def add(self, path: str, inode: Inode) -> None:
+        """Create file at path and schedule its contents.
+
+        Arguments:
+        Str:path      -- Path of file.
+        Dict:inode    -- Inode of file.
+        """
+        open(path, 'wb').close()
+        self._futures.append(self._executor.submit(self._extract, path, inode))
+
+
+    def _extract(self, path: str, inode: Inode) -> None:
+        try:
+            _write_reg_blocks(path, iter_reg_file(self._ubifs, inode, path, self._inodes))
+            _set_file_timestamps(path, inode)
+
+            if self._perms:
+                _set_file_perms(path, inode)
+
+        except Exception as e:
+            error(self, 'Warn', 'FILE Fail: %s' % e)
+
+
+    def run(self) -> None:
+        """Wait for all scheduled files to be written."""
+        for future in self._futures:
+            future.result()
+
+        log(self, 'Wrote %s files' % len(self._futures))
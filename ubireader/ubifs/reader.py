@@ -0,0 +1,141 @@
+#!/usr/bin/env python
+#############################################################
+# ubi_reader/ubifs
+# (c) 2013 Jason Pruitt (jrspruitt@gmail.com)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#############################################################
+
+from __future__ import annotations
+import io
+import os
+from bisect import bisect_left
+from collections.abc import Mapping
+from typing import TYPE_CHECKING
+from ubireader.debug import log
+from ubireader.ubifs.defines import *
+from ubireader.ubifs.misc import read_data
+
+if TYPE_CHECKING:
+    from ubireader.ubifs import ubifs as Ubifs
+    from ubireader.ubifs.walk import Inode
+
+
+class file_reader(io.RawIOBase):
+    """Read-only, seekable file of a UBIFS regular file
+
+    Arguments:
+    Obj:ubifs     -- UBIFS object.
+    Dict:inode    -- Inode with 'ino' and 'data' nodes.
+    Dict:inodes   -- Inodes, for the encryption nonce.
+
+    Attributes:
+    Str:name      -- Path file was opened with, if any.
+
+    Data nodes are indexed by block number, reads only decompress the
+    blocks covering the requested range. Missing blocks read as zeros.
+    The last block read is kept, so small sequential reads decompress
+    each block once.
+    """
+
+    def __init__(self, ubifs: Ubifs, inode: Inode, inodes: Mapping[int, Inode], name: str = '') -> None:
+        super().__init__()
+        self.__name__ = 'file_reader'
+        self.name = name
+        self._ubifs = ubifs
+        self._inode = inode
+        self._inodes = inodes
+        self._size = inode['ino'].size
+        self._pos = 0
+
+        start_key = UBIFS_DATA_KEY << UBIFS_S_KEY_BLOCK_BITS
+        data = sorted(inode.get('data', []), key=lambda x: x.key['khash'])
+        self._blocks = [d.key['khash'] - start_key for d in data]
+        self._data = data
+        self._cached_block = -1
+        self._cached_buf = b''
+        log(self, 'Opened %s, size: %s, data nodes: %s' % (name, self._size, len(data)))
+
+
+    def __repr__(self) -> str:
+        return 'UBIFS File Reader'
+
+
+    def readable(self) -> bool:
+        return True
+
+
+    def seekable(self) -> bool:
+        return True
+
+
+    def tell(self) -> int:
+        return self._pos
+
+
+    def seek(self, offset: int, whence: int = os.SEEK_SET) -> int:
+        if whence == os.SEEK_SET:
+            pos = offset
+        elif whence == os.SEEK_CUR:
+            pos = self._pos + offset
+        elif whence == os.SEEK_END:
+            pos = self._size + offset
+        else:
+            raise ValueError('Invalid whence: %s' % whence)
+
+        if pos < 0:
+            raise ValueError('Negative seek position: %s' % pos)
+
+        self._pos = pos
+        return pos
+
+
+    def _block(self, block_num: int) -> bytes:
+        if block_num == self._cached_block:
+            return self._cached_buf
+
+        i = bisect_left(self._blocks, block_num)
+        if i < len(self._blocks) and self._blocks[i] == block_num:
+            buf = read_data(self._ubifs, self._inode, self._data[i], self._inodes)
+            if buf is None:
+                raise OSError('Could not decompress block %s of %s' % (block_num, self.name))
+        else:
+            buf = b''
+
+        self._cached_block = block_num
+        self._cached_buf = buf
+        return buf
+
+
+    def readinto(self, b: bytearray | memoryview) -> int:
+        if self.closed:
+            raise ValueError('I/O operation on closed file.')
+
+        end = min(self._pos + len(b), self._size)
+        if end <= self._pos:
+            return 0
+
+        out = memoryview(b).cast('B')
+        written = 0
+        while self._pos < end:
+            block_num, block_offset = divmod(self._pos, UBIFS_BLOCK_SIZE)
+            size = min(UBIFS_BLOCK_SIZE - block_offset, end - self._pos)
+            chunk = self._block(block_num)[block_offset:block_offset + size]
+            out[written:written + len(chunk)] = chunk
+            # Holes and short blocks read as zeros.
+            out[written + len(chunk):written + size] = b'\x00' * (size - len(chunk))
+            written += size
+            self._pos += size
+
+        return written
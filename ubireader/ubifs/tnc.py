@@ -0,0 +1,227 @@
+#!/usr/bin/env python
+#############################################################
+# ubi_reader/ubifs
+# (c) 2013 Jason Pruitt (jrspruitt@gmail.com)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#############################################################
+
+from __future__ import annotations
+from collections.abc import MutableMapping
+from typing import TYPE_CHECKING
+from ubireader import settings
+from ubireader.debug import log
+from ubireader.ubifs import walk
+from ubireader.ubifs.decrypt import decrypt_filenames
+from ubireader.ubifs.defines import *
+
+if TYPE_CHECKING:
+    from ubireader.ubifs import ubifs as Ubifs, nodes
+    from ubireader.ubifs.walk import Inode
+
+# Keys compare as (inode number, type << 29 | hash or block number).
+Key = tuple[int, int]
+
+
+def key(ino_num: int, key_type: int, value: int = 0) -> Key:
+    """Build comparable key.
+
+    Arguments:
+    Int:ino_num   -- Inode number.
+    Int:key_type  -- UBIFS_INO_KEY, UBIFS_DATA_KEY, etc.
+    Int:value     -- (optional) Name hash or block number.
+
+    Returns:
+    Tuple:key     -- Compares like the keys in the index.
+    """
+    return (ino_num, (key_type << UBIFS_S_KEY_BLOCK_BITS) | (value & UBIFS_S_KEY_BLOCK_MASK))
+
+
+def name_hash(ubifs: Ubifs, name: bytes) -> int:
+    """Hash of name used in dent and xent keys.
+
+    Arguments:
+    Obj:ubifs     -- UBIFS object.
+    Bin:name      -- Entry name.
+
+    Returns:
+    Int           -- r5 or test hash, as set in the superblock.
+    """
+    if ubifs.superblock_node.key_hash == UBIFS_KEY_HASH_TEST:
+        a = int.from_bytes(name[:4], 'little')
+    else:
+        a = 0
+        for c in name:
+            # Kernel hashes the name as signed chars.
+            c = c - 256 if c > 127 else c
+            a = (a + (c << 4)) & 0xFFFFFFFF
+            a = (a + (c >> 4)) & 0xFFFFFFFF
+            a = (a * 11) & 0xFFFFFFFF
+
+    a &= UBIFS_S_KEY_HASH_MASK
+    # Hash values 0, 1 and 2 are reserved.
+    if a <= 2:
+        a += 3
+    return a
+
+
+def scan(ubifs: Ubifs, low: Key, high: Key, inodes: MutableMapping[int, Inode], bad_blocks: list[int] = []) -> int:
+    """Read leaf nodes with keys from low to high into inodes.
+
+    Arguments:
+    Obj:ubifs       -- UBIFS object.
+    Tuple:low       -- First key, inclusive.
+    Tuple:high      -- Last key, inclusive.
+    Dict:inodes     -- Dict of ino/dent/file nodes keyed to inode number,
+                       same as walk.index fills.
+    List:bad_blocks -- (optional) LEBs to skip.
+
+    Returns:
+    Int             -- Number of index and leaf nodes read.
+
+    Descends from the root of the index, only following branches whose
+    key range overlaps low to high. Branch i of an index node holds
+    keys from its own key up to the key of branch i + 1, equal keys of
+    hash collisions can be on either side of it. Leaves are added in
+    key order.
+    """
+    stack = [(ubifs.master_node.root_lnum, ubifs.master_node.root_offs, 0)]
+    visited = set()
+
+    while stack:
+        lnum, offset, depth = stack.pop()
+
+        if (lnum, offset) in visited:
+            walk._walk_error('LEB: %s at %s, Node already visited, index has a loop.' % (lnum, offset))
+            continue
+
+        if depth > settings.walk_max_depth:
+            walk._walk_error('LEB: %s at %s, Index deeper than %s levels.' % (lnum, offset, settings.walk_max_depth))
+            continue
+
+        visited.add((lnum, offset))
+        idxn = walk._node(ubifs, lnum, offset, inodes, bad_blocks)
+        if not idxn:
+            continue
+
+        branches = idxn.branches
+        for i in reversed(range(0, len(branches))):
+            branch_key = (branches[i].key['ino_num'], branches[i].key['khash'])
+            if branch_key > high:
+                continue
+
+            if idxn.level == 0:
+                if branch_key < low:
+                    continue
+            elif i + 1 < len(branches):
+                next_key = (branches[i + 1].key['ino_num'], branches[i + 1].key['khash'])
+                if next_key < low:
+                    continue
+
+            stack.append((branches[i].lnum, branches[i].offs, depth + 1))
+
+    log(scan, 'Read %s nodes for keys %s - %s' % (len(visited), low, high))
+    return len(visited)
+
+
+def lookup_dent(ubifs: Ubifs, parent: int, name: str, inodes: MutableMapping[int, Inode]) -> nodes.dent_node | None:
+    """Find directory entry by name.
+
+    Arguments:
+    Obj:ubifs       -- UBIFS object.
+    Int:parent      -- Inode number of directory.
+    Str:name        -- Entry name.
+    Dict:inodes     -- Nodes read are added here.
+
+    Returns:
+    Obj:dent_node   -- Entry, None if not found.
+
+    Reads only the entries with the same name hash.
+    """
+    raw_name = name.encode()
+    dent_key = key(parent, UBIFS_DENT_KEY, name_hash(ubifs, raw_name))
+    found: dict[int, Inode] = {}
+    scan(ubifs, dent_key, dent_key, found)
+
+    match = None
+    for dent in found.get(parent, {}).get('dent', []):
+        if dent.raw_name == raw_name:
+            dent.name = name
+            match = dent
+
+    if match is not None:
+        inodes.setdefault(parent, {}).setdefault('dent', []).append(match)
+    return match
+
+
+def load_inode(ubifs: Ubifs, ino_num: int, inodes: MutableMapping[int, Inode], data: bool = False) -> Inode | None:
+    """Read inode node, and optionally its data nodes.
+
+    Arguments:
+    Obj:ubifs       -- UBIFS object.
+    Int:ino_num     -- Inode number.
+    Dict:inodes     -- Nodes read are added here.
+    Bool:data       -- (optional) Also read data nodes of inode.
+
+    Returns:
+    Dict:Inode      -- Entry in inodes, None if inode wasn't found.
+    """
+    high = key(ino_num, UBIFS_DATA_KEY if data else UBIFS_INO_KEY, UBIFS_S_KEY_BLOCK_MASK)
+    scan(ubifs, key(ino_num, UBIFS_INO_KEY), high, inodes)
+    return inodes.get(ino_num)
+
+
+def load_dir(ubifs: Ubifs, ino_num: int, inodes: MutableMapping[int, Inode], recursive: bool = False) -> None:
+    """Read entries of directory and inode nodes they point to.
+
+    Arguments:
+    Obj:ubifs       -- UBIFS object.
+    Int:ino_num     -- Inode number of directory.
+    Dict:inodes     -- Nodes read are added here.
+    Bool:recursive  -- (optional) Also load sub directories.
+    """
+    dirs = [ino_num]
+    while dirs:
+        dir_num = dirs.pop()
+        found: dict[int, Inode] = {}
+        scan(ubifs, key(dir_num, UBIFS_DENT_KEY), key(dir_num, UBIFS_DENT_KEY, UBIFS_S_KEY_HASH_MASK), found)
+        dents = found.get(dir_num, {}).get('dent', [])
+        decrypt_filenames(ubifs, found)
+        inodes.setdefault(dir_num, {})['dent'] = dents
+
+        for dent in dents:
+            if dent.inum not in inodes:
+                load_inode(ubifs, dent.inum, inodes)
+            if recursive and dent.type == UBIFS_ITYPE_DIR:
+                dirs.append(dent.inum)
+
+
+def find_path(ubifs: Ubifs, names: list[str], inodes: MutableMapping[int, Inode]) -> int | None:
+    """Resolve path to inode number.
+
+    Arguments:
+    Obj:ubifs       -- UBIFS object.
+    List:names      -- Path components from root.
+    Dict:inodes     -- Nodes read are added here.
+
+    Returns:
+    Int             -- Inode number, None if not found.
+    """
+    ino_num = UBIFS_ROOT_INO
+    for name in names:
+        dent = lookup_dent(ubifs, ino_num, name, inodes)
+        if dent is None:
+            return None
+        ino_num = dent.inum
+    return ino_num
@@ -18,6 +18,7 @@
 #############################################################
 
 from __future__ import annotations
+import heapq
 from collections.abc import MutableMapping
 from typing import TYPE_CHECKING, TypedDict
 from ubireader import settings
@@ -27,6 +28,7 @@ from ubireader.debug import error, log, verbose_log, verbose_display
 from ubireader.ubifs.decrypt import decrypt_filenames
 
 if TYPE_CHECKING:
+    from cryptography.hazmat.primitives.ciphers import algorithms
     from ubireader.ubifs import ubifs as Ubifs
 
 class Inode(TypedDict, total=False):
@@ -35,8 +37,10 @@ class Inode(TypedDict, total=False):
     dent: list[nodes.dent_node]
     xent: list[nodes.xent_node]
     hlink: str
+    fscrypt_key: algorithms.AES
 
-def index(ubifs: Ubifs, lnum: int, offset: int, inodes: MutableMapping[int, Inode] = {}, bad_blocks: list[int] = []) -> None:
+def index(ubifs: Ubifs, lnum: int, offset: int, inodes: MutableMapping[int, Inode] = {}, bad_blocks: list[int] = [],
+          data: bool = True) -> None:
     """Walk the index gathering Inode, Dir Entry, and File nodes.
 
     Arguments:
@@ -44,6 +48,8 @@ def index(ubifs: Ubifs, lnum: int, offset: int, inodes: MutableMapping[int, Inod
     Int:lnum     -- Logical erase block number.
     Int:offset   -- Offset in logical erase block.
     Dict:inodes  -- Dict of ino/dent/file nodes keyed to inode number.
+    Bool:data    -- (optional) Read data nodes, if False only metadata
+                    is gathered and 'data' lists are left out.
 
     Returns:
     Dict:inodes  -- Dict of ino/dent/file nodes keyed to inode number.
@@ -52,10 +58,11 @@ def index(ubifs: Ubifs, lnum: int, offset: int, inodes: MutableMapping[int, Inod
         'dent'   -- List of directory entry nodes if present.
         'xent'   -- List of extended directory entry nodes if present.
     """
-    _index(ubifs, lnum, offset, inodes, bad_blocks)
+    _index(ubifs, lnum, offset, inodes, bad_blocks, data)
     decrypt_filenames(ubifs, inodes)
 
-def _index(ubifs: Ubifs, lnum: int, offset: int, inodes: MutableMapping[int, Inode] = {}, bad_blocks: list[int] = []) -> None:
+def _index(ubifs: Ubifs, lnum: int, offset: int, inodes: MutableMapping[int, Inode] = {}, bad_blocks: list[int] = [],
+           data: bool = True) -> None:
     """Walk the index gathering Inode, Dir Entry, and File nodes.
 
     Arguments:
@@ -63,6 +70,7 @@ def _index(ubifs: Ubifs, lnum: int, offset: int, inodes: MutableMapping[int, Ino
     Int:lnum     -- Logical erase block number.
     Int:offset   -- Offset in logical erase block.
     Dict:inodes  -- Dict of ino/dent/file nodes keyed to inode number.
+    Bool:data    -- (optional) Read data nodes.
 
     Returns:
     Dict:inodes  -- Dict of ino/dent/file nodes keyed to inode number.
@@ -70,13 +78,147 @@ def _index(ubifs: Ubifs, lnum: int, offset: int, inodes: MutableMapping[int, Ino
         'data'   -- List of data nodes if present.
         'dent'   -- List of directory entry nodes if present.
         'xent'   -- List of extended directory entry nodes if present.
+
+    Nodes are visited depth first with an explicit stack, in the same
+    order as branches appear in index nodes. A node reached twice, a
+    branch deeper than settings.walk_max_depth or more nodes than
+    settings.walk_max_nodes mean a corrupted index.
+
+    If settings.walk_physical_order is set, nodes are read in file
+    order instead, see _frontier. Leaf nodes are kept with their path
+    of branch numbers and added to inodes in key order at the end, so
+    inodes is the same either way.
+
+    Branches of level 0 index nodes point at leaf nodes, with data
+    unset the ones with data keys are not followed, so data nodes are
+    never read.
+    """
+    physical = settings.walk_physical_order
+    frontier = _frontier(ubifs, physical)
+    frontier.push(lnum, offset, ())
+    visited = set()
+    leaves = []
+
+    while frontier:
+        lnum, offset, path = frontier.pop()
+
+        if (lnum, offset) in visited:
+            _walk_error('LEB: %s at %s, Node already visited, index has a loop.' % (lnum, offset))
+            continue
+
+        if len(path) > settings.walk_max_depth:
+            _walk_error('LEB: %s at %s, Index deeper than %s levels.' % (lnum, offset, settings.walk_max_depth))
+            continue
+
+        if settings.walk_max_nodes and len(visited) >= settings.walk_max_nodes:
+            _walk_error('Index has more than %s nodes.' % settings.walk_max_nodes)
+            break
+
+        visited.add((lnum, offset))
+        if physical:
+            leaf_inodes: dict[int, Inode] = {}
+            idxn = _node(ubifs, lnum, offset, leaf_inodes, bad_blocks)
+            if leaf_inodes:
+                leaves.append((path, leaf_inodes))
+        else:
+            idxn = _node(ubifs, lnum, offset, inodes, bad_blocks)
+
+        if idxn:
+            for i in reversed(range(0, len(idxn.branches))):
+                branch = idxn.branches[i]
+                if not data and idxn.level == 0 and branch.key['type'] == UBIFS_DATA_KEY:
+                    continue
+                frontier.push(branch.lnum, branch.offs, path + (i,))
+
+    leaves.sort(key=lambda leaf: leaf[0])
+    for _, leaf_inodes in leaves:
+        for ino_num, leaf in leaf_inodes.items():
+            inode = inodes.setdefault(ino_num, {})
+            for key, value in leaf.items():
+                if key == 'ino':
+                    inode['ino'] = value
+                else:
+                    inode.setdefault(key, []).extend(value)
+
+    log(index, 'Walked %s nodes, %s bytes of seeks' % (len(visited), frontier.seek_distance))
+
+
+class _frontier(object):
+    """Index nodes waiting to be read
+
+    Arguments:
+    Obj:ubifs      -- UBIFS object.
+    Bool:physical  -- Order by file address instead of key.
+
+    Attributes:
+    Int:seek_distance -- Sum of distances between file addresses of
+                         nodes popped, to compare orders.
+
+    Key order is a stack, branches are pushed last to first.
+    Physical order sweeps forward through the file, popping the nearest
+    pending node after the last one. Nodes behind it wait for the next
+    sweep, so each LEB is read in one go as far as possible.
+    """
+
+    def __init__(self, ubifs: Ubifs, physical: bool) -> None:
+        self._ubifs = ubifs
+        self._physical = physical
+        self._pending: list[tuple] = []
+        self._next_sweep: list[tuple] = []
+        self._pos = 0
+        self.seek_distance = 0
+
+
+    def __len__(self) -> int:
+        return len(self._pending) + len(self._next_sweep)
+
+
+    def _addr(self, lnum: int, offset: int) -> int:
+        return self._ubifs.file.physical_addr(self._ubifs.leb_size * lnum + offset)
+
+
+    def push(self, lnum: int, offset: int, path: tuple[int, ...]) -> None:
+        if not self._physical:
+            self._pending.append((lnum, offset, path))
+            return
+
+        entry = (self._addr(lnum, offset), path, lnum, offset)
+        heapq.heappush(self._pending if entry[0] >= self._pos else self._next_sweep, entry)
+
+
+    def pop(self) -> tuple[int, int, tuple[int, ...]]:
+        if not self._physical:
+            lnum, offset, path = self._pending.pop()
+            addr = self._addr(lnum, offset)
+        else:
+            if not self._pending:
+                self._pending, self._next_sweep = self._next_sweep, []
+            addr, path, lnum, offset = heapq.heappop(self._pending)
+
+        self.seek_distance += abs(addr - self._pos)
+        self._pos = addr
+        return lnum, offset, path
+
+
+def _walk_error(msg: str) -> None:
+    if settings.warn_only_block_read_errors:
+        error(index, 'Error', msg)
+    else:
+        error(index, 'Fatal', msg)
+
+
+def _node(ubifs: Ubifs, lnum: int, offset: int, inodes: MutableMapping[int, Inode], bad_blocks: list[int]) -> nodes.idx_node | None:
+    """Read node at lnum:offset into inodes.
+
+    Returns:
+    Obj:idx_node -- Index node, None for other node types.
     """
     if len(bad_blocks):
         if lnum in bad_blocks:
             return
 
-    ubifs.file.seek((ubifs.leb_size * lnum) + offset)
-    buf = ubifs.file.read(UBIFS_COMMON_HDR_SZ)
+    node_addr = (ubifs.leb_size * lnum) + offset
+    buf = ubifs.file.read_at(node_addr, UBIFS_COMMON_HDR_SZ)
 
     if len(buf) < UBIFS_COMMON_HDR_SZ:
         if settings.warn_only_block_read_errors:
@@ -87,7 +229,7 @@ def _index(ubifs: Ubifs, lnum: int, offset: int, inodes: MutableMapping[int, Ino
             error(index, 'Fatal', 'LEB: %s, Common Hdr Size smaller than expected.' % (lnum))
 
     chdr = nodes.common_hdr(buf)
-    log(index , '%s file addr: %s' % (chdr, ubifs.file.last_read_addr()))
+    log(index , '%s file addr: %s' % (chdr, ubifs.file.physical_addr(node_addr)))
     verbose_display(chdr)
     read_size = chdr.len - UBIFS_COMMON_HDR_SZ
     if read_size < 0:
@@ -96,8 +238,12 @@ def _index(ubifs: Ubifs, lnum: int, offset: int, inodes: MutableMapping[int, Ino
             return
         else:
             error(index, 'Fatal', 'LEB: %s at %s, Node len (%s) < common header size.' % (lnum, ubifs.leb_size * lnum + offset, chdr.len))
-    node_buf = ubifs.file.read(read_size)
-    file_offset = ubifs.file.last_read_addr()
+    node_len = read_size
+    if chdr.node_type == UBIFS_DATA_NODE:
+        # Payload is read when the file is extracted, only the header here.
+        read_size = min(read_size, UBIFS_DATA_NODE_SZ)
+    node_buf = ubifs.file.read_at(node_addr + UBIFS_COMMON_HDR_SZ, read_size)
+    file_offset = ubifs.file.physical_addr(node_addr + UBIFS_COMMON_HDR_SZ)
 
     if len(node_buf) < read_size:
         if settings.warn_only_block_read_errors:
@@ -127,9 +273,10 @@ def _index(ubifs: Ubifs, lnum: int, offset: int, inodes: MutableMapping[int, Ino
             verbose_log(index, '-------------------')
             log(index, '%s file addr: %s' % (branch, file_offset + UBIFS_IDX_NODE_SZ + (branch_idx * UBIFS_BRANCH_SZ)))
             verbose_display(branch)
-            _index(ubifs, branch.lnum, branch.offs, inodes, bad_blocks)
             branch_idx += 1
 
+        return idxn
+
     elif chdr.node_type == UBIFS_INO_NODE:
         try:
             inon = nodes.ino_node(node_buf)
@@ -153,7 +300,8 @@ def _index(ubifs: Ubifs, lnum: int, offset: int, inodes: MutableMapping[int, Ino
 
     elif chdr.node_type == UBIFS_DATA_NODE:
         try:
-            datn = nodes.data_node(node_buf, (ubifs.leb_size * lnum) + UBIFS_COMMON_HDR_SZ + offset + UBIFS_DATA_NODE_SZ)
+            datn = nodes.data_node(node_buf, (ubifs.leb_size * lnum) + UBIFS_COMMON_HDR_SZ + offset + UBIFS_DATA_NODE_SZ,
+                                   node_len - UBIFS_DATA_NODE_SZ)
 
         except Exception as e:
             if settings.warn_only_block_read_errors:
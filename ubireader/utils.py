@@ -18,13 +18,68 @@
 #############################################################
 
 from __future__ import annotations
-import re
+import mmap
+from collections import Counter
+from collections.abc import Callable
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, TypedDict
+from zlib import crc32
+from ubireader import settings
 from ubireader.debug import error, log
-from ubireader.ubi.defines import UBI_EC_HDR_MAGIC, FILE_CHUNK_SZ
-from ubireader.ubifs.defines import UBIFS_NODE_MAGIC, UBIFS_SB_NODE_SZ, UBIFS_SB_NODE, UBIFS_COMMON_HDR_SZ
+from ubireader.scan_index import open_scan_index
+from ubireader.ubi.defines import UBI_EC_HDR_MAGIC, UBI_EC_HDR_SZ, UBI_CRC32_INIT, FILE_CHUNK_SZ
+from ubireader.ubi.headers import ec_hdr
+from ubireader.ubifs.defines import UBIFS_NODE_MAGIC, UBIFS_SB_NODE_SZ, UBIFS_SB_NODE, UBIFS_COMMON_HDR_SZ, \
+                                     UBIFS_MST_LNUM, UBIFS_MST_NODE
 from ubireader.ubifs import nodes
 
+class Probe(TypedDict):
+    start_offset: int
+    filetype: bytes
+    peb_size: int | None
+    leb_size: int | None
+    vid_hdr_offset: int | None
+    data_offset: int | None
+    confidence: float
+
+PROBE_FIELDS = list(Probe.__annotations__)
+
+class Region(TypedDict):
+    start_offset: int
+    end_offset: int | None
+    filetype: bytes
+    block_size: int
+
+def _cached_guess(name: str, guess: Callable[..., int | None], path: str, *args: int) -> int | None:
+    """Run guess function, or load its result from the scan index.
+
+    Arguments:
+    Str:name     -- Name of result in scan index.
+    Func:guess   -- Guess function.
+    Str:path     -- Path to file.
+    Args         -- Extra arguments of guess function.
+
+    Returns:
+    Int          -- Result of guess function.
+    """
+    index = open_scan_index(path)
+    if index is None:
+        return guess(path, *args)
+
+    value = index.get_param(name)
+    if value is None:
+        value = guess(path, *args)
+        if value is not None:
+            index.put_param(name, value)
+
+    return value
+
+
 def guess_start_offset(path: str, guess_offset: int =0) -> int | None:
+    return _cached_guess('start_offset_%s' % guess_offset, _guess_start_offset, path, guess_offset)
+
+
+def _guess_start_offset(path: str, guess_offset: int =0) -> int | None:
     file_offset = guess_offset
 
     f = open(path, 'rb')
@@ -82,103 +137,247 @@ def guess_filetype(path: str, start_offset: int = 0) -> bytes | None:
     return ftype
 
 
-def guess_leb_size(path: str) -> int | None:
-    """Get LEB size from superblock
-
-    Arguments:
-    Str:path    -- Path to file.
-    
-    Returns:
-    Int         -- LEB size.
-    
-    Searches file for superblock and retrieves leb size.
-    """
+def _valid_ec_hdr(buf: bytes | mmap.mmap, offset: int) -> bool:
+    hdr = buf[offset:offset + UBI_EC_HDR_SZ]
+    return len(hdr) == UBI_EC_HDR_SZ and (~crc32(hdr[:-4]) & UBI_CRC32_INIT) == int.from_bytes(hdr[-4:], 'big')
 
-    f = open(path, 'rb')
-    f.seek(0,2)
-    file_size = f.tell()+1
-    f.seek(0)
-    block_size = None
 
-    for _ in range(0, file_size, FILE_CHUNK_SZ):
-        buf = f.read(FILE_CHUNK_SZ)
+def _valid_ubifs_node(buf: bytes | mmap.mmap, offset: int, node_type: int) -> nodes.common_hdr | None:
+    hdr_buf = buf[offset:offset + UBIFS_COMMON_HDR_SZ]
+    if len(hdr_buf) != UBIFS_COMMON_HDR_SZ:
+        return None
 
-        for m in re.finditer(UBIFS_NODE_MAGIC, buf):
-            start = m.start()
-            chdr = nodes.common_hdr(buf[start:start+UBIFS_COMMON_HDR_SZ])
+    chdr = nodes.common_hdr(hdr_buf)
+    if chdr.node_type != node_type or chdr.len < UBIFS_COMMON_HDR_SZ:
+        return None
 
-            if chdr and chdr.node_type == UBIFS_SB_NODE:
-                sb_start = start + UBIFS_COMMON_HDR_SZ
-                sb_end = sb_start + UBIFS_SB_NODE_SZ
+    node_buf = buf[offset + 8:offset + chdr.len]
+    if len(node_buf) != chdr.len - 8 or (~crc32(node_buf) & UBI_CRC32_INIT) != chdr.crc:
+        return None
 
-                if chdr.len != len(buf[sb_start:sb_end]):
-                    f.seek(sb_start)
-                    buf = f.read(UBIFS_SB_NODE_SZ)
-                else:
-                    buf = buf[sb_start:sb_end]
+    return chdr
 
-                sbn = nodes.sb_node(buf)
-                block_size = sbn.leb_size
-                f.close()
-                return block_size
 
-    f.close()
-    return block_size
+def _map_file(path: str, caller: Callable) -> mmap.mmap:
+    with open(path, 'rb') as f:
+        try:
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError as e:
+            error(caller, 'Fatal', 'Could not map file: %s' % e)
 
 
-def guess_peb_size(path: str) -> int | None:
-    """Determine the most likely block size
+def probe(path: str, guess_offset: int = 0) -> Probe:
+    """Find where UBI or UBIFS data starts and its parameters
 
     Arguments:
-    Str:path    -- Path to file.
-    
+    Str:path          -- Path to file.
+    Int:guess_offset  -- (optional) Where to start looking in file.
+
     Returns:
-    Int         -- PEB size.
-    
-    Searches file for Magic Number, picks most 
-        common length between them.
+    Dict:Probe        -- Image parameters.
+        'start_offset'   -- Offset of first valid EC header or UBIFS
+                            superblock node.
+        'filetype'       -- UBI_EC_HDR_MAGIC or UBIFS_NODE_MAGIC.
+        'peb_size'       -- Most common distance between valid EC
+                            headers, UBI only.
+        'leb_size'       -- LEB size, from superblock for UBIFS.
+        'vid_hdr_offset' -- From first EC header, UBI only.
+        'data_offset'    -- From first EC header, UBI only.
+        'confidence'     -- 0.0 - 1.0, how consistent the found
+                            headers are.
+
+    Makes one pass over the memory mapped file, candidates are
+    validated by header CRC, so magic numbers in data are skipped.
+    Result is kept in the scan index, if enabled.
     """
-    file_offset = 0
-    offsets: list[int] = []
-    f = open(path, 'rb')
-    f.seek(0,2)
-    file_size = f.tell()+1
-    f.seek(0)
-
-    for _ in range(0, file_size, FILE_CHUNK_SZ):
-        buf = f.read(FILE_CHUNK_SZ)
-        for m in re.finditer(UBI_EC_HDR_MAGIC, buf):
-            start = m.start()
+    index = open_scan_index(path)
+    name = 'probe_%s' % guess_offset
+    if index is not None:
+        values = [index.get_param('%s_%s' % (name, field)) for field in PROBE_FIELDS]
+        if values[0] is not None:
+            return Probe(**dict(zip(PROBE_FIELDS, values)))
+
+    with _map_file(path, probe) as buf:
+        result = _probe(buf, guess_offset)
+
+    if index is not None:
+        for field in PROBE_FIELDS:
+            index.put_param('%s_%s' % (name, field), result[field])
+
+    return result
+
+
+def _probe(buf: mmap.mmap, guess_offset: int) -> Probe:
+    # Start is the first valid EC header or UBIFS superblock.
+    ubi_loc = buf.find(UBI_EC_HDR_MAGIC, guess_offset)
+    ubifs_loc = buf.find(UBIFS_NODE_MAGIC, guess_offset)
+    sb_chdr = None
+
+    while ubi_loc != -1 or ubifs_loc != -1:
+        if ubifs_loc == -1 or (ubi_loc != -1 and ubi_loc < ubifs_loc):
+            if _valid_ec_hdr(buf, ubi_loc):
+                break
+            ubi_loc = buf.find(UBI_EC_HDR_MAGIC, ubi_loc + 1)
+        else:
+            sb_chdr = _valid_ubifs_node(buf, ubifs_loc, UBIFS_SB_NODE)
+            if sb_chdr:
+                break
+            ubifs_loc = buf.find(UBIFS_NODE_MAGIC, ubifs_loc + 1)
+    else:
+        error(probe, 'Fatal', 'Could not determine start offset.')
+
+    if sb_chdr:
+        log(probe, 'Found UBIFS superblock at %s' % ubifs_loc)
+        sb_start = ubifs_loc + UBIFS_COMMON_HDR_SZ
+        sbn = nodes.sb_node(buf[sb_start:sb_start + UBIFS_SB_NODE_SZ])
+        # Master node is at start of LEB 1, if LEB size is right.
+        mst_chdr = _valid_ubifs_node(buf, ubifs_loc + sbn.leb_size * UBIFS_MST_LNUM, UBIFS_MST_NODE)
+        return Probe(start_offset=ubifs_loc, filetype=UBIFS_NODE_MAGIC, peb_size=None, leb_size=sbn.leb_size,
+                     vid_hdr_offset=None, data_offset=None, confidence=1.0 if mst_chdr else 0.5)
+
+    log(probe, 'Found UBI EC header at %s' % ubi_loc)
+    first_hdr = ec_hdr(buf[ubi_loc:ubi_loc + UBI_EC_HDR_SZ])
+    magic_count = 0
+    offsets = []
+    loc = ubi_loc
+
+    while loc != -1:
+        magic_count += 1
+        if _valid_ec_hdr(buf, loc):
+            offsets.append(loc)
+        loc = buf.find(UBI_EC_HDR_MAGIC, loc + 1)
+
+    diffs = Counter(b - a for a, b in zip(offsets, offsets[1:]))
+    if diffs:
+        peb_size, peb_size_count = diffs.most_common(1)[0]
+        confidence = (len(offsets) / magic_count) * (peb_size_count / (len(offsets) - 1))
+    else:
+        peb_size = None
+        confidence = 0.0
 
-            if not file_offset:
-                file_offset = start
-                idx = start
-            else:
-                idx = start+file_offset
+    log(probe, 'PEB size: %s, %s of %s EC headers valid' % (peb_size, len(offsets), magic_count))
+    return Probe(start_offset=ubi_loc, filetype=UBI_EC_HDR_MAGIC, peb_size=peb_size,
+                 leb_size=peb_size - first_hdr.data_offset if peb_size else None,
+                 vid_hdr_offset=first_hdr.vid_hdr_offset, data_offset=first_hdr.data_offset,
+                 confidence=round(confidence, 3))
 
-            offsets.append(idx)
 
-        file_offset += FILE_CHUNK_SZ
-    f.close()
+def find_regions(path: str, guess_offset: int = 0) -> list[Region]:
+    """Find every UBI and UBIFS region in file
 
-    occurrences: dict[int, int] = {}
-    for i in range(0, len(offsets)):
-        try:
-            diff = offsets[i] - offsets[i-1]
-        except:
-            diff = offsets[i]
+    Arguments:
+    Str:path          -- Path to file.
+    Int:guess_offset  -- (optional) Where to start looking in file.
 
-        if diff not in occurrences:
-            occurrences[diff] = 0
+    Returns:
+    List:Region       -- Regions in file order.
+        'start_offset'   -- Offset of first EC header or superblock.
+        'end_offset'     -- Offset after last PEB or LEB of region.
+        'filetype'       -- UBI_EC_HDR_MAGIC or UBIFS_NODE_MAGIC.
+        'block_size'     -- PEB size for UBI, LEB size for UBIFS.
+
+    One pass over the memory mapped file collects all valid EC headers
+    and UBIFS superblocks. A UBI region runs while EC headers stay on
+    its PEB grid, a UBIFS region is leb_cnt LEBs from its superblock.
+    Headers inside a region that are not on its block grid, like
+    images stored as files, are skipped.
+    """
+    with _map_file(path, find_regions) as buf:
+        candidates = _find_candidates(buf, guess_offset)
+        file_size = len(buf)
+
+    regions = []
+    i = 0
+    while i < len(candidates):
+        loc, filetype, hdr = candidates[i]
+
+        if filetype == UBIFS_NODE_MAGIC:
+            block_size = hdr.leb_size
+            end_offset = min(loc + hdr.leb_cnt * block_size, file_size)
+            i += 1
+            while i < len(candidates) and candidates[i][0] < end_offset:
+                if (candidates[i][0] - loc) % block_size == 0:
+                    end_offset = candidates[i][0]
+                    break
+                i += 1
 
-        occurrences[diff] += 1
+        else:
+            ec_locs = [c[0] for c in candidates[i:i + 64] if c[1] == UBI_EC_HDR_MAGIC]
+            diffs = Counter(b - a for a, b in zip(ec_locs, ec_locs[1:]))
+            if not diffs:
+                log(find_regions, 'Single EC header at %s, PEB size unknown, skipping.' % loc)
+                i += 1
+                continue
+
+            block_size = diffs.most_common(1)[0][0]
+            last = loc
+            i += 1
+            while i < len(candidates):
+                next_loc, next_filetype, _ = candidates[i]
+                if next_filetype == UBI_EC_HDR_MAGIC and (next_loc - loc) % block_size == 0:
+                    last = next_loc
+                elif next_loc >= last + block_size:
+                    break
+                i += 1
+            end_offset = min(last + block_size, file_size)
+
+        log(find_regions, 'Found %s region %s - %s, block size %s' % ('UBI' if filetype == UBI_EC_HDR_MAGIC else 'UBIFS',
+                                                                      loc, end_offset, block_size))
+        regions.append(Region(start_offset=loc, end_offset=end_offset, filetype=filetype, block_size=block_size))
+
+    return regions
+
+
+def _find_candidates(buf: mmap.mmap, guess_offset: int) -> list[tuple[int, bytes, Any]]:
+    """Valid EC headers and UBIFS superblock nodes in offset order."""
+    candidates = []
+
+    loc = buf.find(UBI_EC_HDR_MAGIC, guess_offset)
+    while loc != -1:
+        if _valid_ec_hdr(buf, loc):
+            candidates.append((loc, UBI_EC_HDR_MAGIC, None))
+        loc = buf.find(UBI_EC_HDR_MAGIC, loc + 1)
+
+    loc = buf.find(UBIFS_NODE_MAGIC, guess_offset)
+    while loc != -1:
+        if _valid_ubifs_node(buf, loc, UBIFS_SB_NODE):
+            sb_start = loc + UBIFS_COMMON_HDR_SZ
+            sbn = nodes.sb_node(buf[sb_start:sb_start + UBIFS_SB_NODE_SZ])
+            if sbn.leb_size and sbn.leb_cnt:
+                candidates.append((loc, UBIFS_NODE_MAGIC, sbn))
+        loc = buf.find(UBIFS_NODE_MAGIC, loc + 1)
+
+    candidates.sort(key=lambda c: c[0])
+    return candidates
+
+
+def _process_region(func: Callable[..., Any], options: dict[str, Any], path: str, region: Region, *args: Any) -> Any:
+    """Run func on a region in a worker process, with settings of the parent."""
+    for key, value in options.items():
+        setattr(settings, key, value)
+    return func(path, region, *args)
+
+
+def process_regions(func: Callable[..., Any], path: str, regions: list[Region], *args: Any) -> list[Any]:
+    """Run func(path, region, *args) for every region
 
-    most_frequent = 0
-    block_size = None
+    Arguments:
+    Func:func       -- Module level function processing one region.
+    Str:path        -- Path to file.
+    List:regions    -- Regions from find_regions.
+    *args           -- Passed on to func.
 
-    for offset in occurrences:
-        if occurrences[offset] > most_frequent:
-            most_frequent = occurrences[offset]
-            block_size = offset
+    Returns:
+    List            -- Results of func, in region order.
 
-    return block_size
\ No newline at end of file
+    Regions are processed in settings.region_workers processes,
+    or in this process if it is 0.
+    """
+    if settings.region_workers < 1 or len(regions) < 2:
+        return [func(path, region, *args) for region in regions]
+
+    log(process_regions, 'Processing %s regions with %s workers' % (len(regions), settings.region_workers))
+    options = {key: value for key, value in vars(settings).items() if not key.startswith('_')}
+    with ProcessPoolExecutor(settings.region_workers) as executor:
+        futures = [executor.submit(_process_region, func, options, path, region, *args) for region in regions]
+        return [future.result() for future in futures]